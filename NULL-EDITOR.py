@@ -19,10 +19,51 @@
 # along with 'null.'  If not, see <https://www.gnu.org/licenses/>.
 
 
+
 from tkinter import *
 from tkinter import ttk
 from tkinter import messagebox
 import tkinter.scrolledtext as tkst
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import zlib
+
+from null_core import (INDEX_STEP_SIZE, JOURNAL_COMPACT_SIZE,
+                       JOURNAL_INTERVAL, STATS_LOG, WATCHDOG_INTERVAL,
+                       CommandError, CommandTable, EditHistory, LatencyStats,
+                       ListImport, PagedFile, Session, Snapshot,
+                       StallWatchdog, check_text_file, file_stat, format_size,
+                       open_journal, quote_word, read_files, save_document,
+                       snapshot_chunks, split_command, write_atomic)
+
+
+# Files are imported, and long pastes inserted, to the main frame in slices of
+# this many characters, so that the mainloop gets to handle events between the
+# slices.
+
+INSERT_CHUNK_SIZE = 256 * 1024
+
+# Files larger than this are opened in the read-only viewer mode, which keeps
+# only VIEW_PAGES pages of the file in the main frame instead of importing it
+# all.
+
+LARGE_FILE_SIZE = 64 * 1024 * 1024
+VIEW_PAGES = 3
+
+# The ITEM LIST shows this many more top level items each time it is scrolled
+# to the bottom.
+
+TREE_PAGE_SIZE = 200
+
+# The ITEM VIEWER shows this many characters of each item until the item is
+# expanded. Selection changes closer than SELECT_DELAY milliseconds apart are
+# shown once.
+
+PREVIEW_SIZE = 2000
+SELECT_DELAY = 50
 
 
 def validation(default_entry):
@@ -43,18 +84,21 @@ class Interface:
     All the functions in the program are executed within the class.
 
     """
-    def __init__(self):
+    def __init__(self, snapshot=None):
         """The constructor used to create the interface.
 
         The constructor defines the widgets in the interface and other most
-        important attributes of the program
+        important attributes of the program. If a snapshot file is given, the
+        session in it is restored.
 
         :param self.__main_default_trigger: bool: Trigger used to make the
         default text in the main frame disappear after clicking it.
-        :param self.__item_container: dict: A dictionary that holds parts of
-        the text stored in the item list.
-        :param self.__command_list: dict: Dictionary of the commands and the
-        functions they call when they are executed.
+        :param self.__session: Session: The document and the item list,
+        without the window.
+        :param self.__item_container: ItemStore: The store that holds parts of
+        the text saved in the item list.
+        :param self.__commands: CommandTable: The commands, the functions they
+        call when they are executed and the form of their arguments.
 
         """
         # Create the root that contains other widgets. Make the window non-
@@ -66,14 +110,30 @@ class Interface:
         command_validate = self.__root.register(validation)
         self.__root.resizable(width=False, height=False)
 
+        # The commands and the key binding handlers are timed, and the
+        # timings can be shown with "-stats".
+
+        self.__stats = LatencyStats()
+        timed = self.__stats.timed
+
+        # A watchdog reports when the event loop is blocked, and which method
+        # was running.
+
+        self.__watchdog = StallWatchdog(Interface)
+        self.__watchdog.start()
+        self.__root.after(WATCHDOG_INTERVAL, self.watchdog_tick)
+
         # Bind the commands that are not widget specific, so they can be used
         # anywhere in the program, not just when focus is on the widget.
 
-        self.__root.bind("<Control-l>", self.move_item_bind)
-        self.__root.bind("<Alt-l>", self.next_item_bind)
-        self.__root.bind("<Control-m>", self.tabulate)
-        self.__root.bind("<Control-q>", self.delete_bind)
-        self.__root.bind("<Control-r>", self.detach)
+        self.__root.bind("<Control-l>", timed(self.move_item_bind))
+        self.__root.bind("<Alt-l>", timed(self.next_item_bind))
+        self.__root.bind("<Control-m>", timed(self.tabulate))
+        self.__root.bind("<Control-q>", timed(self.delete_bind))
+        self.__root.bind("<Control-r>", timed(self.detach))
+        self.__root.bind("<Alt-t>", timed(self.move_top_bind))
+        self.__root.bind("<Alt-b>", timed(self.move_bottom_bind))
+        self.__root.bind("<Escape>", timed(self.cancel_import))
 
         # The style module is used to create the style for the Treeview widget
         # because it could not be styled with the configure method directly.
@@ -90,17 +150,78 @@ class Interface:
                                     selectbackground="#FFBE33",
                                     inactiveselectbackground="#FFCF66")
 
+        # The state of the imports, the pastes and the viewer mode is read by
+        # the proxy below, so it is set before any text is inserted.
+
+        self.__import_file = None
+        self.__import_job = None
+        self.__list_import = None
+        self.__list_job = None
+        self.__paste_job = None
+        self.__view = None
+        self.__view_page = 0
+        self.__view_lines = []
+
+        # Tk 8.6 counts a character outside the Basic Multilingual Plane, like
+        # an emoji, as two columns in the indexes. Once such a character is
+        # in the text, the columns are converted by counting the characters.
+
+        self.__astral = False
+
+        # The text in the main frame is kept in the document model of the
+        # session. The widget command is renamed and replaced with a proxy,
+        # which passes the commands on to the widget and applies the edits to
+        # the model too.
+
+        self.__session = Session()
+        self.__document = self.__session.document
+        self.__main_command = self.__main_frame._w + "_widget"
+        self.__root.tk.call("rename", self.__main_frame._w,
+                            self.__main_command)
+        self.__root.tk.createcommand(self.__main_frame._w,
+                                     self.main_frame_proxy)
+
+        # The edits are also recorded in the undo history. Edits made with
+        # the same group, like the slices of a paste, are undone together.
+
+        self.__history = EditHistory()
+        self.__edit_group = None
+        self.__history_paused = False
+
+        # The edits are journaled so the text can be recovered after a crash.
+        # If the last session did not end normally, its text is shown instead
+        # of the default text. Each editor running in the folder has a
+        # journal of its own.
+
+        self.__journal = open_journal()
+        recovered = self.__journal.recover()
+
         # Default text is displayed in the main frame on startup, and clears
         # when the text widget is clicked. The trigger determines when the text
         # is displayed and should be destroyed.
 
         self.__main_default_trigger = False
-        self.main_frame_default()
+        default_file = open("default_main.txt", "r")
+        default_text = default_file.read()
+        default_file.close()
+        if recovered is not None and len(recovered) and (
+                recovered.text() != default_text):
+            self.__main_frame.insert(1.0, recovered.text())
+            self.__main_frame.mark_set(INSERT, 1.0)
+            self.__history.clear()
+        else:
+            recovered = None
+            self.main_frame_default()
+        self.__journal.start(self.__document.copy())
+        self.__root.after(JOURNAL_INTERVAL, self.journal_tick)
 
         # Define bindings for the main frame widget and the grid placement.
 
         self.__main_frame.bind("<FocusIn>", self.main_default_destroy)
-        self.__main_frame.bind("<Control-j>", self.paste_bind)
+        self.__main_frame.bind("<Control-j>", timed(self.paste_bind))
+        self.__main_frame.bind("<Control-z>", timed(self.undo))
+        self.__main_frame.bind("<Control-y>", timed(self.redo))
+        self.__main_frame.bind("<Control-Z>", timed(self.redo))
         self.__main_frame.grid(row=0, column=1)
 
         # A Treeview widget is used to show the items that have been saved.
@@ -109,10 +230,14 @@ class Interface:
         self.__tree = ttk.Treeview(self.__root, height=19)
         self.__tree.heading("#0", text="ITEM LIST", anchor=CENTER)
 
-        # Define bindings and the grid placement for the treeview.
+        # Define bindings and the grid placement for the treeview. The rows
+        # are added as they are needed: when the list is scrolled down and
+        # when a parent is opened.
 
-        self.__tree.bind("<Control-j>", self.paste_bind)
-        self.__tree.bind("<<TreeviewSelect>>", self.show_selection)
+        self.__tree.bind("<Control-j>", timed(self.paste_bind))
+        self.__tree.bind("<<TreeviewSelect>>", timed(self.show_selection))
+        self.__tree.bind("<<TreeviewOpen>>", timed(self.tree_open))
+        self.__tree.configure(yscrollcommand=self.tree_scroll)
         self.__tree.grid(row=0, column=0)
 
         # Create two buttons, for clearing the text in the main and side frame.
@@ -126,29 +251,86 @@ class Interface:
         self.__button.grid(row=6, column=5)
 
         # Create an Entry widget for inputting commands. Set the style, the
-        # default symbol, and set the focus to this widget when starting.
+        # default symbol, and set the focus to this widget when starting. The
+        # selection of the command box is not exported, because the suggested
+        # item names are selected, and that must not take the selection away
+        # from the main frame.
 
         self.__command_box = Entry(self.__root, width=80, validate="key",
-                                   validatecommand=(command_validate, "%P"))
+                                   validatecommand=(command_validate, "%P"),
+                                   exportselection=False)
         self.__command_box.configure(foreground="#FFB000",
                                      background="#282828",
                                      insertbackground="#FFB000", insertwidth=3,
                                      selectbackground="#FFBE33")
         self.__command_box.insert(1, "ᴧ ")
+        self.__print_job = None
+        if recovered is not None:
+            self.command_print("Recovered {:d} characters of unsaved text."
+                               .format(len(recovered)))
         self.__command_box.bind("<Return>", self.command_call)
+
+        # Item names are suggested while they are typed, and completed with
+        # Tab.
+
+        self.__suggestion = None
+        self.__completion = None
+        self.__command_box.bind("<KeyRelease>", timed(self.suggest_name))
+        self.__command_box.bind("<Tab>", timed(self.complete_name))
         self.__command_box.focus_set()
         self.__command_box.grid(row=6, column=1)
 
-        # Create a dictionary to hold the saved texts and an other to hold the
-        # commands and functions they are used to call.
-
-        self.__item_container = {}
-        self.__command_list = {"-s": self.save_item, "-j": self.paste,
-                               "-cs": self.save_child, "-q": self.delete_item,
-                               "-l": self.move_item, "-quit": self.quit,
-                               "-ex": self.save_main, "-im": self.open_main,
-                               "-gg": self.clear_main_frame,
-                               "-help": self.help}
+        # Show the items of the session in the Treeview. Then create a
+        # dictionary to hold the commands and functions they are used to call.
+
+        self.__item_container = self.__session.items
+        self.__item_tree = self.__session.tree
+
+        self.__tree_rows = set()
+        self.__tree_opened = set()
+        self.__tree_shown = TREE_PAGE_SIZE
+        self.render_tree("")
+
+        self.__saving = False
+
+        # Texts restored from a snapshot, also in an earlier run, are added
+        # to the search index in the background.
+
+        self.__index_job = None
+        self.index_step()
+        self.__saved_files = {}
+        self.__background_jobs = 0
+        self.__background_results = queue.Queue()
+        self.__recording = None
+        self.__command_failed = False
+        self.__commands = CommandTable()
+        self.__commands.add(self.save_item, "-s /item_name/")
+        self.__commands.add(self.paste, "-j /item_name/")
+        self.__commands.add(self.save_child, "-cs -/parent/ /item_name/")
+        self.__commands.add(self.delete_item, "-q /item_name/")
+        self.__commands.add(self.move_item, "-l -/item_name/")
+        self.__commands.add(self.quit, "-quit y /filename.txt/", "-quit n")
+        self.__commands.add(self.save_main, "-ex /filename.txt/")
+        self.__commands.add(self.open_main, "-im [-v] /filename.txt/")
+        self.__commands.add(self.import_files,
+                            "-imall /pattern/ [/delimiter/]")
+        self.__commands.add(self.export_list, "-exlist /filename/")
+        self.__commands.add(self.import_list, "-imlist /filename/")
+        self.__commands.add(self.clear_main_frame, "-gg")
+        self.__commands.add(self.memory_report, "-mem [top]")
+        self.__commands.add(self.search, "-f /word/...")
+        self.__commands.add(self.bulk_delete, "-qq [/pattern/]")
+        self.__commands.add(self.bulk_move,
+                            "-mv top|bottom|-/parent/ [/pattern/]")
+        self.__commands.add(self.save_session, "-snap /filename.snap/")
+        self.__commands.add(self.restore_session, "-rest /filename.snap/")
+        self.__commands.add(self.select_text,
+                            "-sel /line.column/ /line.column/")
+        self.__commands.add(self.record_macro, "-rec /macro_name/")
+        self.__commands.add(self.end_macro, "-end")
+        self.__commands.add(self.play_macro, "-play /macro_name/")
+        self.__commands.add(self.show_stats, "-stats [log|reset]")
+        self.__commands.add(self.help, "-help")
 
         # Create another Text widget with a scrollbar to the side, this is used
         # to display the saved items, selected from the Treeview.
@@ -166,11 +348,31 @@ class Interface:
         self.__side_frame.bind("<FocusIn>",
                                lambda e: self.__command_box.focus())
         self.__side_frame.config(insertwidth=0)
+
+        # Long items are shown cut, followed by a link that expands them.
+
+        self.__side_frame.tag_configure("expand", foreground="#FFCF66",
+                                        underline=True)
+        self.__side_frame.tag_bind("expand", "<Button-1>",
+                                   self.expand_preview)
+        self.__selection_job = None
+        self.__preview_names = []
+        self.__preview_expanded = set()
         self.__side_frame.grid(row=0, column=5)
 
-        # Enclose the structure in the mainloop.
+        # Restore the snapshot given on the command line, unless unsaved text
+        # was just recovered, which would be lost.
+
+        if snapshot is not None and recovered is None:
+            self.restore_snapshot(snapshot)
+
+        # Enclose the structure in the mainloop. When the window is closed
+        # normally, the journal is no longer needed.
 
         self.__root.mainloop()
+        self.__journal.close(True)
+        self.__stats.close_log()
+        self.__watchdog.close()
 
     def command_print(self, text):
         """Used to print information in the command box.
@@ -183,8 +385,262 @@ class Interface:
 
         self.__command_box.delete(2, END)
         self.__command_box.insert(2, text)
-        self.__command_box.after(1500,
-                                 lambda: self.__command_box.delete(2, END))
+
+        # Cancel the clearing of an earlier notification, so that notifications
+        # printed in quick succession (like import progress) do not get erased
+        # too early.
+
+        if self.__print_job is not None:
+            self.__command_box.after_cancel(self.__print_job)
+        self.__print_job = self.__command_box.after(1500, self.command_clear)
+
+    def command_error(self, text):
+        """Print an error notification in the command box.
+
+        The command being run is marked as failed, so it is not recorded into
+        a macro.
+
+        """
+
+        self.__command_failed = True
+        self.command_print(text)
+
+    def command_clear(self):
+        """Clear the notification printed with command_print.
+
+        """
+
+        self.__print_job = None
+        self.__command_box.delete(2, END)
+
+    def main_frame_proxy(self, *args):
+        """Run a main frame widget command and apply edits to the document.
+
+        Called by Tk for every command of the main frame widget, including
+        the ones from typing and the default key bindings.
+
+        """
+
+        call = self.__root.tk.call
+        widget = self.__main_command
+        operation = args[0] if args else ""
+
+        # Commands that do not change the text are passed on directly. A
+        # disabled widget ignores edits, so they are passed on too.
+
+        if operation not in ("insert", "delete", "replace"):
+            return call(widget, *args)
+        if str(call(widget, "cget", "-state")) == "disabled":
+            return call(widget, *args)
+
+        # The indexes are resolved before the edit, because marks like
+        # "insert" move when the text changes.
+
+        if operation == "insert":
+            offset = self.document_offset(args[1])
+            result = call(widget, *args)
+            self.document_insert(offset, "".join(args[2::2]))
+
+        elif operation == "delete" and len(args) <= 3:
+            start = self.document_offset(args[1])
+            if len(args) == 3:
+                end = self.document_offset(args[2])
+            else:
+                end = start + 1
+            result = call(widget, *args)
+            self.document_delete(start, end)
+
+        elif operation == "replace":
+            start = self.document_offset(args[1])
+            end = self.document_offset(args[2])
+            result = call(widget, *args)
+            self.document_delete(start, end)
+            self.document_insert(start, "".join(args[3::2]))
+
+        # Deleting several ranges at once is rare, so the document is just
+        # read again from the widget. The history cannot follow it.
+
+        else:
+            result = call(widget, *args)
+            text = call(widget, "get", "1.0", "end - 1 chars")
+            self.__document.reset(text)
+            self.__astral = bool(text) and max(text) > "\uffff"
+            self.__history.clear()
+            if self.__view is None:
+                self.__journal.snapshot(self.__document.copy())
+
+        return result
+
+    def document_insert(self, offset, text):
+        """Insert text to the document and record it in the undo history.
+
+        """
+
+        self.__document.insert(offset, text)
+        if text and max(text) > "\uffff":
+            self.__astral = True
+        if not text or self.__view is not None:
+            return
+
+        self.__journal.insert(offset, text)
+        if not self.__history_paused:
+            self.__history.record("insert", offset,
+                                  [(text, 0, len(text), text.count("\n"))],
+                                  self.__edit_group)
+
+    def document_delete(self, start, end):
+        """Delete text from the document and record it in the undo history.
+
+        """
+
+        removed = self.__document.delete(start, end)
+        if len(self.__document) == 0:
+            self.__astral = False
+        if not removed or self.__view is not None:
+            return
+
+        self.__journal.delete(start, end)
+        if not self.__history_paused:
+            self.__history.record("delete", start, removed, self.__edit_group)
+
+    def watchdog_tick(self):
+        """Tell the watchdog the event loop is running, and report a stall if
+        the loop was blocked. Runs every WATCHDOG_INTERVAL milliseconds.
+
+        """
+
+        stall = self.__watchdog.beat()
+        if stall is not None:
+            method = self.__watchdog.report(*stall)
+            self.command_print("The window was blocked for {:.1f} s{:s}."
+                               .format(stall[0], "" if method is None else
+                                       " in " + method))
+        self.__root.after(WATCHDOG_INTERVAL, self.watchdog_tick)
+
+    def journal_tick(self):
+        """Compact the journal when it has grown large, and report if it
+        could not be written. Runs every JOURNAL_INTERVAL milliseconds.
+
+        """
+
+        journal = self.__journal
+        if journal.error is not None:
+            self.command_print("Journal could not be written: {:s}".format(
+                journal.error.strerror or str(journal.error)))
+            return
+
+        if (self.__view is None and journal.size > JOURNAL_COMPACT_SIZE
+                and journal.size > len(self.__document)):
+            journal.snapshot(self.__document.copy())
+        self.__root.after(JOURNAL_INTERVAL, self.journal_tick)
+
+    def document_index(self, offset, document=None):
+        """Convert an offset in the document, or in a copy of it that matches
+        the main frame, to a main frame index.
+
+        """
+
+        if document is None:
+            document = self.__document
+        line, column = document.position(offset)
+        if self.__astral:
+            prefix = document.text(offset - column, offset)
+            column += sum(1 for character in prefix if character > "\uffff")
+        return "{:d}.{:d}".format(line, column)
+
+    def undo(self, event=None):
+        """Undo the last edit in the main frame.
+
+        Use Control + z. Text typed or erased in one go, and each paste,
+        import and clear, are undone as one edit.
+
+        """
+
+        # The entry is only taken from the history when the edits can be
+        # applied, so it is not lost while the main frame is busy.
+
+        if self.history_blocked():
+            return "break"
+        edits = self.__history.undo()
+        if edits is None:
+            self.command_print("Nothing to undo.")
+        else:
+            self.apply_edits(reversed(edits), True)
+        return "break"
+
+    def redo(self, event=None):
+        """Redo the last undone edit in the main frame.
+
+        Use Control + y or Control + Shift + z.
+
+        """
+
+        if self.history_blocked():
+            return "break"
+        edits = self.__history.redo()
+        if edits is None:
+            self.command_print("Nothing to redo.")
+        else:
+            self.apply_edits(edits, False)
+        return "break"
+
+    def history_blocked(self):
+        """Return True and show a notification if the undo history cannot be
+        applied now, because of the viewer mode or a paste in progress.
+
+        """
+
+        if self.view_read_only():
+            return True
+        if self.__paste_job is not None:
+            self.command_error("Still pasting. Try again soon.")
+            return True
+        return False
+
+    def apply_edits(self, edits, undo):
+        """Apply recorded edits to the main frame, or reverse them when
+        undoing, and move the insert cursor to the last edit. The caller
+        checks history_blocked first.
+
+        """
+
+        self.stop_import()
+
+        # The edits are made through the proxy, so the document follows, but
+        # they are not recorded again.
+
+        self.__history_paused = True
+        try:
+            for kind, offset, pieces, length in edits:
+                if (kind == "insert") == undo:
+                    self.__main_frame.delete(self.document_index(offset),
+                                             self.document_index(
+                                                 offset + length))
+                    cursor = offset
+                else:
+                    self.__main_frame.insert(
+                        self.document_index(offset),
+                        "".join(text[start:end]
+                                for text, start, end, count in pieces))
+                    cursor = offset + length
+        finally:
+            self.__history_paused = False
+
+        self.__main_frame.mark_set(INSERT, self.document_index(cursor))
+        self.__main_frame.see(INSERT)
+
+    def document_offset(self, index):
+        """Convert a main frame index to an offset in the document.
+
+        """
+
+        call = self.__root.tk.call
+        position = str(call(self.__main_command, "index", index))
+        line, column = position.split(".")
+        if self.__astral:
+            column = len(call(self.__main_command, "get", line + ".0",
+                              position))
+        return self.__document.offset(int(line), int(column))
 
     def tabulate(self, event):
         """Tabulate between the main frame and the command box.
@@ -208,7 +664,7 @@ class Interface:
         else:
             self.__command_box.focus()
 
-    def save_item(self):
+    def save_item(self, name):
         """Save item to the Treeview item list.
 
         Works by first selecting text in the main frame, then typing "-s
@@ -216,20 +672,7 @@ class Interface:
 
         """
 
-        # Get the line input by the user, to check the command was valid and
-        # to get the item name used for saving.
-
-        line = self.__command_box.get()
-
         try:
-            line_list = line.split()
-
-            # If the line contains too many words, the syntax is incorrect, so
-            # an error will be raised.
-
-            if len(line_list) != 3:
-                raise IndexError
-
             # Get the selected text and check the lenght. If nothing is
             # selected, raise an error.
 
@@ -237,30 +680,22 @@ class Interface:
             if len(selection) == 0:
                 raise TclError
 
-            # Check the Treeview does not already contain another item with
-            # the same name. If needed, print an error notification and return.
-
-            if self.__tree.exists(line_list[2]):
-                self.command_print("Can't save same name twice.")
-                return
-
-            # Insert an entry in the Treeview with the selected name as the
-            # text and the item id. Then save the selected text to the
-            # dictionary, with the name as key. Finally clear the command box.
+            # Save the item in the session, which checks that there is not
+            # another item with the same name. Then show it in the Treeview and
+            # clear the command box.
 
-            self.__tree.insert("", END, iid=line_list[2], text=line_list[2])
-            self.__item_container[line_list[2]] = selection
+            self.__session.add_item(name, "", selection)
+            self.render_tree("")
             self.__command_box.delete(2, END)
 
         # Excepts used to catch errors and print error notifications.
 
+        except CommandError as error:
+            self.command_error(str(error))
         except TclError:
-            self.command_print("No selection. Select text in main frame.")
-        except IndexError:
-            self.command_print("Incorrect syntax. Use form '-s"
-                               " /item_name/'")
+            self.command_error("No selection. Select text in main frame.")
 
-    def save_child(self):
+    def save_child(self, parent, name):
         """Save selected text a an child item in the Treeview.
 
             The command to save a child is: "-cs -*parent* *filename*". Again,
@@ -268,81 +703,46 @@ class Interface:
 
         """
 
-        # Get the line input by the user to check it is valid.
-
-        line = self.__command_box.get()
         try:
-            line_list = line.split()
-            parent = line_list[2][1:]
-
-            # If line does not have 4 words (including the default symbol), the
-            # syntax is wrong, and a error will be raised. Also check that the
-            # parent exists in the Treeview, and that there is not another item
-            # with the same name. Raise errors if necessary.
+            # Check that the parent exists in the Treeview. The session checks
+            # that there is not another item with the same name.
 
-            if len(line_list) != 4:
-                raise IndexError
-            if not self.__tree.exists(parent):
+            if parent not in self.__item_tree:
                 raise TypeError
-            if self.__tree.exists(line_list[3]):
-                self.command_print("Cannot use same name twice.")
-                return
 
-            # Get the selected text. Insert the item to the Treeview and save
-            # the text to the container. Finally clear the command box.
+            # Get the selected text and save the item in the session. Then
+            # show it in the Treeview and clear the command box.
 
             selection = self.__main_frame.selection_get()
-            self.__tree.insert(parent, 1, iid=line_list[3], text=line_list[3])
-            self.__item_container[line_list[3]] = selection
+            self.__session.add_item(name, parent, selection)
+            self.render_tree(parent)
             self.__command_box.delete(2, END)
 
         # Excepts used to catch errors and print error notifications.
 
-        except ValueError:
-            self.command_print("Too many arguments. Try '-cs -/parent/ "
-                               "/item_name/'.")
+        except CommandError as error:
+            self.command_error(str(error))
         except TclError:
-            self.command_print("No selection. Select text in main frame.")
-        except IndexError:
-            self.command_print("Incorrect syntax. Use form '-cs -/parent/ "
-                               "/item_name/'")
+            self.command_error("No selection. Select text in main frame.")
         except TypeError:
-            self.command_print("Parent not found. Try again.")
+            self.command_error("Parent not found. Try again.")
 
-    def delete_item(self):
+    def delete_item(self, item_id):
         """Delete an item from the Treeview item list.
 
         Uses the command "-q *item_name*". Deletes the item from the list and
-        the text from the item_container dictionary.
+        the text from the item store.
 
         """
 
-        # Get the line and split to a list to perform necessary inspections.
-
-        line = self.__command_box.get()
-        try:
-            line_list = line.split()
-            item_id = line_list[2]
-
-            # If the line does not contain 3 words, the syntax is wrong.
-
-            if len(line_list) != 3:
-                raise IndexError
-
-            # Delete the saved text from the item_container and from the
-            # Treeview,
+        # Delete the item and its children from the tree model, the Treeview,
+        # and the saved texts from the item store.
 
-            del self.__item_container[item_id]
-            self.__tree.delete(item_id)
-            self.__command_box.delete(2, END)
-
-        # Except used to catch the errors.
-
-        except IndexError:
-            self.command_print("Incorrect syntax. Use form '-q "
-                               "/item_name/'")
-        except TclError:
-            self.command_print("Item not found. Try again.")
+        if item_id not in self.__item_tree:
+            self.command_error("Item not found. Try again.")
+            return
+        self.delete_items([item_id])
+        self.__command_box.delete(2, END)
 
     def delete_bind(self, event):
         """Keyboard shortcut for the delete command.
@@ -352,399 +752,842 @@ class Interface:
 
         """
 
-        # Get a list of all the selected items in the Treeview widget. Create
-        # two new lists for the items that are parents, and for children.
-
-        current = self.__tree.selection()
-        children = []
-        parents = []
-
-        # Iterate over the selected items and save all children and parent
-        # items in their respective lists.
+        # Delete all the selected items in the Treeview widget at once.
 
-        for item in current:
-            if self.__tree.parent(item) != "":
-                children.append(item)
-            else:
-                parents.append(item)
+        self.delete_items(self.selected_items())
+        self.__command_box.delete(2, END)
 
-        # Iterate over the children list, delete them from the Treeview and
-        # from the item container.
+    def delete_items(self, names):
+        """Delete many items and their children at once.
 
-        for child in children:
-            self.__tree.delete(child)
-            del self.__item_container[child]
+        The items are removed from the tree model, then from the Treeview
+        with one call and from the item store in one transaction.
 
-        # Now delete the parents. Children are deleted first, because otherwise
-        # if both parent and child are selected, it would cause errors.
+        """
 
-        for parent in parents:
-            self.__tree.delete(parent)
-            del self.__item_container[parent]
+        if len(names) == 0:
+            return
 
-        self.__command_box.delete(2, END)
+        # Delete the rows of the removed items, including the rows of
+        # children of parents that were never opened. Then fill the shown
+        # part of the list again.
+
+        parents = {self.__item_tree.parent(name) for name in names}
+        removed = self.__session.remove_items(names)
+        rows = [name for name in removed if name in self.__tree_rows]
+        rows += ["\t" + name for name in removed
+                 if "\t" + name in self.__tree_rows]
+        if rows:
+            self.__tree.delete(*rows)
+        self.__tree_rows.difference_update(rows)
+        self.__tree_opened.difference_update(removed)
+        self.render_tree("", *(parents - set(removed) - {""}))
 
         # Clear text from the side frame if the list is empty after deleting
-        # selected items.
+        # the items.
 
-        if len(self.__tree.get_children()) == 0:
+        if len(self.__item_tree) == 0:
             self.__side_frame.delete(1.0, END)
 
-    def command_call(self, event):
-        """The function used to read the command line and start a function.
+    def move_items(self, names, where):
+        """Move many items at once. Return the number of items moved.
 
-        """
+        The where argument is "top" or "bottom" to move the items to the top
+        or the bottom among their siblings, or the name of a parent to move
+        the items under. Each changed list of children is set in the Treeview
+        with one call and saved in the item store in one transaction.
 
-        # Get the line, split to a list, compile a list of all commands in the
-        # command list.
+        """
 
-        line = self.__command_box.get()
-        commands = [key for key in self.__command_list]
-        linelist = line.split()
-        prompt = linelist[1]
+        names = sorted(names, key=self.__item_tree.tree_order)
+        groups = {}
 
-        # Check the syntax and that the command is in the command list. If
-        # nothing is wrong, call the function.
+        if where in ("top", "bottom"):
+            for name in names:
+                parent = self.__item_tree.parent(name)
+                groups.setdefault(parent, []).append(name)
+        else:
 
-        if len(linelist) < 2:
-            self.command_print("Unknown command. Type '-help' for a list of "
-                               "commands.")
-            return
+            # Only two levels are allowed, so items that have children are
+            # not moved under a parent.
 
-        if prompt not in commands:
-            self.command_print("Unknown command. Type '-help' for a list of "
-                               "commands.")
-        else:
-            self.__command_list[prompt]()
+            groups[where] = [name for name in names if name != where
+                             and len(self.__item_tree.children(name)) == 0]
 
-    def paste(self):
-        """"Paste items selected in the Treeview to the main frame.
+        index = 0 if where == "top" else None
+        changed = set()
+        for parent, group in groups.items():
+            changed |= self.__item_tree.move_many(group, parent, index)
 
-        Use the command "-j /item_name/". You can paste multiple items by
-        typing ":" between the items you want to paste. For example:
-        "-j item1:item2".
+        self.__item_container.set_orders(
+            {parent: (self.__item_tree.children(parent), 0)
+             for parent in changed})
+        self.render_tree(*changed)
+        return sum(len(group) for group in groups.values())
 
-        NOTE: If you paste multiple items. The contents will be separated by a
-        newline character.
+    def pattern_items(self, pattern):
+        """Return the items matching the pattern, or the selected items if
+        the pattern is None.
 
         """
 
-        # Get the line and split into list to check the syntax.
+        if pattern is None:
+            return self.selected_items()
+        return self.__item_tree.match(pattern)
 
-        line = self.__command_box.get()
-
-        try:
-            line_list = line.split()
+    def selected_items(self):
+        """Return the items selected in the Treeview.
 
-            # If the line does not have three words, syntax is wrong.
+        """
 
-            if len(line_list) != 3:
-                raise IndexError
+        return [name for name in self.__tree.selection()
+                if name in self.__item_tree]
 
-            # Check if there is multiple items to paste by checking if the
-            # string contains ":". If it does, split by ":", and iterate over
-            # the list, getting the contents out of the item container and
-            # inserting to the main frame.
+    def render_tree(self, *parents):
+        """Update the rows of the Treeview under the parents to match the
+        tree model.
 
-            if ":" in line_list[2]:
-                add_items = line_list[2].split(":")
-                for item in add_items:
-                    paste_text = self.__item_container[item]
-                    self.__main_frame.insert(INSERT, paste_text + "\n")
+        Only the first self.__tree_shown items of the top level, and the
+        children of opened parents have rows. A parent that has not been
+        opened gets a placeholder row, so it can be opened. The rows are made
+        when they are first shown, and put in order with one call for each
+        parent. Rows that are no longer shown are detached, not deleted.
 
-            # If there was only one item to paste, do the same for that item.
+        """
 
+        for parent in parents:
+            if parent == "":
+                shown = self.__item_tree.children()[:self.__tree_shown]
+            elif parent in self.__tree_opened and parent in self.__item_tree:
+                shown = self.__item_tree.children(parent)
             else:
-                paste_text = self.__item_container[line_list[2]]
-                self.__main_frame.insert(INSERT, paste_text)
-            self.__command_box.delete(2, END)
+                if parent in self.__tree_rows:
+                    self.tree_placeholder(parent)
+                continue
 
-        # Excepts used to catch any errors.
+            for name in shown:
+                if name not in self.__tree_rows:
+                    self.__tree.insert(parent, END, iid=name, text=name)
+                    self.__tree_rows.add(name)
+                self.tree_placeholder(name)
+            self.__tree.set_children(parent, *shown)
 
-        except KeyError:
-            self.command_print("Undefined function. See side frame for a list"
-                               " of saved functions.")
-        except IndexError:
-            self.command_print("Incorrect syntax. Use form '-j "
-                               "/function_name/'")
+    def tree_placeholder(self, name):
+        """Add or remove the placeholder row of an item that has not been
+        opened, depending on whether the item has children.
 
-    def paste_bind(self, event):
-        """Keyboard shortcut for the paste function.
+        """
 
-        Use Control + j to paste after selecting items from the Treeview. NOTE:
-        When pasting multiple things, a newline will be added between items.
+        if name in self.__tree_opened:
+            return
 
-        """
+        placeholder = "\t" + name
+        has_children = len(self.__item_tree.children(name)) > 0
+        if has_children and placeholder not in self.__tree_rows:
+            self.__tree.insert(name, END, iid=placeholder, text="...")
+            self.__tree_rows.add(placeholder)
+        elif not has_children and placeholder in self.__tree_rows:
+            self.__tree.delete(placeholder)
+            self.__tree_rows.discard(placeholder)
 
-        # Get a list of items selected in the Treeview item list. Then iterate
-        # over the list and fetch the text from the item container, and paste
-        # in the insert cursors place.
+    def tree_open(self, event):
+        """Show the children of a parent when it is opened.
 
-        current = self.__tree.selection()
-        for item in current:
-            paste_text = self.__item_container[item]
-            self.__main_frame.insert(INSERT, paste_text + "\n")
+        """
 
-    def move_item(self):
-        """Move selected item one step up in the Treeview widget.
+        self.open_parent(self.__tree.focus())
 
-        Note: Cannot move multiple items at the same time.
+    def open_parent(self, parent):
+        """Make rows for the children of a parent in place of the
+        placeholder.
 
         """
 
-        # Get the line and split it to check the syntax of the input and the
-        # name of the file to be moved.
+        if parent not in self.__item_tree or parent in self.__tree_opened:
+            return
 
-        line = self.__command_box.get()
-        try:
-            line_list = line.split()
-            item = line_list[2][1:]
+        placeholder = "\t" + parent
+        if placeholder in self.__tree_rows:
+            self.__tree.delete(placeholder)
+            self.__tree_rows.discard(placeholder)
+        self.__tree_opened.add(parent)
+        self.render_tree(parent)
 
-            # Raise error if length of the line is not 3 words.
+    def tree_scroll(self, first, last):
+        """Show more top level items when the list is scrolled to the end.
 
-            if len(line_list) != 3:
-                raise IndexError
+        """
 
-            # Check that the item length is not zero and that the item exists.
+        if (float(last) > 0.9
+                and self.__tree_shown < len(self.__item_tree.children())):
+            self.__tree_shown += TREE_PAGE_SIZE
+            self.render_tree("")
 
-            if len(item) < 1:
-                raise IndexError
-            if not self.__tree.exists(item):
-                self.command_print("Item not found. See list for saved items.")
-                return
+    def show_items(self, names):
+        """Make sure the items have rows in the Treeview, showing more of the
+        list and opening parents if needed.
 
-            # Get the index and the parent of the item.
+        """
 
-            index = self.__tree.index(item)
-            parent = self.__tree.parent(item)
+        needed = 0
+        parents = set()
+        for name in names:
+            parent = self.__item_tree.parent(name)
+            if parent == "":
+                needed = max(needed, self.__item_tree.index(name) + 1)
+            else:
+                needed = max(needed, self.__item_tree.index(parent) + 1)
+                parents.add(parent)
 
-            # If the item is on top of the list, move it to the bottom.
-            # Otherwise move it one step up. Finally clear the command box.
+        if needed > self.__tree_shown:
+            self.__tree_shown = needed
+            self.render_tree("")
 
-            if index == 0:
-                self.__tree.move(item, parent, END)
-            else:
-                self.__tree.move(item, parent, index - 1)
+        for parent in parents - self.__tree_opened:
+            self.open_parent(parent)
+            self.__tree.item(parent, open=True)
 
-            self.__command_box.delete(2, END)
+    def select_items(self, names):
+        """Select the items in the Treeview, making rows for them if needed.
 
-        # Except used to catch any errors.
+        """
 
-        except IndexError:
-            self.command_print("Incorrect syntax. Use form '-l "
-                               "-/function_name/'")
+        self.show_items(names)
+        self.__tree.selection_set(names)
 
-    def move_item_bind(self, event):
-        """Keyboard shortcut to move items in the Treeview item list.
+    def bulk_delete(self, pattern):
+        """Delete all items matching a pattern, or all selected items.
 
-        Use Control + l to move a selected item one step upwards.
+        Use the command "-qq /pattern/", where "*" matches any characters and
+        "?" one character, e.g: "-qq temp*". Without a pattern the selected
+        items are deleted.
 
         """
 
-        # Get a list of the selected items. and its index and parent item.
+        names = self.pattern_items(pattern)
+        self.delete_items(names)
+        self.command_print("{:d} items deleted.".format(len(names)))
 
-        try:
-            current = self.__tree.selection()
-            index = self.__tree.index(current)
-            parent = self.__tree.parent(current)
+    def bulk_move(self, where, pattern):
+        """Move all items matching a pattern, or all selected items.
 
-            # If item is on top of the list, move it to the end. Othetwise
-            # move the item one step upwards.
+        Use the command "-mv top /pattern/" or "-mv bottom /pattern/" to move
+        the items to the top or bottom of the list, and "-mv -/parent/
+        /pattern/" to make them children of the parent. Without a pattern the
+        selected items are moved.
 
-            if index == 0:
-                self.__tree.move(current, parent, END)
-            else:
-                self.__tree.move(current, parent, index - 1)
+        """
 
-        # Except used to catch any errors.
+        # The target must be top or bottom, or an item on the top level.
 
-        except TclError:
-            return
+        if where not in ("top", "bottom"):
+            if (where not in self.__item_tree
+                    or self.__item_tree.parent(where) != ""):
+                self.command_print("Parent not found. Try again.")
+                return
 
-    def next_item_bind(self, event):
-        """Keyboard shortcut to select the next item in the Treeview widget.
+        names = self.pattern_items(pattern)
+        moved = self.move_items(names, where)
+        self.command_print("{:d} items moved.".format(moved))
 
-        Use Alt + l to toggle the selected item in the item list.
+    def move_top_bind(self, event):
+        """Keyboard shortcut to move the selected items to the top.
+
+        Use Alt + t to move the selected items to the top of the list.
 
         """
 
-        # If the Treeview is empty, return. If nothing is selected, select the
-        # first item in the list.
+        self.move_items(self.selected_items(), "top")
 
-        if self.__tree.get_children() == "":
-            return
-        elif self.__tree.selection() == "":
-            self.__tree.selection_set(self.__tree.get_children()[0])
+    def move_bottom_bind(self, event):
+        """Keyboard shortcut to move the selected items to the bottom.
 
-        else:
-            try:
+        Use Alt + b to move the selected items to the bottom of the list.
 
-                # Get the current selected item, and its next sibling, parent,
-                # and the parents next sibling.
-
-                current = self.__tree.selection()
-                next_sibling = self.__tree.next(current)
-                parent = self.__tree.parent(current)
-                parent_sibling = self.__tree.next(parent)
-                tree_list = self.__tree.get_children()
-
-                # If the item has no parent, check if it has any children. If
-                # there is children, select the first child. Otherwise, if item
-                # has a next sibling, select it. Otherwise, if the item is last
-                # on the list, select the first item in the list.
-
-                if parent == "":
-                    if len(self.__tree.get_children(current)) > 0:
-                        children = self.__tree.get_children(current)
-                        self.__tree.selection_set(children[0])
-                    elif next_sibling != "":
-                        self.__tree.selection_set(next_sibling)
-                    elif next_sibling == "":
-                        self.__tree.selection_set(tree_list[0])
-
-                # If the item has a parent, check if there is a next sibling.
-                # If there is, select it. Or if the item is last, select the
-                # parent's next sibling. If the parent has no next sibling,
-                # select the first item of the list.
-
-                elif parent != "":
-                    if next_sibling != "":
-                        self.__tree.selection_set(next_sibling)
-                    if next_sibling == "":
-                        if self.__tree.next(parent) == "":
-                            self.__tree.selection_set(tree_list[0])
-                        else:
-                            self.__tree.selection_set(parent_sibling)
-
-            # Excepts used to catch errors.
-
-            except TclError:
-                return
-            except IndexError:
-                return
+        """
 
-    def detach(self, event):
-        """Keyboard shortcut to detach/attach items to others.
+        self.move_items(self.selected_items(), "bottom")
 
-        Use Control + r to detach/attach. If the item is a child, it will be
-        moved to the upper level. If the item is on the upper level and has
-        a next sibling, it will be made a child of the sibling.
+    def command_call(self, event):
+        """The function used to read the command line and start a function.
 
         """
 
-        # Get a list of selected items, the parent and the next sibling.
+        # Get the line without the default symbol, and read the command and
+        # its arguments from the command table. If the command is unknown or
+        # the syntax is wrong, show why.
 
-        current = self.__tree.selection()
-        parent = self.__tree.parent(current)
-        next_item = self.__tree.next(current)
+        self.drop_suggestion()
+        line = self.__command_box.get()[2:]
+        try:
+            prompt, function, arguments = self.__commands.parse(line)
+        except CommandError as error:
+            self.command_print(str(error))
+            return
 
-        # If item has a parent, get the index of the parent and move the item
-        # one below the parent. If there is no parent and the item has a next
-        # sibling, make the item the last child of the sibling.
+        self.__history.separate()
+        self.__command_failed = False
+        self.__stats.timed(function, prompt)(*arguments)
 
-        if parent != "":
-            index = self.__tree.index(parent)
-            self.__tree.move(current, "", index + 1)
-        elif next_item != "":
-            if len(self.__tree.get_children(current)) < 1:
-                self.__tree.move(current, next_item, END)
+        # While a macro is recorded, the lines that the session can run are
+        # added to it, unless they failed. A line the session cannot parse,
+        # like "-im -v", would fail when the macro is run.
 
-    def show_selection(self, event):
-        """Show the contents of the selected items on the side frame.
+        if self.__recording is not None and not self.__command_failed:
+            try:
+                self.__session.commands.parse(line)
+            except CommandError:
+                return
+            self.__recording[1].append(line.strip())
 
-        The side frame can be used to check the contents of the saved items
-        before pasting them or deleting them.
+    def name_start(self):
+        """Return the position in the command box where the item name being
+        typed starts, the name typed so far without quotes, and the quote
+        left open, or None if an item name is not being typed.
 
-        """
+        The name is the last word of the line, after the command, when the
+        cursor is at the end. Several names joined with ":" and names starting
+        with "-" are completed one name at a time. Names with spaces are typed
+        in quotes, like "-j 'my item'".
 
-        # Get the selected items and make a new list for the contents.
+        """
 
-        selection = self.__tree.selection()
-        text_list = []
+        line = self.__command_box.get()
+        if self.__command_box.index(INSERT) != len(line):
+            return None
+
+        # The name starts after the last space or ":" that is not in quotes.
+
+        start = 0
+        quote = None
+        for position, character in enumerate(line):
+            if quote is not None:
+                if character == quote:
+                    quote = None
+            elif character in "'\"":
+                quote = character
+            elif character in " :":
+                start = position + 1
+        if len(line[:start].split()) < 2:
+            return None
+        if line[start:start + 1] == "-":
+            start += 1
+        typed = "".join(split_command(line[start:] + (quote or "")))
+        return start, typed, quote
+
+    def suggest_name(self, event):
+        """Suggest an item name while it is typed in the command box.
+
+        The rest of the first item name starting with the typed text is added
+        to the line and selected, so typing on replaces it and Tab accepts it.
 
-        # Fetch the text for the selected items from the item container, and
-        # append to the list. Join the contents into one string separated by
-        # one empty line, and insert into the side frame.
+        """
 
-        for item in selection:
-            text_list.append(self.__item_container[item])
-        text = "\n\n".join(text_list)
+        if not event.char.isprintable() or event.char.isspace():
+            return
+        self.__suggestion = None
+        found = self.name_start()
+        if found is None:
+            return
 
-        self.__side_frame.delete(1.0, END)
-        self.__side_frame.insert(END, text)
+        start, prefix, quote = found
+        if not prefix:
+            return
+        names = self.__item_tree.names.complete(prefix)
+        longer = [name for name in names if name != prefix]
+        if not longer:
+            return
 
-    def quit(self):
-        """Quit the program, without saving or by first saving the text.
+        # A name that has to be quoted is suggested with the typed text in
+        # quotes, and the closing quote is selected with the rest, so typing
+        # on stays within the quotes.
+
+        box = self.__command_box
+        line = box.get()
+        rest = longer[0][len(prefix):]
+        quoted = quote_word(longer[0])
+        if quote is not None or quoted != longer[0]:
+            quote = quote or quoted[0]
+            box.delete(start, END)
+            box.insert(start, quote + prefix)
+            rest += quote
+        typed = len(box.get())
+        box.insert(END, rest)
+        box.selection_range(typed, END)
+        box.icursor(typed)
+        self.__suggestion = (start, longer, line[start:])
+
+    def complete_name(self, event):
+        """Complete the item name typed in the command box with Tab.
+
+        A suggested name is accepted. Otherwise the name is replaced with the
+        first item name starting with the typed text, or if there is none,
+        with the closest item name that has the typed characters in the same
+        order. Pressing Tab again goes through the other names.
 
-        Use the command "-quit n" if you want to quit without saving the text
-        in the main frame. If you want to save, use "-quit y *item_name.txt".
-        You do not have to select the text to save it, the program will save
-        everything in the main frame automatically.
+        """
 
-        NOTE: File will be saved in the same folder where the program is run
-        from. Only saving .txt files supported.
+        box = self.__command_box
+        if self.__suggestion is not None and box.selection_present():
+            start, names, typed = self.__suggestion
+            self.__suggestion = None
+            box.selection_clear()
+            box.icursor(END)
+            self.__completion = (box.get(), start, names, 0)
+            return "break"
+
+        line = box.get()
+        if self.__completion is not None and self.__completion[0] == line:
+            line, start, names, index = self.__completion
+            index = (index + 1) % len(names)
+        else:
+            found = self.name_start()
+            if found is None:
+                return "break"
+            start, prefix, quote = found
+            names = (self.__item_tree.names.complete(prefix)
+                     or self.__item_tree.names.fuzzy(prefix))
+            if not names:
+                return "break"
+            index = 0
+
+        box.delete(start, END)
+        box.insert(start, quote_word(names[index]))
+        box.icursor(END)
+        self.__completion = (box.get(), start, names, index)
+        return "break"
+
+    def drop_suggestion(self):
+        """Remove a suggested item name that was not accepted from the
+        command box, and the quotes added for it.
 
         """
 
-        # Get the line and split for checking the command.
+        if (self.__suggestion is not None
+                and self.__command_box.selection_present()):
+            start, names, typed = self.__suggestion
+            self.__command_box.delete(start, END)
+            self.__command_box.insert(start, typed)
+        self.__suggestion = None
+        self.__completion = None
 
-        line = self.__command_box.get()
-        try:
-            line_list = line.split()
+    def memory_report(self, top):
+        """Show how much text the items hold and how much space it takes.
 
-            # If the user does not want to save, quit the program directly.
+        Use the command "-mem". Items with the same text share the stored
+        text, and long texts are compressed, so the stored size can be much
+        smaller than the total size of the items. "-mem top" shows the
+        largest items in the main frame.
 
-            if line[2:] == "-quit n":
-                self.__root.destroy()
+        """
 
-            # If the user wants to save, first check the filename is correct.
+        if top is not None:
+            self.show_text(self.__session.largest_report())
+            return
 
-            elif (line_list[2] == "y") and (len(line_list) == 4):
+        self.command_print(self.__session.memory_report())
 
-                # If the filename contains "/" (the user wants to save to
-                # another directory), print an error notification.
+    def search(self, words):
+        """Select the items that contain the given words.
 
-                if "/" in line_list[3]:
-                    self.command_print("Only saving in the run folder "
-                                       "allowed.")
+        Use the command "-f *word* *word*...". Selects all the items whose
+        text contains every word. End a word with "*" to match all words
+        starting with it, e.g: "-f pri*".
 
-                # If the filename does not contain ".txt", show error message.
+        """
 
-                elif ".txt" not in line_list[3]:
-                    self.command_print("Incorrect syntax. Try '-quit y "
-                                       "/filename.txt/' or '-quit n' to "
-                                       "exit.")
+        # Search the index, select the found items and scroll to the first.
 
-                # Check that there is no extra dots in the filename. If not,
-                # save the file by calling the save_file function.
+        names = self.__item_container.search(words)
+        self.select_items(names)
+        if len(names) == 0:
+            self.command_print("No items found.")
+            return
 
-                elif len(line_list[3].split(".")) != 2:
-                    self.command_print("Incorrect syntax. Try '-quit y "
-                                       "/filename.txt/' or '-quit n' to exit.")
+        self.__tree.see(names[0])
+        self.command_print("{:d} items found.".format(len(names)))
 
-                # Finally check that the "txt" does not have extra characters
-                # and save the file by calling save_file function.
+    def paste(self, names):
+        """"Paste items selected in the Treeview to the main frame.
 
-                else:
-                    split_line = line_list[3].split(".")
-                    if split_line[1] != "txt":
-                        self.command_print("Incorrect syntax. Use form '-im "
-                                           "/filename.txt/")
-                        return
+        Use the command "-j /item_name/". You can paste multiple items by
+        typing ":" between the items you want to paste. For example:
+        "-j item1:item2".
+
+        NOTE: If you paste multiple items. The contents will be separated by a
+        newline character.
+
+        """
+
+        if self.view_read_only():
+            return
+
+        # Get the text from the session. Several items are separated by ":",
+        # and each of them is ended with a newline. Then insert the text to
+        # the main frame.
+
+        try:
+            self.insert_text(self.__session.paste_text(names))
+            self.__command_box.delete(2, END)
+        except CommandError as error:
+            self.command_error(str(error))
+
+    def paste_bind(self, event):
+        """Keyboard shortcut for the paste function.
+
+        Use Control + j to paste after selecting items from the Treeview. NOTE:
+        When pasting multiple things, a newline will be added between items.
+
+        """
+
+        # Get a list of items selected in the Treeview item list. Then fetch
+        # the texts from the item container, join them ending each with a
+        # newline, and paste in the insert cursors place.
+
+        if self.view_read_only():
+            return
+
+        current = self.selected_items()
+        paste_text = "".join(text + "\n" for text in
+                             self.__item_container.bodies(current))
+        try:
+            self.insert_text(paste_text)
+        except CommandError as error:
+            self.command_error(str(error))
+
+    def insert_text(self, text):
+        """Insert text to the main frame at the insert cursor.
+
+        Short texts are inserted with one call. Long texts are inserted in
+        slices scheduled with after(), so that the window stays responsive.
+        Raises CommandError if an earlier paste is still running.
+
+        """
+
+        if self.__paste_job is not None:
+            raise CommandError("Still pasting. Try again soon.")
+
+        # The whole paste is undone as one edit.
+
+        group = object()
+        if len(text) <= INSERT_CHUNK_SIZE:
+            self.__edit_group = group
+            self.__main_frame.insert(INSERT, text)
+            self.__edit_group = None
+            return
+
+        # The slices are inserted at a mark with right gravity, so the mark
+        # moves to the end of each inserted slice.
+
+        self.__main_frame.mark_set("paste", INSERT)
+        self.__main_frame.mark_gravity("paste", RIGHT)
+        self.insert_slice(text, 0, group)
+
+    def insert_slice(self, text, start, group):
+        """Insert the next slice of a long paste started by insert_text.
+
+        """
+
+        end = start + INSERT_CHUNK_SIZE
+        self.__edit_group = group
+        self.__main_frame.insert("paste", text[start:end])
+        self.__edit_group = None
+        if end < len(text):
+            self.command_print("Pasting: {:d}%".format(100 * end // len(text)))
+            self.__paste_job = self.__root.after(
+                1, lambda: self.insert_slice(text, end, group))
+        else:
+            self.__main_frame.mark_unset("paste")
+            self.__paste_job = None
+
+    def stop_paste(self):
+        """Stop a long paste that is still running. The slices pasted so far
+        are left in the main frame.
+
+        """
+
+        if self.__paste_job is None:
+            return
+
+        self.__root.after_cancel(self.__paste_job)
+        self.__main_frame.mark_unset("paste")
+        self.__paste_job = None
+
+    def move_item(self, item):
+        """Move selected item one step up in the Treeview widget.
+
+        Note: Cannot move multiple items at the same time.
+
+        """
+
+        # Check that the item exists.
+
+        if item not in self.__item_tree:
+            self.command_print("Item not found. See list for saved items.")
+            return
+
+        # Get the index and the parent of the item.
+
+        index = self.__item_tree.index(item)
+        parent = self.__item_tree.parent(item)
+
+        # If the item is on top of the list, move it to the bottom. Otherwise
+        # move it one step up. Finally clear the command box.
+
+        if index == 0:
+            self.move_tree_item(item, parent)
+        else:
+            self.move_tree_item(item, parent, index - 1)
+
+        self.__command_box.delete(2, END)
+
+    def move_item_bind(self, event):
+        """Keyboard shortcut to move items in the Treeview item list.
+
+        Use Control + l to move a selected item one step upwards.
+
+        """
+
+        # Get the selected item, and its index and parent item. Only one item
+        # can be moved at a time.
+
+        current = self.selected_items()
+        if len(current) != 1:
+            return
+
+        index = self.__item_tree.index(current[0])
+        parent = self.__item_tree.parent(current[0])
+
+        # If item is on top of the list, move it to the end. Othetwise move
+        # the item one step upwards.
+
+        if index == 0:
+            self.move_tree_item(current[0], parent)
+        else:
+            self.move_tree_item(current[0], parent, index - 1)
 
-                    self.save_file(line_list[3])
+    def move_tree_item(self, item, parent, index=None):
+        """Move an item to the index under the parent, or to the end.
 
-            # Error if the "-quit y *filename*" command has too many words.
+        The item is moved in the tree model and the Treeview, and the
+        positions that changed are saved in the item store.
 
+        """
+
+        old_parent = self.__item_tree.parent(item)
+        old_index = self.__item_tree.index(item)
+        self.__item_tree.move(item, parent, index)
+        new_index = self.__item_tree.index(item)
+        self.render_tree(*{old_parent, parent})
+
+        # Within the same parent only the items between the old and the new
+        # position move. In a new parent, the items after the new position,
+        # and in the old parent the items after the old position, which move
+        # up to fill the gap. Both parents are saved in one transaction.
+
+        siblings = self.__item_tree.children(parent)
+        if old_parent == parent:
+            start = min(old_index, new_index)
+            stop = max(old_index, new_index) + 1
+            orders = {parent: (siblings[start:stop], start)}
+        else:
+            old_siblings = self.__item_tree.children(old_parent)
+            orders = {parent: (siblings[new_index:], new_index),
+                      old_parent: (old_siblings[old_index:], old_index)}
+        self.__item_container.set_orders(orders)
+
+    def next_item_bind(self, event):
+        """Keyboard shortcut to select the next item in the Treeview widget.
+
+        Use Alt + l to toggle the selected item in the item list.
+
+        """
+
+        # If the list is empty, return. If nothing is selected, select the
+        # first item in the list. Only one item can be selected to toggle.
+
+        tree_list = self.__item_tree.children()
+        current = self.selected_items()
+        if len(tree_list) == 0:
+            return
+        elif len(current) == 0:
+            self.select_items([tree_list[0]])
+            return
+        elif len(current) != 1:
+            return
+
+        # Get the current selected item, and its next sibling, parent, and
+        # children from the tree model.
+
+        current = current[0]
+        next_sibling = self.__item_tree.next(current)
+        parent = self.__item_tree.parent(current)
+        children = self.__item_tree.children(current)
+
+        # If the item has no parent, check if it has any children. If there is
+        # children, select the first child. Otherwise, if item has a next
+        # sibling, select it. Otherwise, if the item is last on the list,
+        # select the first item in the list.
+
+        if parent == "":
+            if len(children) > 0:
+                target = children[0]
+            elif next_sibling != "":
+                target = next_sibling
             else:
-                self.command_print("Incorrect syntax. Try '-quit y "
-                                   "/filename.txt/' or '-quit n' to exit.")
+                target = tree_list[0]
+
+        # If the item has a parent, check if there is a next sibling. If there
+        # is, select it. Or if the item is last, select the parent's next
+        # sibling. If the parent has no next sibling, select the first item of
+        # the list.
 
-        # Except to catch any unnoticed errors.
+        elif next_sibling != "":
+            target = next_sibling
+        elif self.__item_tree.next(parent) == "":
+            target = tree_list[0]
+        else:
+            target = self.__item_tree.next(parent)
 
-        except IndexError:
-            self.command_print("Incorrect syntax. Type '-quit y "
+        # Make sure the item has a row before selecting it.
+
+        self.select_items([target])
+        self.__tree.see(target)
+
+    def detach(self, event):
+        """Keyboard shortcut to detach/attach items to others.
+
+        Use Control + r to detach/attach. If the item is a child, it will be
+        moved to the upper level. If the item is on the upper level and has
+        a next sibling, it will be made a child of the sibling.
+
+        """
+
+        # Get the selected item, the parent and the next sibling. Only one
+        # item can be moved at a time.
+
+        current = self.selected_items()
+        if len(current) != 1:
+            return
+
+        current = current[0]
+        parent = self.__item_tree.parent(current)
+        next_item = self.__item_tree.next(current)
+
+        # If item has a parent, get the index of the parent and move the item
+        # one below the parent. If there is no parent and the item has a next
+        # sibling, make the item the last child of the sibling.
+
+        if parent != "":
+            index = self.__item_tree.index(parent)
+            self.move_tree_item(current, "", index + 1)
+        elif next_item != "":
+            if len(self.__item_tree.children(current)) < 1:
+                self.move_tree_item(current, next_item)
+
+    def show_selection(self, event):
+        """Show the contents of the selected items on the side frame.
+
+        The side frame can be used to check the contents of the saved items
+        before pasting them or deleting them. The contents are shown after a
+        short delay, so when the selection changes quickly, only the last
+        selection is shown.
+
+        """
+
+        if self.__selection_job is not None:
+            self.__root.after_cancel(self.__selection_job)
+        self.__preview_expanded = set()
+        self.__selection_job = self.__root.after(
+            SELECT_DELAY, self.__stats.timed(self.render_selection))
+
+    def render_selection(self):
+        """Show the selected items on the side frame.
+
+        Only the first PREVIEW_SIZE characters of each item are shown, unless
+        the item has been expanded by clicking the link after it.
+
+        """
+
+        # Get the selected items, the beginnings of their texts, and the
+        # full texts of the expanded items.
+
+        self.__selection_job = None
+        selection = self.selected_items()
+        previews = self.__item_container.previews(selection, PREVIEW_SIZE)
+        expanded = [item for item in selection
+                    if item in self.__preview_expanded]
+        full_texts = dict(zip(expanded,
+                              self.__item_container.bodies(expanded)))
+
+        # Make a list of texts and tags for the side frame, the contents
+        # separated by one empty line. Each link has a tag with the index of
+        # the item, to find out which item to expand.
+
+        segments = []
+        for index, (item, preview) in enumerate(zip(selection, previews)):
+            text, size, truncated = preview
+            if index > 0:
+                segments += ["\n\n", ()]
+            if item in full_texts:
+                segments += [full_texts[item], ()]
+            else:
+                segments += [text, ()]
+                if truncated:
+                    link = " [... show all {:s}]".format(format_size(size))
+                    segments += [link, ("expand", "item{:d}".format(index))]
+
+        self.__preview_names = selection
+        self.__side_frame.delete(1.0, END)
+        if segments:
+            self.__side_frame.insert(END, *segments)
+
+    def expand_preview(self, event):
+        """Show the whole text of the item whose link was clicked.
+
+        """
+
+        for tag in self.__side_frame.tag_names(CURRENT):
+            if tag.startswith("item"):
+                index = int(tag[4:])
+                self.__preview_expanded.add(self.__preview_names[index])
+                self.render_selection()
+                return
+
+    def quit(self, answer, filename=None):
+        """Quit the program, without saving or by first saving the text.
+
+        Use the command "-quit n" if you want to quit without saving the text
+        in the main frame. If you want to save, use "-quit y *item_name.txt".
+        You do not have to select the text to save it, the program will save
+        everything in the main frame automatically.
+
+        NOTE: File will be saved in the same folder where the program is run
+        from. Only saving .txt files supported.
+
+        """
+
+        # If the user does not want to save, quit the program directly.
+
+        if answer == "n":
+            self.__root.destroy()
+
+        # If the user wants to save, first check the filename is correct. If
+        # the filename contains "/" (the user wants to save to another
+        # directory), print an error notification.
+
+        elif "/" in filename:
+            self.command_print("Only saving in the run folder allowed.")
+
+        # Check that the filename ends with ".txt" and that there are no extra
+        # dots in it. If not, save the file by calling the save_file function.
+
+        elif (len(filename.split(".")) != 2
+              or filename.split(".")[1] != "txt"):
+            self.command_print("Incorrect syntax. Try '-quit y "
                                "/filename.txt/' or '-quit n' to exit.")
+        else:
+            self.save_file(filename, True)
 
     def quit_popup(self):
         """Make a pop up notification appear when closing from the window.
@@ -761,7 +1604,7 @@ class Interface:
         if popup:
             self.__root.destroy()
 
-    def save_main(self):
+    def save_main(self, filename):
         """Save without quitting.
 
         Use the "-ex *filename.txt*" command. The saving is done in a similar
@@ -769,67 +1612,131 @@ class Interface:
 
         """
 
-        # Get the line, check the syntax for errors.
+        # Only ".txt" files in the run folder are saved. The session checks
+        # the filename the same way, so the command works alike in macros.
 
-        line = self.__command_box.get()
         try:
-            line_list = line.split()
-            if len(line_list) != 3:
-                raise IndexError
+            check_text_file(filename, "-ex")
+        except CommandError as error:
+            self.command_error(str(error))
+            return
 
-            # If "/" in filename, show an error notification.
+        # Finally, save the file by calling the save_file function.
 
-            if "/" in line_list[2]:
-                self.command_print("Only saving in the run folder allowed.")
+        self.save_file(filename)
 
-            # If ".txt" is not defined in the filename, show error message.
+    def save_file(self, filename, quit_after=False):
+        """The save file method used above.
 
-            elif ".txt" not in line_list[2]:
-                self.command_print("Incorrect syntax. Use form '-ex "
-                                   "/filename.txt/")
+        The text is written in a worker thread, so saving does not block the
+        interface. If quit_after is True, the program quits after the file
+        has been saved.
 
-            # Split the filename for dots to see if the filename contains too
-            # many dots and that the "txt" does not have extra characters.
+        """
 
-            else:
-                split_line = line_list[2].split(".")
+        # The viewer mode only holds a part of the file, so it cannot be saved.
 
-                if len(split_line) != 2:
-                    self.command_print("Incorrect syntax. Use form '-ex "
-                                       "/filename.txt/")
-                elif split_line[1] != "txt":
-                    self.command_print("Incorrect syntax. Use form '-im "
-                                       "/filename.txt/")
+        if self.view_read_only():
+            return
+        if self.__saving:
+            self.command_error("Already saving a file. Try again soon.")
+            return
 
-                # Finally, save the file by calling the save_file function.
+        # The saved files are recorded with the document version and the
+        # hash of the text. If the document has not been edited since the
+        # file was saved, and the file is untouched, there is nothing to do.
 
-                else:
-                    self.save_file(line_list[2])
+        version = self.__document.version
+        saved = self.__saved_files.get(filename)
+        if (saved is not None and saved[0] == version
+                and saved[2] == file_stat(filename)):
+            self.save_done(filename, version, quit_after,
+                           (saved[1:], False), None)
+            return
 
-        # Except to catch any errors.
+        # Take a copy of the document, and hash and write it in the
+        # background.
 
-        except IndexError:
-            self.command_print("Incorrect syntax. Use form '-ex "
-                               "/filename.txt/'")
+        document = self.__document.copy()
+        if saved is not None:
+            saved = saved[1:]
+        self.__saving = True
+        self.command_print("Saving {:s}...".format(filename))
+        self.run_in_background(lambda: save_document(filename, document,
+                                                     saved),
+                               lambda result, error: self.save_done(
+                                   filename, version, quit_after, result,
+                                   error))
 
-    def save_file(self, filename):
-        """The save file method used above.
+    def save_done(self, filename, version, quit_after, result, error):
+        """Show the result of saving a file, and quit if requested.
 
         """
 
-        # Open the file with the given filename, get the whole text from the
-        # main frame, and write.
-
-        file = open(filename, "w")
-        file.write(self.__main_frame.get(1.0, END))
-        file.close()
+        self.__saving = False
+        if error is not None:
+            self.command_print("Error in saving file: {:s}".format(
+                str(error)))
+            return
 
-        # Show a notification that the file was saved.
+        # Record the saved version and show a notification.
 
-        notification = "File saved as: {:s}".format(filename)
+        (digest, stat), written = result
+        self.__saved_files[filename] = (version, digest, stat)
+        if written:
+            notification = "File saved as: {:s}".format(filename)
+        else:
+            notification = "No changes to save in {:s}.".format(filename)
         self.command_print(notification)
+        if quit_after:
+            self.__root.destroy()
+
+    def run_in_background(self, work, done):
+        """Run a function in a worker thread.
+
+        When the function returns, done is called in the mainloop with the
+        result and the error raised, one of which is None. The results are
+        passed through a queue that is read with after().
+
+        """
+
+        thread = threading.Thread(target=self.background_worker,
+                                  args=(work, done), daemon=True)
+        thread.start()
+
+        if self.__background_jobs == 0:
+            self.__root.after(50, self.background_poll)
+        self.__background_jobs += 1
+
+    def background_worker(self, work, done):
+        """Run the function given to run_in_background and queue the result.
+
+        """
+
+        try:
+            self.__background_results.put((done, work(), None))
+        except Exception as error:
+            self.__background_results.put((done, None, error))
 
-    def open_main(self):
+    def background_poll(self):
+        """Call the done functions of the finished background jobs.
+
+        Keeps polling with after() while there are jobs running.
+
+        """
+
+        while True:
+            try:
+                done, result, error = self.__background_results.get_nowait()
+            except queue.Empty:
+                break
+            self.__background_jobs -= 1
+            done(result, error)
+
+        if self.__background_jobs > 0:
+            self.__root.after(50, self.background_poll)
+
+    def open_main(self, viewer, filename):
         """Open a ".txt" file and import to the main frame.
 
         Use the command "-im *filename.txt*. Only opening files from the same
@@ -839,41 +1746,24 @@ class Interface:
 
         """
 
-        # Get line, check the current text in the main frame.
+        # The "-v" flag opens the file in the read-only viewer mode.
 
-        line = self.__command_box.get()
-        current_text = self.__main_frame.get(1.0, END)
+        viewer = viewer is not None
 
-        # Check the syntax and show error notification if necessary.
+        # Check the filename and show error notification if necessary. Only
+        # ".txt" files in the run folder are opened, like in macros.
 
         try:
-            line_list = line.split()
-            split_line = line_list[2].split(".")
-            if len(line_list) != 3:
-                raise IndexError
-
-            # Show error if the filename contains "/" or ".txt".
-
-            if "/" in line_list[2]:
-                self.command_print("Only opening from the run folder allowed.")
-            if ".txt" not in line_list[2]:
-                self.command_print("Incorrect syntax. Use form '-im "
-                                   "/filename.txt/")
-
-            # Show error if the filename contains too many dots or the "txt"
-            # contains extra characters.
-
-            elif len(split_line) != 2:
-                self.command_print("Incorrect syntax. Use form '-im "
-                                   "/filename.txt/")
-            elif split_line[1] != "txt":
-                self.command_print("Incorrect syntax. Use form '-im "
-                                   "/filename.txt/")
+            check_text_file(filename, "-im")
+        except CommandError as error:
+            self.command_error(str(error))
+            return
 
+        try:
             # Check main frame contains current text, and show a warning if it
             # does, because the text will be cleared when importing the file.
 
-            elif len(current_text) > 1:
+            if len(self.__document) > 0:
                 popup = messagebox.askokcancel("Open Warning",
                                                "Text field not empty. All text"
                                                " will be cleared. Continue?",
@@ -884,36 +1774,648 @@ class Interface:
                 # the command box.
 
                 if popup:
+                    group = object()
+                    self.close_view()
+                    self.__edit_group = group
                     self.__main_frame.delete(1.0, END)
-                    self.open_file(line_list[2])
+                    self.__edit_group = None
+                    self.open_file(filename, viewer, group)
 
             # If there was no text in main frame, import the file directly.
 
             else:
-                self.open_file(line_list[2])
+                self.open_file(filename, viewer)
 
-        # Excepts to catch unwanted errors.
+        # Except to catch unwanted errors.
 
-        except IndexError:
-            self.command_print("Incorrect syntax. Use form '-im "
-                               "/filename.txt/'")
         except OSError:
-            self.command_print("Error in opening file. Check '-help' for more"
+            self.command_error("Error in opening file. Check '-help' for more"
                                " information.")
 
-    def open_file(self, filename):
+    def import_files(self, pattern, delimiter):
+        """Save all files matching a pattern as items.
+
+        Use the command "-imall *pattern*", e.g: "-imall *.txt", to save each
+        file in the run folder matching the pattern as an item, or "-imall
+        *pattern* *delimiter*" to also save the parts of each file between
+        the lines with only the delimiter as children of the file. The files
+        are read by a pool of threads in the background, and the items are
+        added to the list at once when all have been read.
+
+        """
+
+        try:
+            filenames = self.__session.match_files(pattern)
+        except CommandError as error:
+            self.command_error(str(error))
+            return
+        if not filenames:
+            self.command_error("No files found.")
+            return
+
+        self.command_print("Reading {:d} files...".format(len(filenames)))
+        self.run_in_background(lambda: read_files(filenames, delimiter),
+                               self.import_files_done)
+
+    def import_files_done(self, files, error):
+        """Save the files read by import_files as items and show them in the
+        Treeview.
+
+        """
+
+        if error is not None:
+            self.command_print("Error in reading files: {:s}".format(
+                str(error)))
+            return
+
+        try:
+            saved, skipped = self.__session.add_files(files)
+        except sqlite3.Error:
+            self.command_print("Error in saving the items.")
+            return
+        self.render_tree("")
+        self.command_print("{:d} files imported, {:d} skipped.".format(
+            saved, len(skipped)))
+
+    def export_list(self, filename):
+        """Save the item list to a ";" separated list file.
+
+        Use the command "-exlist *filename*". Each row holds the name, the
+        parent and the text of an item, and the texts are written one at a
+        time, so large lists do not have to fit in memory.
+
+        """
+
+        try:
+            self.command_print(self.__session.export_list(filename))
+        except CommandError as error:
+            self.command_error(str(error))
+
+    def import_list(self, filename):
+        """Add the items in a list file saved with "-exlist" to the item list.
+
+        Use the command "-imlist *filename*". The rows are stored while the
+        file is read, a chunk at a time scheduled with after(), so the window
+        stays responsive, and the Treeview is updated after each chunk.
+
+        """
+
+        if self.__list_import is not None:
+            self.command_error("Still importing a list. Try again soon.")
+            return
+        try:
+            self.__list_import = ListImport(self.__item_container,
+                                            self.__item_tree, filename)
+        except CommandError as error:
+            self.command_error(str(error))
+            return
+        self.__list_job = self.__root.after(1, self.import_list_slice)
+
+    def import_list_slice(self):
+        """Store the next chunk of a list file imported with import_list.
+
+        """
+
+        importer = self.__list_import
+        message = None
+        try:
+            more = importer.step()
+        except CommandError as error:
+            more = False
+            message = str(error)
+
+        # Update the top level and the parents that got children, which also
+        # shows the children under parents that are already open.
+
+        self.render_tree("", *importer.parents)
+        importer.parents.clear()
+        if not more:
+            self.stop_list_import()
+            self.command_print(message or importer.report())
+            return
+
+        self.command_print("Importing {:s}: {:d}% (Esc to cancel)".format(
+            importer.filename, 100 * importer.done // importer.size))
+        self.__list_job = self.__root.after(1, self.import_list_slice)
+
+    def stop_list_import(self):
+        """Stop a running list import and close the file. The items stored
+        so far are kept.
+
+        Returns True if a list import was running.
+
+        """
+
+        if self.__list_import is None:
+            return False
+
+        if self.__list_job is not None:
+            self.__root.after_cancel(self.__list_job)
+        self.__list_import.close()
+        self.__list_import = None
+        self.__list_job = None
+        return True
+
+    def open_file(self, filename, viewer=False, group=None):
         """Used to open the file in when importing text.
 
+        Large files, and files opened with the "-v" flag, are opened in the
+        read-only viewer mode instead. The import is undone as one edit,
+        together with the clearing of the main frame made with the same group.
+
+        """
+
+        # Stop a previous import if it is still running. Open large files in
+        # the viewer, empty files cannot be memory-mapped.
+
+        self.stop_import()
+        self.close_view()
+        size = os.path.getsize(filename)
+        if (viewer or size > LARGE_FILE_SIZE) and size > 0:
+            self.open_view(filename)
+            return
+
+        # Open the file and schedule the first slice, the rest of the file is
+        # read by the import_slice method in chunks.
+
+        self.__import_file = open(filename, "r")
+        self.__import_size = max(os.path.getsize(filename), 1)
+        self.__import_name = filename
+        self.__import_group = group if group is not None else object()
+        self.__command_box.delete(2, END)
+        self.__import_job = self.__root.after(1, self.import_slice)
+
+    def import_slice(self):
+        """Import the next chunk of the file opened by open_file.
+
+        Each call reads a fixed-size chunk, appends it to the main frame and
+        schedules the next call with after(), so the window stays responsive
+        while large files are imported.
+
+        """
+
+        try:
+            text = self.__import_file.read(INSERT_CHUNK_SIZE)
+            done = self.__import_file.buffer.tell()
+        except (OSError, ValueError):
+            self.stop_import()
+            self.command_print("Error in reading file. Import stopped.")
+            return
+
+        # When the whole file has been read, close it and show notification.
+
+        if text == "":
+            self.stop_import()
+            self.command_print("File imported: {:s}".format(
+                self.__import_name))
+            return
+
+        # Append the chunk to the end of the main frame, show the progress in
+        # the command box, and schedule the next slice.
+
+        self.__edit_group = self.__import_group
+        self.__main_frame.insert(END, text)
+        self.__edit_group = None
+        percent = min(100 * done // self.__import_size, 100)
+        self.command_print("Importing {:s}: {:d}% (Esc to cancel)".format(
+            self.__import_name, percent))
+        self.__import_job = self.__root.after(1, self.import_slice)
+
+    def stop_import(self):
+        """Stop a running import and close the file.
+
+        Returns True if an import was running.
+
+        """
+
+        if self.__import_file is None:
+            return False
+
+        if self.__import_job is not None:
+            self.__root.after_cancel(self.__import_job)
+        self.__import_file.close()
+        self.__import_file = None
+        self.__import_job = None
+        return True
+
+    def cancel_import(self, event):
+        """Keyboard shortcut to cancel a running import.
+
+        Use Escape to stop importing a file or a list. The text imported so
+        far is left in the main frame, and the items in the item list.
+
+        """
+
+        stopped = self.stop_list_import()
+        if self.stop_import() or stopped:
+            self.command_print("Import cancelled.")
+
+    def open_view(self, filename):
+        """Open a file in the read-only viewer mode.
+
+        Only a window of VIEW_PAGES pages of the file is kept in the main
+        frame. The pages are swapped when the user scrolls near the top or the
+        bottom of the window, so opening does not depend on the file size.
+
+        """
+
+        self.__view = PagedFile(filename)
+        self.__view_page = 0
+        self.__view_lines = []
+        self.__history.clear()
+        self.__main_frame.configure(state=NORMAL)
+        self.__main_frame.delete(1.0, END)
+
+        for page in range(min(VIEW_PAGES, self.__view.page_count)):
+            self.view_append(page)
+
+        # Disable editing and follow the scrolling to swap the pages.
+
+        self.__main_frame.configure(state=DISABLED,
+                                    yscrollcommand=self.view_scroll)
+        self.__command_box.delete(2, END)
+        self.view_status()
+
+    def close_view(self):
+        """Leave the viewer mode, if it is on, and make the main frame
+        editable again.
+
+        """
+
+        if self.__view is None:
+            return
+
+        # The pages shown were never edited, so they are cleared without
+        # recording them in the undo history.
+
+        self.__main_frame.configure(state=NORMAL,
+                                    yscrollcommand=self.__main_frame.vbar.set)
+        self.__main_frame.delete(1.0, END)
+        self.__view.close()
+        self.__view = None
+        self.__view_lines = []
+        self.__history.clear()
+
+    def view_append(self, page):
+        """Add a page to the end of the viewer window.
+
+        """
+
+        text = self.__view.page_text(page)
+        self.__main_frame.insert(END, text)
+        self.__view_lines.append(text.count("\n"))
+
+    def view_scroll(self, first, last):
+        """Update the scroll bar and swap the pages in the viewer window.
+
+        Used as the scroll command of the main frame in the viewer mode. If
+        the view is close to the bottom of the window, the first page is
+        dropped and the next one added, and the other way around at the top.
+
+        """
+
+        self.__main_frame.vbar.set(first, last)
+        view = self.__view
+        if view is None:
+            return
+
+        window_end = self.__view_page + len(self.__view_lines)
+        self.__main_frame.configure(state=NORMAL)
+
+        if float(last) > 0.9 and window_end < view.page_count:
+            dropped = self.__view_lines.pop(0)
+            self.__main_frame.delete(1.0, "{:d}.0".format(dropped + 1))
+            self.view_append(window_end)
+            self.__view_page += 1
+            self.view_status()
+
+        elif float(first) < 0.1 and self.__view_page > 0:
+            self.__view_page -= 1
+            text = view.page_text(self.__view_page)
+            self.__main_frame.insert(1.0, text)
+            self.__view_lines.insert(0, text.count("\n"))
+            dropped = self.__view_lines.pop()
+            self.__main_frame.delete("end - 1 chars linestart - {:d} lines"
+                                     .format(dropped), END)
+            self.view_status()
+
+        self.__main_frame.configure(state=DISABLED)
+
+    def view_status(self):
+        """Show the file name and the lines shown in the command box.
+
+        """
+
+        first = self.__view.first_line(self.__view_page)
+        total = self.__view.line_count()
+        if first is None:
+            position = "indexing lines"
+        else:
+            position = "from line {:d}".format(first)
+        if total is not None:
+            position += " of {:d}".format(total)
+
+        self.command_print("Viewing {:s} (read-only), {:s}.".format(
+            self.__view.name, position))
+
+    def view_read_only(self):
+        """Return True and show a notification if the viewer mode is on.
+
+        """
+
+        if self.__view is not None:
+            self.command_error("Viewer mode is read-only. Clear the main "
+                               "frame to edit.")
+            return True
+        return False
+
+    def save_session(self, filename):
+        """Save the whole session to a snapshot file.
+
+        Use the command "-snap *filename.snap*". The snapshot holds the text in
+        the main frame with the cursor and the selection, and the items with
+        their texts and order. It can be restored with "-rest", or by giving
+        it to the program when starting it.
+
+        """
+
+        if not filename.endswith(".snap"):
+            self.command_print("Incorrect syntax. Use form '-snap "
+                               "/filename.snap/'")
+            return
+        if "/" in filename:
+            self.command_print("Only saving in the run folder allowed.")
+            return
+        if self.view_read_only():
+            return
+
+        # The positions are stored as offsets in the document.
+
+        cursor = self.document_offset(INSERT)
+        selection = self.__main_frame.tag_ranges(SEL)
+        if selection:
+            selection = (self.document_offset(selection[0]),
+                         self.document_offset(selection[1]))
+        else:
+            selection = None
+
+        try:
+            write_atomic(filename, snapshot_chunks(
+                self.__document, cursor, selection,
+                self.__item_container.export_items(),
+                self.__item_container.export_blobs()), mode="wb")
+        except (OSError, sqlite3.Error):
+            self.command_print("Error in saving the snapshot.")
+            return
+        self.command_print("Session saved: {:s}".format(filename))
+
+    def restore_session(self, filename):
+        """Restore a session from a snapshot file.
+
+        Use the command "-rest *filename.snap*". The text in the main frame and
+        all the items are replaced with the ones in the snapshot.
+
+        """
+
+        if not filename.endswith(".snap"):
+            self.command_print("Incorrect syntax. Use form '-rest "
+                               "/filename.snap/'")
+            return
+        if "/" in filename:
+            self.command_print("Only opening from the run folder allowed.")
+            return
+
+        popup = messagebox.askokcancel("Restore Warning",
+                                       "All text and items will be replaced. "
+                                       "Continue?", icon="warning")
+        if popup:
+            self.restore_snapshot(filename)
+
+    def index_step(self):
+        """Add the next texts restored from a snapshot to the search index,
+        and schedule the rest with after(), so restoring does not depend on
+        how much text the items hold.
+
+        """
+
+        self.__index_job = None
+        try:
+            pending = self.__item_container.index_pending(INDEX_STEP_SIZE)
+        except sqlite3.Error:
+            return
+        if pending:
+            self.__index_job = self.__root.after(1, self.index_step)
+
+    def restore_snapshot(self, filename):
+        """Replace the text in the main frame and the items with the ones in a
+        snapshot.
+
         """
 
-        # Open the file, read the text, paste, and show notification.
+        if self.__paste_job is not None:
+            self.command_error("Still pasting. Try again soon.")
+            return
+
+        try:
+            snapshot = Snapshot(filename)
+        except (OSError, ValueError):
+            self.command_print("Error in opening the snapshot.")
+            return
+
+        try:
+            self.__session.restore_items(snapshot)
+        except (sqlite3.Error, ValueError, zlib.error):
+            self.command_print("Error in restoring the items.")
+            return
+        finally:
+            snapshot.close()
+        self.reload_tree()
+        if self.__index_job is None:
+            self.index_step()
 
-        file = open(filename, "r")
-        text = file.read()
-        self.__main_frame.insert(1.0, text)
-        file.close()
+        # Replace the main text as one edit, then place the cursor and the
+        # selection.
+
+        self.stop_import()
+        self.close_view()
+        self.__main_default_trigger = False
+        self.__edit_group = object()
+        self.__main_frame.delete(1.0, END)
+        self.__main_frame.insert(1.0, snapshot.text)
+        self.__edit_group = None
+
+        self.__main_frame.mark_set(INSERT, self.document_index(
+            snapshot.cursor))
+        self.__main_frame.tag_remove(SEL, 1.0, END)
+        if snapshot.selection is not None:
+            self.__main_frame.tag_add(SEL, *map(self.document_index,
+                                                snapshot.selection))
+        self.__main_frame.see(INSERT)
+        self.command_print("Session restored: {:s}".format(filename))
+
+    def reload_tree(self):
+        """Drop all the rows of the Treeview and show the items of the tree
+        model again, after the item list was replaced.
+
+        """
+
+        self.__tree.set_children("")
+        for row in self.__tree_rows:
+            if self.__tree.exists(row):
+                self.__tree.delete(row)
+        self.__tree_rows.clear()
+        self.__tree_opened.clear()
+        self.__tree_shown = TREE_PAGE_SIZE
+        self.render_tree("")
+        self.__preview_names = []
+        self.__side_frame.delete(1.0, END)
+
+    def select_text(self, first, last):
+        """Select text in the main frame.
+
+        Use the command "-sel *first* *last*", where the positions are given
+        as "line.column", e.g. "1.0" for the start of the text, or "end".
+        Useful in macros, which cannot select text with the mouse.
+
+        """
+
+        try:
+            first, last = sorted(self.__session.position_offset(word)
+                                 for word in (first, last))
+        except ValueError:
+            self.command_error("Incorrect syntax. Use form '-sel "
+                               "/line.column/ /line.column/'")
+            return
+
+        self.__main_frame.tag_remove(SEL, 1.0, END)
+        self.__main_frame.tag_add(SEL, self.document_index(first),
+                                  self.document_index(last))
+        self.__main_frame.mark_set(INSERT, self.document_index(last))
         self.__command_box.delete(2, END)
 
+    def record_macro(self, name):
+        """Start recording a macro.
+
+        Use the command "-rec *macro_name*". The commands run after it are
+        recorded, until the command "-end" saves the macro. Only the commands
+        that edit the text or the item list are recorded.
+
+        """
+
+        if self.__recording is not None:
+            self.command_print("Already recording {:s}. Type '-end' to save "
+                               "it.".format(self.__recording[0]))
+            return
+
+        self.__recording = (name, [])
+        self.command_print("Recording macro {:s}. Type '-end' to save it."
+                           .format(name))
+
+    def end_macro(self):
+        """Stop recording and save the macro.
+
+        Use the command "-end".
+
+        """
+
+        if self.__recording is None:
+            self.command_print("No macro is being recorded.")
+            return
+
+        name, lines = self.__recording
+        self.__recording = None
+        if not lines:
+            self.command_print("Nothing recorded. Macro not saved.")
+            return
+        self.__item_container.save_macro(name, lines)
+        self.command_print("Macro saved: {:s}, {:d} commands.".format(
+            name, len(lines)))
+
+    def play_macro(self, name):
+        """Play a recorded macro.
+
+        Use the command "-play *macro_name*". The commands are run by the
+        session directly on the document and the item list, without updating
+        the windows or showing notifications between them. The main frame and
+        the item list are updated once at the end.
+
+        """
+
+        if self.view_read_only():
+            return
+        if self.__paste_job is not None or self.__import_file is not None:
+            self.command_error("Still pasting or importing. Try again soon.")
+            return
+
+        # The session starts from the cursor and the selection of the main
+        # frame.
+
+        session = self.__session
+        session.cursor = self.document_offset(INSERT)
+        selection = self.__main_frame.tag_ranges(SEL)
+        if selection:
+            session.selection = (self.document_offset(selection[0]),
+                                 self.document_offset(selection[1]))
+        else:
+            session.selection = None
+        before = self.__document.copy()
+
+        # Run the macro. The changes made before a failed command are kept,
+        # but a failed macro is not recorded into another macro.
+
+        try:
+            message = session.play_macro(name)
+        except CommandError as error:
+            message = str(error)
+            self.__command_failed = True
+
+        self.sync_main_frame(before)
+        self.reload_tree()
+        self.__main_frame.tag_remove(SEL, 1.0, END)
+        if session.selection is not None:
+            self.__main_frame.tag_add(SEL, *map(self.document_index,
+                                                session.selection))
+        self.__main_frame.mark_set(INSERT, self.document_index(
+            session.cursor))
+        self.__main_frame.see(INSERT)
+        self.command_print(message)
+
+    def sync_main_frame(self, before):
+        """Update the main frame after the document was edited directly.
+
+        The before argument is a copy of the document taken before the edits,
+        which matches the text still in the main frame. Only the range that
+        changed is replaced, with the widget command itself, so the proxy does
+        not apply the edit to the document again. The change is recorded in
+        the undo history and the journal as one edit.
+
+        """
+
+        start, old_end, end = self.__document.difference(before)
+        if start == old_end == end:
+            return
+
+        call = self.__root.tk.call
+        widget = self.__main_command
+        text = self.__document.text(start, end)
+        removed = before.copy().delete(start, old_end)
+        call(widget, "delete", self.document_index(start, before),
+             self.document_index(old_end, before))
+        call(widget, "insert", self.document_index(start, before), text)
+        if text and max(text) > "\uffff":
+            self.__astral = True
+
+        group = object()
+        self.__history.separate()
+        self.__history.record("delete", start, removed, group)
+        self.__history.record("insert", start,
+                              [(text, 0, len(text), text.count("\n"))], group)
+        self.__history.separate()
+        if old_end > start:
+            self.__journal.delete(start, old_end)
+        if text:
+            self.__journal.insert(start, text)
+
     def help(self):
         """Show the help file in the main frame.
 
@@ -923,36 +2425,71 @@ class Interface:
 
         """
 
-        # See if the main frame contains text. Open the help file and save
-        # the help text, then close file.
+        # Open the help file and save the help text, then close file.
 
-        current_text = self.__main_frame.get(1.0, END)
         help_file = open("help.txt", "r")
         help_text = help_file.read()
         help_file.close()
+        self.show_text(help_text)
+
+    def show_stats(self, action):
+        """Show the latency of the commands and key bindings.
+
+        Use the command "-stats" to show the median, the 95th percentile and
+        the longest time of the latest runs of each command in the main frame.
+        "-stats log" turns on or off writing every timing to a log file as
+        JSON lines, and "-stats reset" forgets the timings.
+
+        """
+
+        if action is None:
+            self.show_text(self.__stats.report_text())
+        elif action == "log":
+            if self.__stats.logging():
+                self.__stats.close_log()
+                self.command_print("Stopped logging the timings.")
+                return
+            try:
+                self.__stats.open_log()
+            except OSError:
+                self.command_print("Error in opening the log file.")
+                return
+            self.command_print("Logging the timings to {:s}.".format(
+                STATS_LOG))
+        else:
+            self.__stats.clear()
+            self.command_print("Timings cleared.")
+
+    def show_text(self, text):
+        """Replace the text in the main frame with a text to read, like the
+        help.
+
+        """
 
         # Get the default text from the default file. It is used to see if the
         # current text in the main frame is only the default text, then a pop
         # up will not ask whether you want to import.
 
         default_file = open("default_main.txt", "r")
-        default_text = default_file.read() + "\n"
+        default_text = default_file.read()
         default_file.close()
 
         self.__command_box.delete(2, END)
+        self.__edit_group = object()
 
-        # If the main frame is empty, paste the help text. If it only contains
-        # the default text, clear it and paste the help text.
+        # If the main frame is empty, paste the text. If it only contains the
+        # default text, clear it and paste the text.
 
-        if len(current_text) <= 1:
-            self.__main_frame.insert(1.0, help_text)
-        elif current_text == default_text:
+        if len(self.__document) == 0:
+            self.__main_frame.insert(1.0, text)
+        elif (len(self.__document) == len(default_text)
+              and self.__document.text() == default_text):
             self.__main_frame.delete(1.0, END)
-            self.__main_frame.insert(1.0, help_text)
+            self.__main_frame.insert(1.0, text)
 
         # If there was other text in the main frame, first show a pop up
         # asking if the user really wants to open the file. If the answer is
-        # ok, clear the main frame and paste the help text.
+        # ok, clear the main frame and paste the text.
 
         else:
             popup = messagebox.askokcancel("Open Warning",
@@ -960,8 +2497,11 @@ class Interface:
                                            "will be cleared. Continue?",
                                            icon="warning")
             if popup:
+                self.close_view()
                 self.__main_frame.delete(1.0, END)
-                self.__main_frame.insert(1.0, help_text)
+                self.__main_frame.insert(1.0, text)
+
+        self.__edit_group = None
 
     def main_frame_default(self):
         """Show the default text when the program is started.
@@ -977,6 +2517,7 @@ class Interface:
         default_text = default_file.read()
         self.__main_frame.insert(1.0, default_text)
         default_file.close()
+        self.__history.clear()
 
         # This trigger is used to record if the user has focused on the main
         # frame. If it has, the trigger will be set False, and the default
@@ -996,6 +2537,7 @@ class Interface:
 
         if self.__main_default_trigger:
             self.__main_frame.delete(1.0, END)
+            self.__history.clear()
         self.__main_default_trigger = False
 
     def clear_main_frame(self):
@@ -1005,28 +2547,25 @@ class Interface:
 
         """
 
-        # Get the line, check the syntax for errors.
-
-        line = self.__command_box.get()
-        line_list = line.split()
+        # Stop a running paste or import, so their next slices are not
+        # inserted after the text is cleared. Then clear the text and show
+        # notification in command box.
 
-        # If syntax is ok, clear the text and show notification in command box.
-
-        if len(line_list) == 2:
-            self.__main_frame.delete(1.0, END)
-            self.command_print("Main frame cleared successfully.")
-
-        # Show error message if syntax was wrong.
-
-        else:
-            self.command_print("Incorrect syntax. Try '-gg' to clear the "
-                               "main frame.")
+        self.stop_paste()
+        self.stop_import()
+        self.close_view()
+        self.__main_frame.delete(1.0, END)
+        self.command_print("Main frame cleared successfully.")
 
     def clear_main_button(self):
         """The button that clears the text in the main frame.
 
         """
 
+        self.stop_paste()
+        self.stop_import()
+        self.close_view()
+        self.__history.separate()
         self.__main_frame.delete(1.0, END)
 
     def clear_side_button(self):
@@ -1037,7 +2576,8 @@ class Interface:
 
 
 def main():
-    interface = Interface()
+    interface = Interface(sys.argv[1] if len(sys.argv) > 1 else None)
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3231 @@
+# null – Small pseudo-editor created as a final project for a university course
+#
+# The core of the editor: the document, the item list and the commands, without
+# the window. Can be run as a script to apply a file of commands to documents.
+
+########################## LICENSE ###########################
+# Copyright (c) 2021 Matias Ikkala
+#
+# This file is part of 'null.'
+#
+# 'null.' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'null.' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'null.'  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+from bisect import bisect_left, bisect_right, insort
+import collections
+import concurrent.futures
+import csv
+import fnmatch
+import glob
+import hashlib
+import io
+import itertools
+import json
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import zlib
+
+# The journals are locked with flock, or with msvcrt on Windows.
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+# Files opened in the viewer mode are read in pages of about this many bytes.
+
+VIEW_PAGE_SIZE = 256 * 1024
+
+# Text typed next to the end of a short piece is joined to it, so typing does
+# not make a new piece for every character.
+
+PIECE_MERGE_SIZE = 512
+
+# The undo history holds at most about this many characters of deleted text.
+# Each recorded edit is counted as UNDO_EDIT_COST characters more, for the
+# bookkeeping. The oldest edits are dropped first.
+
+UNDO_LIMIT = 32 * 1024 * 1024
+UNDO_EDIT_COST = 64
+
+# Saved files are written through a buffer of this size.
+
+SAVE_BUFFER_SIZE = 1024 * 1024
+
+# The edits in the main frame are written to this journal in the run folder
+# every JOURNAL_INTERVAL milliseconds, so the text can be recovered after a
+# crash. The journal is rewritten from the text when the edits in it grow past
+# JOURNAL_COMPACT_SIZE characters and the length of the text. Other editors
+# running in the same folder use numbered journals, like "null-journal-2.log".
+
+JOURNAL_FILE = "null-journal.log"
+JOURNAL_INTERVAL = 1000
+JOURNAL_COMPACT_SIZE = 4 * 1024 * 1024
+
+# Session snapshots start and end with the magic bytes. The main text comes
+# first, then the items as (name length, parent length, hash) followed by the
+# name and the parent, then the stored item texts. The index of the texts
+# and the trailer, which holds the cursor, the selection and the offsets of
+# the sections, are at the end, so the snapshot can be written in one pass.
+
+SNAPSHOT_MAGIC = b"NULLSNAP"
+SNAPSHOT_ITEM = struct.Struct("<II20s")
+SNAPSHOT_BLOB = struct.Struct("<20sQBQQ")
+SNAPSHOT_TRAILER = struct.Struct("<QqqQQQQ8s")
+
+# The items in the ITEM LIST are kept in this database in the run folder.
+
+ITEM_DATABASE = "null-items.db"
+
+# Item texts longer than this many bytes are stored compressed.
+
+COMPRESS_SIZE = 4096
+
+# Texts restored from a snapshot are added to the search index later, about
+# INDEX_STEP_SIZE bytes of text at a time.
+
+INDEX_STEP_SIZE = 256 * 1024
+
+# The texts of the items used last are kept in memory, up to this many
+# characters in total, so pasting and showing them again does not read and
+# decompress them from the database.
+
+BODY_CACHE_SIZE = 32 * 1024 * 1024
+
+# When many files are imported to the ITEM LIST at once, they are read by
+# this many threads.
+
+INGEST_WORKERS = 8
+
+# The ITEM LIST is saved to a list file as rows of LIST_HEADER, separated
+# with ";". The rows are written and read LIST_CHUNK_ROWS at a time, and a
+# text can be up to LIST_FIELD_SIZE characters long when the list is read.
+
+LIST_HEADER = ("name", "parent", "text")
+LIST_CHUNK_ROWS = 1000
+LIST_FIELD_SIZE = 2 ** 31 - 1
+
+# The latency statistics are counted from the last STATS_WINDOW timings of
+# each command. When logging is turned on, every timing is also written to
+# STATS_LOG as a line of JSON.
+
+STATS_WINDOW = 1000
+STATS_LOG = "null-stats.jsonl"
+
+# The watchdog expects the event loop to run every WATCHDOG_INTERVAL
+# milliseconds. If it is late by more than WATCHDOG_THRESHOLD milliseconds,
+# the stall is reported and written to WATCHDOG_LOG as a line of JSON.
+
+WATCHDOG_INTERVAL = 100
+WATCHDOG_THRESHOLD = 500
+WATCHDOG_LOG = "null-stalls.jsonl"
+
+
+def format_size(size):
+    """Return a byte count as a short human readable string.
+
+    """
+
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return "{:.0f} {:s}".format(size, unit)
+        size /= 1024
+    return "{:.1f} GB".format(size)
+
+
+def write_atomic(filename, chunks, newline=None, mode="w"):
+    """Write text chunks to a file so that the file is never left half written.
+
+    The chunks are written to a temporary file in the same folder, which is
+    flushed to the disk and then renamed over the original file. The newline
+    and mode arguments are passed to open(), use mode "wb" for bytes.
+
+    """
+
+    folder = os.path.dirname(os.path.abspath(filename))
+    handle, temp_name = tempfile.mkstemp(prefix=".null-", suffix=".tmp",
+                                         dir=folder)
+    try:
+        with open(handle, mode, buffering=SAVE_BUFFER_SIZE,
+                  newline=newline) as file:
+            for chunk in chunks:
+                file.write(chunk)
+            file.flush()
+            os.fsync(file.fileno())
+
+        # Keep the permissions of the file being replaced.
+
+        if os.path.exists(filename):
+            os.chmod(temp_name, os.stat(filename).st_mode)
+        else:
+            os.chmod(temp_name, 0o644)
+        os.replace(temp_name, filename)
+
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+def file_stat(filename):
+    """Return the size and modification time of a file, or None if the file
+    does not exist.
+
+    """
+
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def save_document(filename, document, saved):
+    """Save a document to a file, unless the file already has the same text.
+
+    The saved argument is the (digest, stat) pair recorded when the file was
+    last saved, or None. Returns the new pair and whether the file was
+    written.
+
+    """
+
+    # Hash the text first. If it matches the last save and the file has not
+    # been changed since, there is nothing to write.
+
+    digest = hashlib.sha1()
+    for chunk in document.chunks():
+        digest.update(chunk.encode("utf-8"))
+    digest = digest.hexdigest()
+
+    if saved is not None and saved == (digest, file_stat(filename)):
+        return saved, False
+
+    write_atomic(filename, itertools.chain(document.chunks(), ("\n",)))
+    return (digest, file_stat(filename)), True
+
+
+def snapshot_chunks(document, cursor, selection, rows, blobs):
+    """Yield the bytes of a session snapshot.
+
+    The cursor and the selection are offsets in the document, the selection
+    is a (first, last) pair or None. The rows are the (name, parent, hash)
+    of the items and the blobs the (hash, size, compressed, data) of their
+    stored texts.
+
+    """
+
+    yield SNAPSHOT_MAGIC
+    position = len(SNAPSHOT_MAGIC)
+    for chunk in document.chunks():
+        data = chunk.encode("utf-8")
+        position += len(data)
+        yield data
+    text_end = position
+
+    for name, parent, digest in rows:
+        name = name.encode("utf-8")
+        parent = parent.encode("utf-8")
+        record = (SNAPSHOT_ITEM.pack(len(name), len(parent),
+                                     bytes.fromhex(digest)) + name + parent)
+        position += len(record)
+        yield record
+    items_end = position
+
+    index = []
+    for digest, size, compressed, data in blobs:
+        index.append(SNAPSHOT_BLOB.pack(bytes.fromhex(digest), size,
+                                        compressed, position, len(data)))
+        position += len(data)
+        yield data
+    yield b"".join(index)
+
+    first, last = selection if selection is not None else (-1, -1)
+    yield SNAPSHOT_TRAILER.pack(cursor, first, last, text_end, items_end,
+                                position, len(index), SNAPSHOT_MAGIC)
+
+
+def list_chunks(rows):
+    """Yield the text of a list file in chunks. The rows are the (name,
+    parent, text) of the items, and are read one at a time.
+
+    """
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";", lineterminator="\n")
+    writer.writerow(LIST_HEADER)
+    for number, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if number % LIST_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def read_sections(filename, delimiter=None):
+    """Read a text file and return (filename, text, sections).
+
+    The sections are the parts of the text between the lines that only have
+    the delimiter, without the empty ones, or None without a delimiter. The
+    text is None if the file cannot be read or decoded.
+
+    """
+
+    try:
+        with open(filename, "r") as file:
+            text = file.read()
+    except (OSError, UnicodeDecodeError):
+        return filename, None, None
+    if delimiter is None:
+        return filename, text, None
+
+    parts = re.split(r"^{:s}[ \t]*$\n?".format(re.escape(delimiter)), text,
+                     flags=re.MULTILINE)
+    return filename, text, [part.rstrip("\n") for part in parts
+                            if part.strip()]
+
+
+def read_files(filenames, delimiter=None, workers=INGEST_WORKERS):
+    """Read many text files at once in a pool of threads. Returns the
+    results of read_sections in the order of the filenames.
+
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(lambda filename: read_sections(
+            filename, delimiter), filenames))
+
+
+class PieceTable:
+    """The document model of the text in the main frame.
+
+    The text is held as a list of pieces, each a slice of an immutable string.
+    Edits only split and replace pieces, so inserting and deleting never copy
+    the whole text, and the text can be read out piece by piece. Offsets are
+    counted in characters from the start of the text.
+
+    """
+    def __init__(self, text=""):
+        """Create the document, optionally with some text in it.
+
+        :param self.__pieces: list: Tuples of (string, start, end, newlines),
+        where newlines is the number of line breaks in string[start:end].
+        :param self.__offsets: list: Cached start offset of each piece.
+        :param self.__newlines: list: Cached number of line breaks before each
+        piece.
+        :param self.version: int: Incremented on every edit.
+
+        """
+
+        self.__pieces = []
+        self.__length = 0
+        self.__offsets = None
+        self.__newlines = None
+        self.version = 0
+        if text:
+            self.insert(0, text)
+
+    def __len__(self):
+        """Return the length of the text.
+
+        """
+
+        return self.__length
+
+    def build_cache(self):
+        """Build the cached piece offsets and line counts after an edit.
+
+        """
+
+        if self.__offsets is not None:
+            return
+
+        offsets = []
+        newlines = []
+        total = 0
+        lines = 0
+        for text, start, end, count in self.__pieces:
+            offsets.append(total)
+            newlines.append(lines)
+            total += end - start
+            lines += count
+        self.__offsets = offsets
+        self.__newlines = newlines
+
+    def locate(self, offset):
+        """Return the index of the piece containing the offset and the offset
+        within the piece. The end of the text gives the index after the last
+        piece.
+
+        """
+
+        self.build_cache()
+        index = bisect_right(self.__offsets, offset) - 1
+        if index < 0:
+            return 0, 0
+
+        text, start, end, count = self.__pieces[index]
+        inner = offset - self.__offsets[index]
+        if inner >= end - start:
+            return index + 1, 0
+        return index, inner
+
+    def offset(self, line, column):
+        """Return the offset of a position given as a line (starting from 1)
+        and a column, like the indexes of the Text widget.
+
+        """
+
+        if line > 1 and self.__pieces:
+            self.build_cache()
+
+            # Find the piece containing the line break that ends the previous
+            # line, then the line break within the piece.
+
+            before = line - 1
+            index = max(bisect_left(self.__newlines, before) - 1, 0)
+            text, start, end, count = self.__pieces[index]
+            needed = before - self.__newlines[index]
+            if needed > count:
+                return self.__length
+
+            position = start - 1
+            for i in range(needed):
+                position = text.find("\n", position + 1)
+            column += self.__offsets[index] + position + 1 - start
+
+        return min(column, self.__length)
+
+    def position(self, offset):
+        """Return the line (starting from 1) and the column of an offset, the
+        reverse of the offset method.
+
+        """
+
+        offset = min(max(offset, 0), self.__length)
+        if not self.__pieces:
+            return 1, 0
+
+        self.build_cache()
+        index = bisect_right(self.__offsets, offset) - 1
+        text, start, end, count = self.__pieces[index]
+        inner = start + offset - self.__offsets[index]
+        line = self.__newlines[index] + text.count("\n", start, inner) + 1
+
+        # The column is the distance from the line break before the offset,
+        # which may be some pieces back.
+
+        previous = text.rfind("\n", start, inner)
+        if previous >= 0:
+            return line, inner - previous - 1
+
+        column = inner - start
+        for text, start, end, count in reversed(self.__pieces[:index]):
+            if count:
+                return line, column + end - text.rfind("\n", start, end) - 1
+            column += end - start
+        return line, column
+
+    def cut(self, piece, start, end):
+        """Return the part of a piece between two offsets within the piece.
+
+        """
+
+        text, first, last, count = piece
+        if start == 0 and end == last - first:
+            return piece
+        return (text, first + start, first + end,
+                text.count("\n", first + start, first + end))
+
+    def insert(self, offset, text):
+        """Insert text at the offset.
+
+        """
+
+        if not text:
+            return
+
+        index, inner = self.locate(offset)
+        pieces = self.__pieces
+        new = (text, 0, len(text), text.count("\n"))
+
+        # If the text goes between two pieces and the previous piece ends a
+        # short string, join the text to it. Otherwise split the piece at the
+        # offset and put the new piece in between.
+
+        if inner == 0:
+            previous = pieces[index - 1] if index > 0 else None
+            if (previous is not None and previous[2] == len(previous[0])
+                    and previous[2] + len(text) <= PIECE_MERGE_SIZE):
+                pieces[index - 1] = (previous[0] + text, previous[1],
+                                     previous[2] + len(text),
+                                     previous[3] + new[3])
+            else:
+                pieces.insert(index, new)
+        else:
+            piece = pieces[index]
+            size = piece[2] - piece[1]
+            pieces[index:index + 1] = [self.cut(piece, 0, inner), new,
+                                       self.cut(piece, inner, size)]
+
+        self.__length += len(text)
+        self.changed()
+
+    def delete(self, start, end):
+        """Delete the text between two offsets. Return the removed pieces.
+
+        """
+
+        start = max(start, 0)
+        end = min(end, self.__length)
+        if start >= end:
+            return []
+
+        first, first_inner = self.locate(start)
+        last, last_inner = self.locate(end)
+        stop = last + 1 if last_inner else last
+
+        # Keep the parts of the first and last pieces that are outside of the
+        # deleted range.
+
+        kept = []
+        removed = []
+        for index in range(first, stop):
+            piece = self.__pieces[index]
+            size = piece[2] - piece[1]
+            cut_start = first_inner if index == first else 0
+            cut_end = last_inner if index == last else size
+
+            if cut_start > 0:
+                kept.append(self.cut(piece, 0, cut_start))
+            removed.append(self.cut(piece, cut_start, cut_end))
+            if cut_end < size:
+                kept.append(self.cut(piece, cut_end, size))
+
+        self.__pieces[first:stop] = kept
+        self.__length -= end - start
+        self.changed()
+        return removed
+
+    def difference(self, old):
+        """Return the range where the document differs from an earlier copy
+        of it, as (start, old_end, end), where the text between start and
+        old_end in the copy was replaced by the text between start and end.
+
+        Only the pieces are compared, so the range is found without reading
+        the text, but it may be larger than the text that really changed.
+
+        """
+
+        mine = self.__pieces
+        theirs = old.__pieces
+        shortest = min(len(mine), len(theirs))
+
+        head = 0
+        start = 0
+        while head < shortest and mine[head] == theirs[head]:
+            start += mine[head][2] - mine[head][1]
+            head += 1
+
+        tail = 0
+        suffix = 0
+        while (tail < shortest - head
+               and mine[-1 - tail] == theirs[-1 - tail]):
+            suffix += mine[-1 - tail][2] - mine[-1 - tail][1]
+            tail += 1
+
+        return start, old.__length - suffix, self.__length - suffix
+
+    def copy(self):
+        """Return a copy of the document.
+
+        Only the piece list is copied, because the strings are never changed.
+        The copy can be read in another thread while the document is edited.
+
+        """
+
+        document = PieceTable()
+        document.__pieces = list(self.__pieces)
+        document.__length = self.__length
+        document.version = self.version
+        return document
+
+    def reset(self, text=""):
+        """Replace the whole text.
+
+        """
+
+        self.delete(0, self.__length)
+        self.insert(0, text)
+
+    def changed(self):
+        """Drop the cached offsets and count the edit.
+
+        """
+
+        self.__offsets = None
+        self.__newlines = None
+        self.version += 1
+
+    def chunks(self):
+        """Yield the text piece by piece.
+
+        """
+
+        for text, start, end, count in self.__pieces:
+            if start == 0 and end == len(text):
+                yield text
+            else:
+                yield text[start:end]
+
+    def text(self, start=0, end=None):
+        """Return the text between two offsets as one string, by default the
+        whole text.
+
+        """
+
+        if start <= 0 and end is None:
+            return "".join(self.chunks())
+
+        start = max(start, 0)
+        end = self.__length if end is None else min(end, self.__length)
+        parts = []
+        index, inner = self.locate(start)
+        remaining = end - start
+        while remaining > 0:
+            text, first, last, count = self.__pieces[index]
+            part_end = min(last, first + inner + remaining)
+            parts.append(text[first + inner:part_end])
+            remaining -= part_end - first - inner
+            index += 1
+            inner = 0
+        return "".join(parts)
+
+
+class EditHistory:
+    """The undo and redo history of the document in the main frame.
+
+    Each entry is a list of edits, and each edit holds the pieces of text it
+    inserted or removed. The pieces are slices of the strings in the
+    document, so the history keeps references to the text instead of copies
+    of it. Only the removed text counts towards the memory limit, because the
+    inserted text is still in the document.
+
+    Typing and erasing character by character make runs of edits next to each
+    other, and a run is kept as one entry. Edits made with the same group, like
+    the slices of an import, are also kept as one entry.
+
+    """
+    def __init__(self, limit=UNDO_LIMIT):
+        """Create an empty history.
+
+        :param self.__undo: deque: Entries of [group, edits, cost], oldest
+        first. Each edit is [kind, offset, pieces, length], where kind is
+        "insert" or "delete".
+        :param self.__redo: list: Entries undone since the last edit.
+        :param self.__joined: bool: Whether the next edit may be joined to the
+        last entry.
+
+        """
+
+        self.__undo = collections.deque()
+        self.__redo = []
+        self.__cost = 0
+        self.__joined = False
+        self.limit = limit
+
+    def clear(self):
+        """Forget all the entries.
+
+        """
+
+        self.__undo.clear()
+        self.__redo = []
+        self.__cost = 0
+        self.__joined = False
+
+    def separate(self):
+        """Start a new entry with the next edit, even if it continues a run.
+
+        """
+
+        self.__joined = False
+
+    def record(self, kind, offset, pieces, group=None):
+        """Record an edit made to the document.
+
+        The pieces are the inserted or removed pieces, in the format of the
+        PieceTable.
+
+        """
+
+        length = sum(end - start for text, start, end, count in pieces)
+        if not length:
+            return
+        cost = UNDO_EDIT_COST + (length if kind == "delete" else 0)
+        self.__redo = []
+
+        # Edits made by typing are only joined to the run they continue, and a
+        # run ends at a line break. Grouped edits are always kept in the same
+        # entry.
+
+        entry = self.__undo[-1] if self.__undo and self.__joined else None
+        if entry is None or entry[0] is not group:
+            entry = None
+        elif group is None and any(piece[3] for piece in pieces):
+            entry = None
+        elif self.join(entry[1][-1], kind, offset, pieces, length):
+            cost -= UNDO_EDIT_COST
+        elif group is None:
+            entry = None
+        else:
+            entry[1].append([kind, offset, list(pieces), length])
+
+        if entry is None:
+            entry = [group, [[kind, offset, list(pieces), length]], 0]
+            self.__undo.append(entry)
+
+        entry[2] += cost
+        self.__cost += cost
+        self.__joined = True
+        self.trim()
+
+    def join(self, last, kind, offset, pieces, length):
+        """Join an edit to the previous edit if they are next to each other.
+        Return whether the edit was joined.
+
+        """
+
+        if last[0] != kind:
+            return False
+
+        if kind == "insert" and offset == last[1] + last[3]:
+            last[2].extend(pieces)
+        elif kind == "delete" and offset + length == last[1]:
+            last[2][:0] = pieces
+            last[1] = offset
+        elif kind == "delete" and offset == last[1]:
+            last[2].extend(pieces)
+        else:
+            return False
+
+        last[3] += length
+        return True
+
+    def trim(self):
+        """Drop the oldest entries until the history fits in the limit. The
+        newest entry is always kept.
+
+        """
+
+        while self.__cost > self.limit and len(self.__undo) > 1:
+            self.__cost -= self.__undo.popleft()[2]
+
+    def undo(self):
+        """Take the newest entry for undoing. Return its edits, or None if
+        there is nothing to undo.
+
+        """
+
+        self.__joined = False
+        if not self.__undo:
+            return None
+        entry = self.__undo.pop()
+        self.__cost -= entry[2]
+        self.__redo.append(entry)
+        return entry[1]
+
+    def redo(self):
+        """Take the last undone entry for redoing. Return its edits, or None
+        if there is nothing to redo.
+
+        """
+
+        self.__joined = False
+        if not self.__redo:
+            return None
+        entry = self.__redo.pop()
+        self.__undo.append(entry)
+        self.__cost += entry[2]
+        self.trim()
+        return entry[1]
+
+
+class Journal:
+    """Crash recovery journal of the edits in the main frame.
+
+    The edits are queued in memory as they are made, and a background thread
+    appends them to the journal file and flushes it to the disk every
+    JOURNAL_INTERVAL milliseconds, so an edit only costs an append to the
+    queue. The journal starts with a snapshot of the whole text, and is
+    compacted by queueing a new snapshot, which replaces the file.
+
+    The records are "S length" followed by the text, "I offset length"
+    followed by the inserted text, and "D start end". Lengths and offsets are
+    counted in characters.
+
+    """
+    def __init__(self, filename=JOURNAL_FILE):
+        """Create the journal. Nothing is written until start is called.
+
+        :param self.__pending: deque: Records waiting to be written.
+        :param self.size: int: Characters written since the last snapshot.
+        :param self.error: OSError: The error that stopped the writing, or
+        None.
+
+        """
+
+        self.filename = filename
+        self.size = 0
+        self.error = None
+        self.__pending = collections.deque()
+        self.__file = None
+        self.__lock = None
+        self.__thread = None
+        self.__stop = threading.Event()
+
+    def lock(self):
+        """Take the lock of the journal, so that other editors do not use the
+        same journal. Returns False if another editor holds the lock.
+
+        The lock is taken on a separate file, because the journal is replaced
+        when it is compacted. The system releases the lock if the editor
+        crashes, so the journal can be recovered by the next editor.
+
+        """
+
+        while True:
+
+            # If the lock file cannot be made, neither can the journal, and
+            # the error is reported when the journal is written.
+
+            try:
+                file = open(self.filename + ".lock", "a")
+            except OSError:
+                return True
+            try:
+                if fcntl is not None:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            except OSError:
+                file.close()
+                return False
+
+            # The editor that held the lock removes the file when it closes,
+            # and a lock on a removed file does not count, so try again.
+
+            try:
+                if os.path.samestat(os.fstat(file.fileno()),
+                                    os.stat(file.name)):
+                    self.__lock = file
+                    return True
+            except OSError:
+                pass
+            file.close()
+
+    def recover(self):
+        """Replay the journal left by an earlier run.
+
+        Returns the recovered document, or None if there is no journal. A
+        record cut short by the crash ends the replay.
+
+        """
+
+        try:
+            file = open(self.filename, "r", newline="")
+        except OSError:
+            return None
+
+        document = PieceTable()
+        with file:
+            for header in iter(file.readline, ""):
+                fields = header.split()
+                if not header.endswith("\n") or not fields:
+                    break
+                try:
+                    if fields[0] in ("S", "I") and len(fields) == (
+                            2 if fields[0] == "S" else 3):
+                        length = int(fields[-1])
+                        text = file.read(length)
+                        if len(text) < length or file.read(1) != "\n":
+                            break
+                        if fields[0] == "S":
+                            document.reset(text)
+                        else:
+                            document.insert(int(fields[1]), text)
+                    elif fields[0] == "D" and len(fields) == 3:
+                        document.delete(int(fields[1]), int(fields[2]))
+                    else:
+                        break
+                except ValueError:
+                    break
+        return document
+
+    def start(self, document):
+        """Start a new journal from a copy of the document and start the
+        writing thread.
+
+        """
+
+        self.__pending.clear()
+        self.snapshot(document)
+        self.__thread = threading.Thread(target=self.run, daemon=True)
+        self.__thread.start()
+
+    def insert(self, offset, text):
+        """Queue an insert.
+
+        """
+
+        self.__pending.append(("I", offset, text))
+
+    def delete(self, start, end):
+        """Queue a delete.
+
+        """
+
+        self.__pending.append(("D", start, end))
+
+    def snapshot(self, document):
+        """Queue a snapshot of a copy of the document, which replaces the
+        records before it.
+
+        """
+
+        self.size = 0
+        self.__pending.append(("S", document))
+
+    def run(self):
+        """Write the queued records on a timer until the journal is closed.
+
+        """
+
+        while not self.__stop.wait(JOURNAL_INTERVAL / 1000):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """Write the queued records and flush the file to the disk.
+
+        """
+
+        if self.error is not None or not self.__pending:
+            return
+
+        try:
+            while self.__pending:
+                record = self.__pending.popleft()
+                if record[0] == "S":
+                    document = record[1]
+                    if self.__file is not None:
+                        self.__file.close()
+                    write_atomic(self.filename, itertools.chain(
+                        ("S {:d}\n".format(len(document)),),
+                        document.chunks(), ("\n",)), newline="")
+                    self.__file = open(self.filename, "a", newline="")
+                    self.size = 0
+                elif record[0] == "I":
+                    text = record[2]
+                    header = "I {:d} {:d}\n".format(record[1], len(text))
+                    self.__file.write(header)
+                    self.__file.write(text)
+                    self.__file.write("\n")
+                    self.size += len(header) + len(text) + 1
+                else:
+                    header = "D {:d} {:d}\n".format(record[1], record[2])
+                    self.__file.write(header)
+                    self.size += len(header)
+
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+
+        # Stop journaling if the file cannot be written, the editor keeps
+        # working without it.
+
+        except OSError as error:
+            self.error = error
+            self.__pending.clear()
+
+    def close(self, remove=False):
+        """Write the rest of the records and stop the thread. With remove,
+        delete the journal, because the session ended normally.
+
+        """
+
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        if remove:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+
+        # The lock file is removed while the lock is held, so no other editor
+        # can take the lock of the removed file.
+
+        if self.__lock is not None:
+            if remove:
+                try:
+                    os.remove(self.__lock.name)
+                except OSError:
+                    pass
+            self.__lock.close()
+            self.__lock = None
+
+
+def open_journal(filename=JOURNAL_FILE):
+    """Return a Journal, with its lock taken, that no other editor in the
+    folder uses.
+
+    A journal left by an editor that crashed is taken first, so that its text
+    is recovered. Otherwise the journal is the first free one of the file and
+    the numbered journals next to it, like "null-journal-2.log".
+
+    """
+
+    stem, extension = os.path.splitext(filename)
+    pattern = re.compile(r"{:s}(?:-([0-9]+))?{:s}$".format(
+        re.escape(os.path.basename(stem)), re.escape(extension)))
+
+    def numbered(number):
+        if number == 1:
+            return filename
+        return "{:s}-{:d}{:s}".format(stem, number, extension)
+
+    found = set()
+    for name in os.listdir(os.path.dirname(filename) or "."):
+        match = pattern.match(name)
+        if match is not None:
+            found.add(int(match.group(1) or 1))
+
+    for number in itertools.chain(sorted(found), itertools.count(1)):
+        journal = Journal(numbered(number))
+        if journal.lock():
+            return journal
+
+
+class Snapshot:
+    """A session snapshot opened for restoring.
+
+    The file is memory-mapped. The main text, the items and the index of the
+    texts are read when the snapshot is opened, but the item texts are only
+    read from the map when they are asked for, so opening does not depend on
+    how much text the items hold.
+
+    """
+    def __init__(self, filename):
+        """Open the snapshot. Raises ValueError if the file is not a valid
+        snapshot.
+
+        :param self.cursor: int: Offset of the insert cursor in the text.
+        :param self.selection: tuple: The first and last offset of the
+        selection in the text, or None.
+        :param self.items: list: The (name, parent, hash) of the items, in
+        the order of the list.
+        :param self.blobs: dict: The (size, compressed, offset, length) of
+        each stored text, by hash.
+
+        """
+
+        self.__file = open(filename, "rb")
+        try:
+            self.__map = mmap.mmap(self.__file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except ValueError:
+            self.__file.close()
+            raise ValueError("Empty file.")
+
+        try:
+            self.read_sections()
+        except (ValueError, struct.error):
+            self.close()
+            raise ValueError("Not a valid snapshot.")
+
+    def read_sections(self):
+        """Read the trailer, the text, the items and the index.
+
+        """
+
+        data = self.__map
+        size = len(data)
+        if (size < len(SNAPSHOT_MAGIC) + SNAPSHOT_TRAILER.size
+                or data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC):
+            raise ValueError
+        trailer = size - SNAPSHOT_TRAILER.size
+        (cursor, first, last, text_end, items_end, index_start, count,
+         magic) = SNAPSHOT_TRAILER.unpack_from(data, trailer)
+        if (magic != SNAPSHOT_MAGIC or not len(SNAPSHOT_MAGIC) <= text_end
+                <= items_end <= index_start
+                or index_start + count * SNAPSHOT_BLOB.size != trailer):
+            raise ValueError
+
+        self.text = data[len(SNAPSHOT_MAGIC):text_end].decode("utf-8")
+        self.cursor = cursor
+        self.selection = (first, last) if first >= 0 else None
+
+        self.items = []
+        position = text_end
+        while position < items_end:
+            name_size, parent_size, digest = SNAPSHOT_ITEM.unpack_from(
+                data, position)
+            position += SNAPSHOT_ITEM.size
+            name = data[position:position + name_size].decode("utf-8")
+            position += name_size
+            parent = data[position:position + parent_size].decode("utf-8")
+            position += parent_size
+            self.items.append((name, parent, digest.hex()))
+
+        self.blobs = {}
+        for position in range(index_start, trailer, SNAPSHOT_BLOB.size):
+            digest, length, compressed, offset, stored = (
+                SNAPSHOT_BLOB.unpack_from(data, position))
+            if offset < items_end or offset + stored > index_start:
+                raise ValueError
+            self.blobs[digest.hex()] = (length, compressed, offset, stored)
+
+        for name, parent, digest in self.items:
+            if digest not in self.blobs:
+                raise ValueError
+
+    def blob(self, digest):
+        """Return the (hash, size, compressed, data) of a stored text.
+
+        """
+
+        size, compressed, offset, stored = self.blobs[digest]
+        return digest, size, compressed, self.__map[offset:offset + stored]
+
+    def close(self):
+        """Close the map and the file.
+
+        """
+
+        self.__map.close()
+        self.__file.close()
+
+
+class ItemStore:
+    """Persistent storage for the items in the ITEM LIST.
+
+    The items are kept in an SQLite database with their parent and position
+    among their siblings. The texts are stored once for each distinct text,
+    keyed by the hash of the text, so saving the same text under many names
+    only stores it once. Long texts are compressed. Only the names and parents
+    are held in memory. The text of an item is read from the database when it
+    is needed, and the texts used last are kept in a cache of a limited size.
+    The words of each text are kept in an index for searching.
+
+    The structure of the list is held in memory by an ItemTree, the store
+    only saves it.
+
+    """
+    def __init__(self, filename=ITEM_DATABASE, cache_size=BODY_CACHE_SIZE):
+        """Open the database, creating the tables if needed.
+
+        :param self.__cache: OrderedDict: The cached texts by hash, the one
+        used last at the end.
+        :param self.__cache_counts: Counter: The hits, misses and evictions
+        of the cache.
+
+        """
+
+        self.cache_size = cache_size
+        self.__cache = collections.OrderedDict()
+        self.__cached = 0
+        self.__cache_counts = collections.Counter()
+        self.__connection = sqlite3.connect(filename)
+        self.__connection.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                compressed INTEGER NOT NULL,
+                data BLOB NOT NULL);
+            """)
+
+        # The search index holds the distinct words of each stored text.
+
+        self.__connection.execute("""
+            CREATE TABLE IF NOT EXISTS words (
+                word TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (word, hash)) WITHOUT ROWID""")
+        self.__connection.execute("CREATE INDEX IF NOT EXISTS words_hash "
+                                  "ON words (hash)")
+        self.__connection.execute("""
+            CREATE TABLE IF NOT EXISTS unindexed (
+                hash TEXT PRIMARY KEY) WITHOUT ROWID""")
+
+        self.create_tables()
+
+    def create_tables(self):
+        """Create the items and macros tables and the indexes if they do not
+        exist.
+
+        """
+
+        self.__connection.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                name TEXT PRIMARY KEY,
+                parent TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                hash TEXT NOT NULL)""")
+        self.__connection.execute("CREATE INDEX IF NOT EXISTS items_order "
+                                  "ON items (parent, position)")
+        self.__connection.execute("CREATE INDEX IF NOT EXISTS items_hash "
+                                  "ON items (hash)")
+        self.__connection.execute("""
+            CREATE TABLE IF NOT EXISTS macros (
+                name TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                line TEXT NOT NULL,
+                PRIMARY KEY (name, position)) WITHOUT ROWID""")
+
+    def store_blob(self, body, words=None):
+        """Store a text in the blobs table unless it is already there, and
+        return its hash.
+
+        The words of a new text are added to the search index, or to the
+        list of (word, hash) rows if one is given, to be inserted later.
+
+        """
+
+        data = body.encode("utf-8")
+        digest = hashlib.sha1(data).hexdigest()
+        size = len(data)
+
+        # Compress long texts, if it makes them smaller.
+
+        compressed = 0
+        if size > COMPRESS_SIZE:
+            packed = zlib.compress(data)
+            if len(packed) < size:
+                data = packed
+                compressed = 1
+
+        cursor = self.__connection.execute(
+            "INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?)",
+            (digest, size, compressed, data))
+        if cursor.rowcount > 0:
+            if words is None:
+                self.index_words(digest, body)
+            else:
+                words.extend((word, digest) for word in
+                             set(re.findall(r"\w+", body.lower())))
+        return digest
+
+    def index_words(self, digest, body):
+        """Add the words of a text to the search index.
+
+        """
+
+        words = set(re.findall(r"\w+", body.lower()))
+        self.__connection.executemany(
+            "INSERT OR IGNORE INTO words VALUES (?, ?)",
+            ((word, digest) for word in words))
+
+    def search(self, words):
+        """Return the names of the items whose text contains all the words.
+
+        A word ending with "*" matches all words starting with it. Texts that
+        are not in the index yet are added first.
+
+        """
+
+        self.index_pending()
+        queries = []
+        arguments = []
+        for word in words:
+            word = word.lower()
+            if word.endswith("*") and len(word) > 1:
+                prefix = word[:-1]
+                queries.append("SELECT hash FROM words "
+                               "WHERE word >= ? AND word < ?")
+                arguments += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+            else:
+                queries.append("SELECT hash FROM words WHERE word = ?")
+                arguments.append(word)
+
+        rows = self.__connection.execute(
+            "SELECT name FROM items WHERE hash IN ({:s}) "
+            "ORDER BY parent != '', parent, position".format(
+                " INTERSECT ".join(queries)), arguments)
+        return [row[0] for row in rows]
+
+    def load(self):
+        """Read the names and parents of the stored items.
+
+        Returns a list of (name, parent) pairs, with the top level items first
+        and the children of each parent in order, so they can be inserted to
+        the Treeview one by one.
+
+        """
+
+        return self.__connection.execute(
+            "SELECT name, parent FROM items "
+            "ORDER BY parent != '', parent, position").fetchall()
+
+    def export_items(self):
+        """Return the (name, parent, hash) of the stored items, in the same
+        order as load.
+
+        """
+
+        return self.__connection.execute(
+            "SELECT name, parent, hash FROM items "
+            "ORDER BY parent != '', parent, position").fetchall()
+
+    def export_rows(self):
+        """Return an iterator over the (name, parent, text) of the stored
+        items, in the same order as load. The texts are read one at a time.
+
+        """
+
+        rows = self.__connection.execute(
+            "SELECT items.name, items.parent, blobs.compressed, blobs.data "
+            "FROM items JOIN blobs ON blobs.hash = items.hash "
+            "ORDER BY items.parent != '', items.parent, items.position")
+        for name, parent, compressed, data in rows:
+            if compressed:
+                data = zlib.decompress(data)
+            yield name, parent, data.decode("utf-8")
+
+    def export_blobs(self):
+        """Return an iterator over the (hash, size, compressed, data) of the
+        texts the items use. The texts are read one at a time.
+
+        """
+
+        return self.__connection.execute(
+            "SELECT hash, size, compressed, data FROM blobs "
+            "WHERE hash IN (SELECT hash FROM items)")
+
+    def missing_blobs(self, hashes):
+        """Return the hashes of the texts that are not stored.
+
+        """
+
+        hashes = list(hashes)
+        found = set()
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            rows = self.__connection.execute(
+                "SELECT hash FROM blobs WHERE hash IN ({:s})".format(
+                    ",".join("?" * len(batch))), batch)
+            found.update(row[0] for row in rows)
+        return [digest for digest in hashes if digest not in found]
+
+    def replace_items(self, rows, blobs):
+        """Replace all the items.
+
+        The rows are the (name, parent, hash) of the new items in the order
+        of the list, and the blobs the (hash, size, compressed, data) of the
+        texts that are not stored yet. The texts are stored as they are,
+        without decompressing them, and added to the search index later by
+        index_pending.
+
+        """
+
+        with self.__connection:
+            for digest, size, compressed, data in blobs:
+                cursor = self.__connection.execute(
+                    "INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?)",
+                    (digest, size, compressed, data))
+                if cursor.rowcount > 0:
+                    self.__connection.execute(
+                        "INSERT OR IGNORE INTO unindexed VALUES (?)",
+                        (digest,))
+
+            positions = collections.Counter()
+            records = []
+            for name, parent, digest in rows:
+                records.append((name, parent, positions[parent], digest))
+                positions[parent] += 1
+
+            self.__connection.execute("DELETE FROM items")
+            self.__connection.executemany(
+                "INSERT INTO items VALUES (?, ?, ?, ?)", records)
+            self.__connection.execute(
+                "DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM items)")
+            self.__connection.execute(
+                "DELETE FROM words WHERE hash NOT IN (SELECT hash FROM blobs)")
+            self.__connection.execute(
+                "DELETE FROM unindexed WHERE hash NOT IN "
+                "(SELECT hash FROM blobs)")
+
+    def index_pending(self, limit=None):
+        """Add the texts stored by replace_items to the search index, about
+        limit bytes of text at a time, or all of them. Returns True if there
+        are texts left to index.
+
+        """
+
+        with self.__connection:
+            rows = self.__connection.execute(
+                "SELECT blobs.hash, blobs.size, blobs.compressed, blobs.data "
+                "FROM unindexed JOIN blobs ON blobs.hash = unindexed.hash")
+            done = 0
+            indexed = []
+            for digest, size, compressed, data in rows:
+                if limit is not None and indexed and done + size > limit:
+                    rows.close()
+                    break
+                try:
+                    if compressed:
+                        data = zlib.decompress(data)
+                    self.index_words(digest, data.decode("utf-8"))
+                except (zlib.error, UnicodeDecodeError):
+                    pass
+                indexed.append((digest,))
+                done += size
+            self.__connection.executemany(
+                "DELETE FROM unindexed WHERE hash = ?", indexed)
+        return self.__connection.execute(
+            "SELECT 1 FROM unindexed LIMIT 1").fetchone() is not None
+
+    def body(self, name):
+        """Return the text of an item. Raises KeyError if there is no item
+        with the name.
+
+        """
+
+        return self.bodies([name])[0]
+
+    def bodies(self, names):
+        """Return the texts of many items, in the same order as the names.
+        Raises KeyError if an item is not found.
+
+        """
+
+        # Find the hashes of the texts, then read the texts that are not in
+        # the cache. The names are looked up in batches, because the number
+        # of query parameters is limited.
+
+        hashes = {}
+        unique = list(set(names))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            hashes.update(self.__connection.execute(
+                "SELECT name, hash FROM items WHERE name IN ({:s})".format(
+                    ",".join("?" * len(batch))), batch))
+
+        texts = {}
+        missing = []
+        for digest in set(hashes.values()):
+            text = self.cached(digest)
+            if text is None:
+                missing.append(digest)
+            else:
+                texts[digest] = text
+
+        for start in range(0, len(missing), 500):
+            batch = missing[start:start + 500]
+            rows = self.__connection.execute(
+                "SELECT hash, compressed, data FROM blobs "
+                "WHERE hash IN ({:s})".format(",".join("?" * len(batch))),
+                batch)
+            for digest, compressed, data in rows:
+                if compressed:
+                    data = zlib.decompress(data)
+                texts[digest] = data.decode("utf-8")
+                self.cache(digest, texts[digest])
+
+        return [texts[hashes[name]] for name in names]
+
+    def cached(self, digest):
+        """Return a text from the cache and mark it used, or None if it is
+        not cached.
+
+        """
+
+        text = self.__cache.get(digest)
+        if text is None:
+            self.__cache_counts["misses"] += 1
+            return None
+        self.__cache.move_to_end(digest)
+        self.__cache_counts["hits"] += 1
+        return text
+
+    def cache(self, digest, text):
+        """Add a text to the cache, and drop the texts used longest ago until
+        the cache fits in its size. Texts larger than the cache are not
+        cached.
+
+        """
+
+        if len(text) > self.cache_size or digest in self.__cache:
+            return
+        self.__cache[digest] = text
+        self.__cached += len(text)
+        while self.__cached > self.cache_size:
+            digest, text = self.__cache.popitem(last=False)
+            self.__cached -= len(text)
+            self.__cache_counts["evictions"] += 1
+
+    def uncache(self, hashes):
+        """Drop texts from the cache.
+
+        """
+
+        for digest in hashes:
+            text = self.__cache.pop(digest, None)
+            if text is not None:
+                self.__cached -= len(text)
+
+    def cache_usage(self):
+        """Return the number of cached texts, their total length, and the
+        hits, misses and evictions of the cache.
+
+        """
+
+        counts = self.__cache_counts
+        return (len(self.__cache), self.__cached, counts["hits"],
+                counts["misses"], counts["evictions"])
+
+    def largest(self, count):
+        """Return the (name, size, stored size) of the items with the
+        largest texts, the largest first. Sizes are in bytes.
+
+        """
+
+        return self.__connection.execute(
+            "SELECT items.name, blobs.size, LENGTH(blobs.data) FROM items "
+            "JOIN blobs ON blobs.hash = items.hash "
+            "ORDER BY blobs.size DESC, items.name LIMIT ?",
+            (count,)).fetchall()
+
+    def previews(self, names, length):
+        """Return the beginnings of the texts of many items.
+
+        Returns a list of (text, size, truncated) tuples, where text is at
+        most length characters, size is the size of the whole text in bytes,
+        and truncated tells if the text was cut. Only the beginning of each
+        text is read and decompressed.
+
+        """
+
+        # A character takes at most four bytes. Compressed data is never much
+        # longer than the text it holds, zlib only adds a header and a few
+        # bytes for each block it could not compress, so a small margin
+        # covers the data needed for the first bytes of a compressed text.
+
+        limit = length * 4
+        packed = limit + limit // 1024 + 1024
+        found = {}
+        unique = list(set(names))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            rows = self.__connection.execute(
+                "SELECT items.name, items.hash, blobs.size, blobs.compressed, "
+                "SUBSTR(blobs.data, 1, CASE WHEN blobs.compressed THEN ? "
+                "ELSE ? END) FROM items "
+                "JOIN blobs ON blobs.hash = items.hash "
+                "WHERE items.name IN ({:s})".format(
+                    ",".join("?" * len(batch))),
+                [packed, limit] + batch)
+            for name, digest, size, compressed, data in rows:
+                text = self.cached(digest)
+                if text is not None:
+                    found[name] = (text[:length], size, len(text) > length)
+                    continue
+                if compressed:
+                    data = zlib.decompressobj().decompress(data, limit)
+                text = data.decode("utf-8", errors="ignore")
+                truncated = len(text) > length or len(data) < size
+                found[name] = (text[:length], size, truncated)
+
+        return [found[name] for name in names]
+
+    def add(self, name, parent, body):
+        """Store a new item as the last child of the parent.
+
+        """
+
+        with self.__connection:
+            digest = self.store_blob(body)
+            self.__connection.execute(
+                "INSERT INTO items (name, parent, position, hash) "
+                "SELECT ?, ?, COALESCE(MAX(position) + 1, 0), ? FROM items "
+                "WHERE parent = ?", (name, parent, digest, parent))
+
+    def add_many(self, rows):
+        """Store many new items at once, in one transaction. The rows are the
+        (name, parent, body) of the items, and each item is put last among
+        the children of its parent. The rows are read one at a time, and if
+        reading them raises an error, none of the items are stored.
+
+        """
+
+        # The items and the words of the texts are inserted in batches of
+        # 500 rows.
+
+        positions = {}
+        records = []
+        words = []
+        with self.__connection:
+            for name, parent, body in rows:
+                if parent not in positions:
+                    positions[parent] = self.__connection.execute(
+                        "SELECT COALESCE(MAX(position) + 1, 0) FROM items "
+                        "WHERE parent = ?", (parent,)).fetchone()[0]
+                records.append((name, parent, positions[parent],
+                                self.store_blob(body, words)))
+                positions[parent] += 1
+                if len(records) == 500:
+                    self.insert_batch(records, words)
+            self.insert_batch(records, words)
+
+    def insert_batch(self, records, words):
+        """Insert the item records and the word index rows collected by
+        add_many, and empty the lists.
+
+        """
+
+        self.__connection.executemany(
+            "INSERT INTO items VALUES (?, ?, ?, ?)", records)
+        self.__connection.executemany(
+            "INSERT OR IGNORE INTO words VALUES (?, ?)", words)
+        del records[:]
+        del words[:]
+
+    def remove(self, names, orders=None):
+        """Remove items. The children of the items must be included.
+
+        The positions of the remaining siblings are given in the orders, like
+        in set_orders, and saved in the same transaction.
+
+        """
+
+        # Delete the items, then the texts no other item uses.
+
+        with self.__connection:
+            if orders:
+                self.write_orders(orders)
+            hashes = set()
+            for name in names:
+                row = self.__connection.execute(
+                    "SELECT hash FROM items WHERE name = ?",
+                    (name,)).fetchone()
+                if row is not None:
+                    hashes.add(row[0])
+            self.__connection.executemany(
+                "DELETE FROM items WHERE name = ?",
+                ((name,) for name in names))
+            self.__connection.executemany(
+                "DELETE FROM blobs WHERE hash = ? AND NOT EXISTS "
+                "(SELECT 1 FROM items WHERE items.hash = blobs.hash)",
+                ((digest,) for digest in hashes))
+            self.__connection.executemany(
+                "DELETE FROM words WHERE hash = ? AND NOT EXISTS "
+                "(SELECT 1 FROM blobs WHERE blobs.hash = words.hash)",
+                ((digest,) for digest in hashes))
+            self.__connection.executemany(
+                "DELETE FROM unindexed WHERE hash = ? AND NOT EXISTS "
+                "(SELECT 1 FROM blobs WHERE blobs.hash = unindexed.hash)",
+                ((digest,) for digest in hashes))
+        self.uncache(hashes)
+
+    def save_macro(self, name, lines):
+        """Store the command lines of a macro, replacing an earlier macro with
+        the same name.
+
+        """
+
+        with self.__connection:
+            self.__connection.execute("DELETE FROM macros WHERE name = ?",
+                                      (name,))
+            self.__connection.executemany(
+                "INSERT INTO macros VALUES (?, ?, ?)",
+                ((name, position, line) for position, line in
+                 enumerate(lines)))
+
+    def macro(self, name):
+        """Return the command lines of a macro. Raises KeyError if there is
+        no macro with the name.
+
+        """
+
+        lines = [row[0] for row in self.__connection.execute(
+            "SELECT line FROM macros WHERE name = ? ORDER BY position",
+            (name,))]
+        if not lines:
+            raise KeyError(name)
+        return lines
+
+    def usage(self):
+        """Return the number of items, the total size of their texts, the
+        number of distinct texts and the size they take in the database.
+
+        """
+
+        items, logical = self.__connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(blobs.size), 0) FROM items "
+            "JOIN blobs ON blobs.hash = items.hash").fetchone()
+        blobs, stored = self.__connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) "
+            "FROM blobs").fetchone()
+        return items, logical, blobs, stored
+
+    def set_order(self, parent, names, start=0):
+        """Store the parent and the positions of children of the parent.
+
+        The names are the children from the start position onwards, so only
+        the part of the list that changed needs to be given.
+
+        """
+
+        self.set_orders({parent: (names, start)})
+
+    def set_orders(self, orders):
+        """Store the children of many parents in one transaction.
+
+        The orders map each parent to the names of its children from a start
+        position onwards and the start position, like in set_order.
+
+        """
+
+        with self.__connection:
+            self.write_orders(orders)
+
+    def write_orders(self, orders):
+        """Update the parents and the positions of the children given in
+        the orders, without committing.
+
+        """
+
+        self.__connection.executemany(
+            "UPDATE items SET parent = ?, position = ? WHERE name = ?",
+            ((parent, position, name)
+             for parent, (names, start) in orders.items()
+             for position, name in enumerate(names, start)))
+
+
+class NameIndex:
+    """The names of the items in sorted order, for completing names.
+
+    The names starting with a prefix are next to each other in a sorted list,
+    so they are found by bisecting, like walking down a prefix tree, without
+    keeping a node for every character. Added names wait in a list and are
+    sorted in when the index is next searched, so adding many names at once,
+    like when a session is opened, does not insert them one by one.
+
+    """
+    def __init__(self):
+        """Create an empty index.
+
+        :param self.__names: list: The names in sorted order.
+        :param self.__added: list: The names added since the last search.
+        :param self.__lines: str: The names on separate lines for the fuzzy
+        search, or None if the names have changed.
+
+        """
+
+        self.__names = []
+        self.__added = []
+        self.__lines = None
+
+    def add(self, name):
+        """Add a name.
+
+        """
+
+        self.__added.append(name)
+        self.__lines = None
+
+    def discard(self, names):
+        """Remove names.
+
+        """
+
+        self.update()
+        if len(names) < 64:
+            for name in names:
+                index = bisect_left(self.__names, name)
+                if index < len(self.__names) and self.__names[index] == name:
+                    del self.__names[index]
+        else:
+            names = set(names)
+            self.__names = [name for name in self.__names
+                            if name not in names]
+        self.__lines = None
+
+    def update(self):
+        """Sort the added names in.
+
+        """
+
+        if len(self.__added) < 64:
+            for name in self.__added:
+                insort(self.__names, name)
+        else:
+            self.__names.extend(self.__added)
+            self.__names.sort()
+        self.__added = []
+
+    def complete(self, prefix, limit=20):
+        """Return at most limit names starting with the prefix, in sorted
+        order.
+
+        """
+
+        if self.__added:
+            self.update()
+        start = bisect_left(self.__names, prefix)
+        names = []
+        for name in itertools.islice(self.__names, start, start + limit):
+            if not name.startswith(prefix):
+                break
+            names.append(name)
+        return names
+
+    def fuzzy(self, pattern, limit=20):
+        """Return at most limit names that have the characters of the pattern
+        in the same order, ignoring case.
+
+        The names where the characters are found earliest and closest to each
+        other come first.
+
+        """
+
+        if not pattern:
+            return []
+        if self.__added:
+            self.update()
+        if self.__lines is None:
+            self.__lines = "\n".join(self.__names)
+
+        # The names are searched all at once with a regular expression. After
+        # a match the search goes on from the next line, so each name is found
+        # once, at the earliest place where the pattern starts.
+
+        expression = re.compile("[^\n]*?".join(
+            re.escape(character) for character in pattern), re.IGNORECASE)
+        lines = self.__lines
+        found = []
+        position = 0
+        while True:
+            match = expression.search(lines, position)
+            if match is None:
+                break
+            start = lines.rfind("\n", 0, match.start()) + 1
+            position = lines.find("\n", match.end())
+            if position < 0:
+                position = len(lines)
+            found.append((match.start() - start, match.end() - match.start(),
+                          position - start, lines[start:position]))
+            position += 1
+        found.sort()
+        return [name for start, span, length, name in found[:limit]]
+
+
+class ItemTree:
+    """The structure of the ITEM LIST, kept in Python.
+
+    Mirrors the items in the Treeview widget, so the parent, the siblings and
+    the position of an item can be looked up without asking the widget. The
+    position of each item among its siblings is kept in a dictionary, and
+    updated when the list of siblings changes.
+
+    """
+    def __init__(self):
+        """Create an empty tree.
+
+        :param self.__parents: dict: The parent of each item, "" for the items
+        on the top level.
+        :param self.__children: dict: The list of children of each item, and
+        of the top level under "".
+        :param self.__positions: dict: The position of each item in the list
+        of children of its parent.
+        :param self.names: NameIndex: The names of the items, for completing
+        them.
+
+        """
+
+        self.clear()
+
+    def clear(self):
+        """Remove all the items.
+
+        """
+
+        self.__parents = {}
+        self.__children = {"": []}
+        self.__positions = {}
+        self.names = NameIndex()
+
+    def __contains__(self, name):
+        """Return True if the item is in the tree.
+
+        """
+
+        return name in self.__parents
+
+    def __len__(self):
+        """Return the number of items in the tree.
+
+        """
+
+        return len(self.__parents)
+
+    def parent(self, name):
+        """Return the parent of the item, "" for items on the top level.
+
+        """
+
+        return self.__parents[name]
+
+    def children(self, name=""):
+        """Return the list of children of the item, or the top level items.
+        The list must not be changed.
+
+        """
+
+        return self.__children[name]
+
+    def index(self, name):
+        """Return the position of the item among its siblings.
+
+        """
+
+        return self.__positions[name]
+
+    def next(self, name):
+        """Return the next sibling of the item, or "" if it is the last.
+
+        """
+
+        siblings = self.__children[self.__parents[name]]
+        position = self.__positions[name] + 1
+        if position < len(siblings):
+            return siblings[position]
+        return ""
+
+    def match(self, pattern):
+        """Return the items with names matching a pattern, like "item*", in
+        the order they are in the list.
+
+        """
+
+        return sorted(fnmatch.filter(self.__parents, pattern),
+                      key=self.tree_order)
+
+    def tree_order(self, name):
+        """Return a key that sorts items in the order they are in the list.
+
+        """
+
+        parent = self.__parents[name]
+        if parent == "":
+            return self.__positions[name], -1
+        return self.__positions[parent], self.__positions[name]
+
+    def renumber(self, parent, start):
+        """Update the positions of the children of the parent, from the given
+        position to the end.
+
+        """
+
+        siblings = self.__children[parent]
+        for position in range(start, len(siblings)):
+            self.__positions[siblings[position]] = position
+
+    def insert(self, name, parent="", index=None):
+        """Add an item under the parent, at the index or at the end.
+
+        """
+
+        siblings = self.__children[parent]
+        if index is None or index > len(siblings):
+            index = len(siblings)
+        siblings.insert(index, name)
+        self.__parents[name] = parent
+        self.__children[name] = []
+        self.renumber(parent, index)
+        self.names.add(name)
+
+    def remove_many(self, names):
+        """Remove many items and their children at once.
+
+        Returns the items whose parents were not removed, which is enough to
+        delete all from the Treeview, and the list of all removed items.
+
+        """
+
+        names = set(names)
+        roots = [name for name in names if self.__parents[name] not in names]
+        parents = {self.__parents[name] for name in roots}
+
+        removed = list(roots)
+        for item in removed:
+            removed.extend(self.__children.pop(item))
+            del self.__parents[item]
+            del self.__positions[item]
+
+        # Filter the removed items from the lists of siblings, once for each
+        # parent.
+
+        for parent in parents:
+            self.__children[parent] = [child
+                                       for child in self.__children[parent]
+                                       if child in self.__parents]
+            self.renumber(parent, 0)
+        self.names.discard(removed)
+        return roots, removed
+
+    def move_many(self, names, parent, index=None):
+        """Move many items under the parent at once, keeping their order.
+
+        The items are put at the index, or at the end. Returns the parents
+        whose children changed.
+
+        """
+
+        moving = set(names)
+        parents = {self.__parents[name] for name in names}
+        parents.add(parent)
+        for old_parent in parents:
+            self.__children[old_parent] = [
+                child for child in self.__children[old_parent]
+                if child not in moving]
+
+        siblings = self.__children[parent]
+        if index is None or index > len(siblings):
+            index = len(siblings)
+        siblings[index:index] = names
+        for name in names:
+            self.__parents[name] = parent
+
+        for changed in parents:
+            self.renumber(changed, 0)
+        return parents
+
+    def move(self, name, parent, index=None):
+        """Move the item under the parent, to the index or to the end.
+
+        """
+
+        old_parent = self.__parents[name]
+        old_index = self.__positions[name]
+
+        # Moving one step among the same siblings only swaps two items.
+
+        siblings = self.__children[parent]
+        if (old_parent == parent and index is not None
+                and abs(index - old_index) == 1 and index < len(siblings)):
+            other = siblings[index]
+            siblings[index], siblings[old_index] = name, other
+            self.__positions[name] = index
+            self.__positions[other] = old_index
+            return
+
+        del self.__children[old_parent][old_index]
+        if index is None or index > len(siblings):
+            index = len(siblings)
+        siblings.insert(index, name)
+        self.__parents[name] = parent
+
+        if old_parent == parent:
+            self.renumber(parent, min(index, old_index))
+        else:
+            self.renumber(old_parent, old_index)
+            self.renumber(parent, index)
+
+
+class PagedFile:
+    """A memory-mapped file that is read in pages for the viewer mode.
+
+    The file is split into pages of about VIEW_PAGE_SIZE bytes, each ending
+    at a line break, so any page can be found without reading the file before
+    it. A line longer than a page is split between pages, so a page is never
+    more than twice VIEW_PAGE_SIZE bytes. A background thread counts the lines
+    of each page to build the line index used for showing line numbers.
+
+    """
+    def __init__(self, filename):
+        """Memory-map the file and start building the line index.
+
+        :param self.__page_starts: dict: Cache of page numbers and the byte
+        offsets where the pages start.
+        :param self.__page_lines: list: Number of the first line of each page,
+        filled by the index thread.
+
+        """
+
+        self.__file = open(filename, "rb")
+        self.__map = mmap.mmap(self.__file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        self.__size = len(self.__map)
+        self.__page_starts = {0: 0}
+        self.__page_lines = [1]
+        self.__closed = False
+        self.name = filename
+        self.page_count = -(-self.__size // VIEW_PAGE_SIZE)
+
+        self.__thread = threading.Thread(target=self.build_index, daemon=True)
+        self.__thread.start()
+
+    def page_start(self, page):
+        """Return the byte offset where the page starts.
+
+        A page starts after the first line break following its nominal start,
+        so that pages do not split lines. If there is no line break within
+        VIEW_PAGE_SIZE bytes, the page starts at its nominal start, moved
+        forward to the start of a UTF-8 character.
+
+        """
+
+        if page >= self.page_count:
+            return self.__size
+        if page not in self.__page_starts:
+            start = page * VIEW_PAGE_SIZE
+            offset = self.__map.find(b"\n", start - 1,
+                                     start - 1 + VIEW_PAGE_SIZE) + 1
+            if offset == 0:
+                offset = start
+                while (offset < self.__size
+                       and self.__map[offset] & 0xC0 == 0x80):
+                    offset += 1
+            self.__page_starts[page] = offset
+        return self.__page_starts[page]
+
+    def page_text(self, page):
+        """Return the decoded text of a page. Empty if the page has no lines.
+
+        """
+
+        data = self.__map[self.page_start(page):self.page_start(page + 1)]
+        return data.decode("utf-8", errors="replace")
+
+    def build_index(self):
+        """Count the lines of every page. Run in a background thread.
+
+        """
+
+        try:
+            for page in range(self.page_count):
+                if self.__closed:
+                    return
+                start = self.page_start(page)
+                end = self.page_start(page + 1)
+                lines = self.__map[start:end].count(b"\n")
+                self.__page_lines.append(self.__page_lines[-1] + lines)
+
+        # The map is closed under the thread if the viewer is closed.
+
+        except ValueError:
+            return
+
+    def first_line(self, page):
+        """Return the number of the first line on the page, or None if the
+        index has not reached the page yet.
+
+        """
+
+        if page < len(self.__page_lines):
+            return self.__page_lines[page]
+        return None
+
+    def line_count(self):
+        """Return the number of lines in the file, or None if the index is
+        still being built.
+
+        """
+
+        if len(self.__page_lines) > self.page_count:
+            return self.__page_lines[-1]
+        return None
+
+    def close(self):
+        """Stop the index thread and close the map and the file.
+
+        """
+
+        self.__closed = True
+        self.__map.close()
+        self.__file.close()
+
+
+class LatencyStats:
+    """Rolling latency statistics of the commands and key bindings.
+
+    The last STATS_WINDOW timings of each command are kept, and the
+    percentiles are counted from them when a report is made, so recording a
+    timing only appends it to a deque.
+
+    """
+    def __init__(self, window=STATS_WINDOW):
+        """Create empty statistics.
+
+        :param self.__samples: dict: A deque of the latest timings of each
+        command, in seconds.
+        :param self.__counts: Counter: The number of timings of each command.
+        :param self.__log: file: The log the timings are written to, or None.
+
+        """
+
+        self.window = window
+        self.__samples = {}
+        self.__counts = collections.Counter()
+        self.__log = None
+
+    def record(self, name, seconds):
+        """Record a timing of a command.
+
+        """
+
+        samples = self.__samples.get(name)
+        if samples is None:
+            samples = self.__samples[name] = collections.deque(
+                maxlen=self.window)
+        samples.append(seconds)
+        self.__counts[name] += 1
+
+        if self.__log is not None:
+            self.__log.write(json.dumps({"time": round(time.time(), 3),
+                                         "command": name,
+                                         "ms": round(seconds * 1000, 3)}))
+            self.__log.write("\n")
+
+    def timed(self, function, name=None):
+        """Return a function that calls the function and records how long
+        the call took, under the name of the function by default.
+
+        """
+
+        if name is None:
+            name = function.__name__
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - start)
+
+        return call
+
+    def report(self):
+        """Return (name, count, p50, p95, max) of each command, in seconds,
+        the slowest first by the 95th percentile.
+
+        """
+
+        rows = []
+        for name, samples in self.__samples.items():
+            ordered = sorted(samples)
+            last = len(ordered) - 1
+            rows.append((name, self.__counts[name],
+                         ordered[min(last, int(len(ordered) * 0.5))],
+                         ordered[min(last, int(len(ordered) * 0.95))],
+                         ordered[last]))
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows
+
+    def report_text(self):
+        """Return the report as a table of milliseconds.
+
+        """
+
+        lines = ["{:<24s} {:>8s} {:>10s} {:>10s} {:>10s}".format(
+            "COMMAND", "COUNT", "P50 MS", "P95 MS", "MAX MS")]
+        for name, count, median, high, most in self.report():
+            lines.append("{:<24s} {:>8d} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                name, count, median * 1000, high * 1000, most * 1000))
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        """Forget all the timings.
+
+        """
+
+        self.__samples.clear()
+        self.__counts.clear()
+
+    def logging(self):
+        """Return whether the timings are written to a log.
+
+        """
+
+        return self.__log is not None
+
+    def open_log(self, filename=STATS_LOG):
+        """Start appending the timings to a log file.
+
+        """
+
+        self.close_log()
+        self.__log = open(filename, "a")
+
+    def close_log(self):
+        """Stop writing the timings to the log.
+
+        """
+
+        if self.__log is not None:
+            self.__log.close()
+            self.__log = None
+
+
+class StallWatchdog:
+    """Finds out what blocks the event loop.
+
+    The event loop calls beat every WATCHDOG_INTERVAL milliseconds. A helper
+    thread checks how long ago the last beat was, and while the loop is
+    blocked for longer than the threshold, it samples the stack of the main
+    thread and notes the innermost method of the owner class that is running.
+    When the loop runs again, beat returns the length of the stall and the
+    samples.
+
+    """
+    def __init__(self, owner, threshold=WATCHDOG_THRESHOLD):
+        """Create the watchdog for the methods of a class. Start it with
+        start.
+
+        :param self.__samples: list: The (method, stack) samples taken during
+        the current stall.
+
+        """
+
+        self.owner = owner.__name__
+        self.methods = set(dir(owner))
+        self.threshold = threshold / 1000
+        self.__main = threading.get_ident()
+        self.__last = time.perf_counter()
+        self.__samples = []
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        """Start the sampling thread. Must be called in the main thread.
+
+        """
+
+        self.__main = threading.get_ident()
+        self.__last = time.perf_counter()
+        self.__thread = threading.Thread(target=self.run, daemon=True)
+        self.__thread.start()
+
+    def beat(self):
+        """Tell the watchdog the event loop is running. Returns None, or the
+        length of the stall in seconds and the samples taken during it, if
+        the last beat was too long ago.
+
+        """
+
+        now = time.perf_counter()
+        late = now - self.__last - WATCHDOG_INTERVAL / 1000
+        self.__last = now
+        samples, self.__samples = self.__samples, []
+        if late < self.threshold:
+            return None
+        return late, samples
+
+    def run(self):
+        """Sample the main thread while the event loop is blocked.
+
+        """
+
+        while not self.__stop.wait(WATCHDOG_INTERVAL / 2000):
+            if (time.perf_counter() - self.__last - WATCHDOG_INTERVAL / 1000
+                    > self.threshold):
+                frame = sys._current_frames().get(self.__main)
+                if frame is not None:
+                    self.__samples.append(self.sample(frame))
+
+    def sample(self, frame):
+        """Return the innermost running method of the owner class and the
+        stack of a frame.
+
+        """
+
+        method = None
+        inner = frame
+        while inner is not None and method is None:
+            code = inner.f_code
+            name = getattr(code, "co_qualname", None)
+            if name is not None and name.startswith(self.owner + "."):
+                method = code.co_name
+            elif name is None and code.co_name in self.methods:
+                method = code.co_name
+            inner = inner.f_back
+
+        stack = ["{:s}:{:d} in {:s}".format(os.path.basename(entry.filename),
+                                            entry.lineno, entry.name)
+                 for entry in traceback.extract_stack(frame)]
+        return method, stack
+
+    def report(self, late, samples):
+        """Return the method that was seen running most often during a stall,
+        or None, and write the stall to the log.
+
+        """
+
+        methods = collections.Counter(method for method, stack in samples
+                                      if method is not None)
+        method = methods.most_common(1)[0][0] if methods else None
+        stack = next((stack for found, stack in samples if found == method),
+                     [])
+
+        try:
+            with open(WATCHDOG_LOG, "a") as log:
+                log.write(json.dumps({"time": round(time.time(), 3),
+                                      "ms": round(late * 1000),
+                                      "method": method,
+                                      "methods": dict(methods),
+                                      "stack": stack}))
+                log.write("\n")
+        except OSError:
+            pass
+        return method
+
+    def close(self):
+        """Stop the sampling thread.
+
+        """
+
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+
+
+class CommandError(Exception):
+    """A command could not be run. The message tells why, and is shown to the
+    user as it is.
+
+    """
+
+
+def check_text_file(filename, command):
+    """Check the filename given to "-ex" or "-im": only ".txt" files in the
+    run folder are saved and opened. Raises CommandError if the filename is
+    not allowed.
+
+    """
+
+    if "/" in filename or os.sep in filename:
+        if command == "-ex":
+            raise CommandError("Only saving in the run folder allowed.")
+        raise CommandError("Only opening from the run folder allowed.")
+    parts = filename.split(".")
+    if len(parts) != 2 or parts[1] != "txt":
+        raise CommandError("Incorrect syntax. Use form '{:s} /filename.txt/'"
+                           .format(command))
+
+
+# The parts of a command line: text in double or single quotes, white space,
+# other text, and a quote that is not closed.
+
+COMMAND_PART = re.compile(r'"([^"]*)"|\'([^\']*)\'|(\s+)|([^\s"\']+)|(["\'])')
+
+
+def split_command(line):
+    """Split a command line into words. Text in quotes is part of a word,
+    even if it has white space, and the quotes are removed, so an item
+    name with spaces is given like "-s 'my item'". Raises CommandError if a
+    quote is not closed.
+
+    """
+
+    words = []
+    word = None
+    for match in COMMAND_PART.finditer(line):
+        double, single, space, text, quote = match.groups()
+        if quote is not None:
+            raise CommandError("Missing closing quote.")
+        if space is not None:
+            if word is not None:
+                words.append(word)
+            word = None
+        else:
+            word = (word or "") + (text if text is not None else
+                                   double if double is not None else single)
+    if word is not None:
+        words.append(word)
+    return words
+
+
+def quote_word(word):
+    """Return a word the way it is typed in a command line, the reverse of
+    split_command. A word with white space or quotes is put in quotes.
+
+    """
+
+    if word and not re.search(r"[\s\"']", word):
+        return word
+    if "'" in word:
+        return '"' + word + '"'
+    return "'" + word + "'"
+
+
+class CommandTable:
+    """The commands that can be typed, and how their arguments are read.
+
+    Each command is added with the function it calls and its usages, like
+    "-cs -/parent/ /item_name/". A usage is both the schema of the arguments
+    and the form shown when the syntax is wrong. After the command, each word
+    of a usage is one argument given to the function:
+
+    "/name/" is any word. "-/name/" is a word starting with "-", given without
+    the "-". "top|bottom" is one of the words, and "top|-/name/" is the word
+    top or a word starting with "-". "[...]" is optional, and None is given
+    if it is missing. "/name/..." is one or more words given as a list, last
+    in the usage.
+
+    The usages are compiled when the commands are added, so a command line is
+    split once and its words are checked against the table.
+
+    """
+    def __init__(self):
+        """Create an empty table.
+
+        :param self.__commands: dict: The function, the usages and the
+        compiled usages of each command.
+
+        """
+
+        self.__commands = {}
+
+    def __contains__(self, name):
+        """Return True if there is a command with the name.
+
+        """
+
+        return name in self.__commands
+
+    def add(self, function, *usages):
+        """Add a command with one or more usages. The name of the command is
+        the first word of the usages.
+
+        """
+
+        name = usages[0].split()[0]
+        patterns = [self.compile(usage.split()[1:]) for usage in usages]
+        self.__commands[name] = (function, usages, patterns)
+
+    def compile(self, words):
+        """Compile the argument words of a usage into a list of (optional,
+        repeated, alternatives), and the number of required arguments.
+
+        """
+
+        arguments = []
+        required = 0
+        for word in words:
+            optional = word.startswith("[") and word.endswith("]")
+            if optional:
+                word = word[1:-1]
+            repeated = word.endswith("...")
+            if repeated:
+                word = word[:-3]
+            alternatives = []
+            for alternative in word.split("|"):
+                if alternative.startswith("-/"):
+                    alternatives.append((False, "-"))
+                elif alternative.startswith("/"):
+                    alternatives.append((False, ""))
+                else:
+                    alternatives.append((True, alternative))
+            arguments.append((optional, repeated, alternatives))
+            if not optional:
+                required += 1
+        return arguments, required
+
+    def parse(self, line):
+        """Return the name, the function and the arguments of a command line.
+        Raises CommandError if the command is unknown or its syntax is wrong.
+
+        """
+
+        words = split_command(line)
+        if not words or words[0] not in self.__commands:
+            raise CommandError("Unknown command. Type '-help' for a list of "
+                               "commands.")
+
+        function, usages, patterns = self.__commands[words[0]]
+        for pattern in patterns:
+            arguments = self.match(pattern, words[1:])
+            if arguments is not None:
+                return words[0], function, arguments
+        raise CommandError("Incorrect syntax. Use form {:s}".format(
+            " or ".join("'{:s}'".format(usage) for usage in usages)))
+
+    def match(self, pattern, words):
+        """Return the arguments read from the words with a compiled usage, or
+        None if the words do not match it.
+
+        """
+
+        arguments, required = pattern
+        extra = len(words) - required
+        if extra < 0:
+            return None
+
+        values = []
+        position = 0
+        for optional, repeated, alternatives in arguments:
+            if optional:
+                if extra == 0:
+                    values.append(None)
+                    continue
+                extra -= 1
+            if repeated:
+                value = [self.argument(alternatives, word)
+                         for word in words[position:]]
+                if None in value:
+                    return None
+                values.append(value)
+                position = len(words)
+                continue
+            value = self.argument(alternatives, words[position])
+            if value is None:
+                return None
+            values.append(value)
+            position += 1
+
+        if position != len(words):
+            return None
+        return values
+
+    def argument(self, alternatives, word):
+        """Return the argument read from a word, or None if the word is none
+        of the alternatives.
+
+        """
+
+        for literal, text in alternatives:
+            if literal:
+                if word == text:
+                    return word
+            elif not text:
+                return word
+            elif word.startswith(text) and len(word) > len(text):
+                return word[len(text):]
+        return None
+
+
+class ListImport:
+    """An import of a list file saved with "-exlist", made in steps.
+
+    Each step reads LIST_CHUNK_ROWS rows of the file, stores them in one
+    transaction and adds them to the tree, so the window can handle events
+    between the steps. If a step fails, the rows stored before it are kept.
+
+    """
+    def __init__(self, items, tree, filename):
+        """Open the list file. Raises CommandError if it cannot be opened.
+
+        :param self.parents: set: The parents whose children were added.
+        :param self.done: int: The number of bytes read, for showing the
+        progress out of self.size.
+
+        """
+
+        if "/" in filename or os.sep in filename:
+            raise CommandError("Only opening from the run folder allowed.")
+
+        self.__items = items
+        self.__tree = tree
+        self.filename = filename
+        self.added = 0
+        self.skipped = 0
+        self.parents = set()
+        self.done = 0
+
+        csv.field_size_limit(LIST_FIELD_SIZE)
+        try:
+            self.__file = open(filename, "r", newline="")
+            self.size = max(os.fstat(self.__file.fileno()).st_size, 1)
+        except OSError as error:
+            raise CommandError("Error in opening the list: {:s}".format(
+                str(error)))
+        self.__rows = csv.reader(self.__file, delimiter=";")
+
+    def step(self):
+        """Store the next rows of the file. Returns False when the whole file
+        has been imported. Raises CommandError if the file cannot be read.
+
+        """
+
+        # The rows are checked against the tree, which already has the rows
+        # of the earlier steps. Items whose names are already used, and
+        # children whose parent is not on the top level, are skipped.
+
+        added = {}
+        rows = []
+        read = 0
+        tree = self.__tree
+        try:
+            for row in itertools.islice(self.__rows, LIST_CHUNK_ROWS):
+                read += 1
+                if tuple(row) == LIST_HEADER:
+                    continue
+                if len(row) != 3 or not row[0]:
+                    self.skipped += 1
+                    continue
+                name, parent, text = row
+                if parent in added:
+                    top = added[parent] == ""
+                else:
+                    top = parent in tree and tree.parent(parent) == ""
+                if name in tree or name in added or (parent and not top):
+                    self.skipped += 1
+                    continue
+                added[name] = parent
+                rows.append((name, parent, text))
+            self.__items.add_many(rows)
+            self.done = min(self.__file.buffer.tell(), self.size)
+        except (OSError, UnicodeDecodeError, csv.Error,
+                sqlite3.Error) as error:
+            raise CommandError("Error in opening the list: {:s}".format(
+                str(error)))
+
+        for name, parent in added.items():
+            tree.insert(name, parent)
+            self.parents.add(parent)
+        self.added += len(added)
+        return read == LIST_CHUNK_ROWS
+
+    def close(self):
+        """Close the file.
+
+        """
+
+        self.__file.close()
+
+    def report(self):
+        """Return the notification shown when the import has finished.
+
+        """
+
+        return "{:d} items imported, {:d} skipped.".format(self.added,
+                                                           self.skipped)
+
+
+class Session:
+    """The document and the item list, and the commands that edit them.
+
+    This is the editor without the window. The commands are the same ones
+    that are typed in the command box, like "-s name" or "-j name", given
+    without the lambda symbol. Instead of the selection and the insert cursor
+    of the main frame, the session has its own, set with "-sel".
+
+    The window uses the same document, item store and item tree, and the
+    methods that change the item list.
+
+    """
+    def __init__(self, items=ITEM_DATABASE):
+        """Create an empty document and open the item store.
+
+        :param self.cursor: int: Offset where "-j" pastes.
+        :param self.selection: tuple: The first and last offset of the text
+        "-s" and "-cs" save, or None.
+        :param self.commands: CommandTable: The commands and the functions
+        they call with the arguments read from the line.
+
+        """
+
+        self.document = PieceTable()
+        self.items = ItemStore(items)
+        self.tree = ItemTree()
+        for name, parent in self.items.load():
+            self.tree.insert(name, parent)
+
+        self.cursor = 0
+        self.selection = None
+        self.__saved_files = {}
+        self.__playing = set()
+        self.commands = CommandTable()
+        self.commands.add(self.save_item, "-s /item_name/")
+        self.commands.add(self.save_child, "-cs -/parent/ /item_name/")
+        self.commands.add(self.delete_item, "-q /item_name/")
+        self.commands.add(self.paste, "-j /item_name/")
+        self.commands.add(self.export_file, "-ex /filename.txt/")
+        self.commands.add(self.import_file, "-im /filename.txt/")
+        self.commands.add(self.clear, "-gg")
+        self.commands.add(self.select, "-sel /line.column/ /line.column/")
+        self.commands.add(self.search, "-f /word/...")
+        self.commands.add(self.memory_report, "-mem [top]")
+        self.commands.add(self.play_macro, "-play /macro_name/")
+        self.commands.add(self.import_files, "-imall /pattern/ [/delimiter/]")
+        self.commands.add(self.export_list, "-exlist /filename/")
+        self.commands.add(self.import_list, "-imlist /filename/")
+
+    def run(self, line):
+        """Run a command line and return the notification to show. Raises
+        CommandError if the command fails.
+
+        """
+
+        if not line.strip():
+            return ""
+        name, function, arguments = self.commands.parse(line)
+        return function(*arguments)
+
+    def add_item(self, name, parent, text):
+        """Save a text as a new item. Items with a parent are saved as the
+        second child of the parent.
+
+        """
+
+        if name in self.tree:
+            raise CommandError("Can't save same name twice.")
+        if parent and parent not in self.tree:
+            raise CommandError("Parent not found. Try again.")
+
+        if parent:
+            self.tree.insert(name, parent, 1)
+            self.items.add(name, parent, text)
+            self.items.set_order(parent, self.tree.children(parent)[1:], 1)
+        else:
+            self.tree.insert(name)
+            self.items.add(name, "", text)
+
+    def add_files(self, files):
+        """Save files read with read_files as items, in one batch. Returns the
+        number of files saved and the files that were skipped.
+
+        Each file is saved as an item named after the file. If the file has
+        sections, they are saved as its children, named after the file
+        without the extension and numbered from 1. Files that cannot be read,
+        or whose names are already used, are skipped.
+
+        """
+
+        rows = []
+        used = set()
+        skipped = []
+        for filename, text, sections in files:
+            name = os.path.basename(filename)
+            names = [name]
+            if sections is not None:
+                stem = os.path.splitext(name)[0]
+                names.extend("{:s}-{:d}".format(stem, number)
+                             for number in range(1, len(sections) + 1))
+            if (text is None or any(item in self.tree or item in used
+                                    for item in names)):
+                skipped.append(filename)
+                continue
+            used.update(names)
+            rows.append((name, "", text))
+            if sections is not None:
+                rows.extend(zip(names[1:], itertools.repeat(name), sections))
+
+        self.items.add_many(rows)
+        for name, parent, text in rows:
+            self.tree.insert(name, parent)
+        return len(files) - len(skipped), skipped
+
+    def match_files(self, pattern):
+        """Return the files in the run folder matching a pattern, in sorted
+        order. Raises CommandError if the pattern is not in the run folder.
+
+        """
+
+        if "/" in pattern or os.sep in pattern:
+            raise CommandError("Only opening from the run folder allowed.")
+        return sorted(filename for filename in glob.glob(pattern)
+                      if os.path.isfile(filename))
+
+    def remove_items(self, names):
+        """Remove items and their children. Return the removed names.
+
+        """
+
+        # The siblings after the removed items move up, so the positions of
+        # the remaining children of their parents are saved with the delete.
+
+        parents = {self.tree.parent(name) for name in names}
+        roots, removed = self.tree.remove_many(names)
+        orders = {parent: (self.tree.children(parent), 0)
+                  for parent in parents if parent == "" or parent in self.tree}
+        self.items.remove(removed, orders)
+        return removed
+
+    def paste_text(self, names):
+        """Return the text pasted by "-j". Several items are given separated
+        by ":", and each of them is ended with a newline.
+
+        """
+
+        try:
+            if ":" in names:
+                return "".join(text + "\n" for text in
+                               self.items.bodies(names.split(":")))
+            return self.items.body(names)
+        except KeyError:
+            raise CommandError("Undefined function. See side frame for a "
+                               "list of saved functions.")
+
+    def restore(self, snapshot):
+        """Replace the items and the text with the ones in a Snapshot.
+
+        """
+
+        self.restore_items(snapshot)
+        self.document.reset(snapshot.text)
+        self.cursor = snapshot.cursor
+        self.selection = snapshot.selection
+
+    def restore_items(self, snapshot):
+        """Replace the items with the ones in a Snapshot.
+
+        """
+
+        # The texts are content-addressed, so only the texts the store does
+        # not already have are copied from the snapshot.
+
+        missing = self.items.missing_blobs(snapshot.blobs)
+        self.items.replace_items(
+            snapshot.items, (snapshot.blob(digest) for digest in missing))
+        self.tree.clear()
+        for name, parent, digest in snapshot.items:
+            self.tree.insert(name, parent)
+
+    def open(self, filename):
+        """Replace the text with the text of a file.
+
+        """
+
+        with open(filename, "r") as file:
+            self.document.reset(file.read())
+        self.cursor = len(self.document)
+        self.selection = None
+
+    def selected_text(self):
+        """Return the selected text. Raises CommandError if nothing is
+        selected.
+
+        """
+
+        if self.selection is None or self.selection[0] >= self.selection[1]:
+            raise CommandError("No selection. Select text with '-sel'.")
+        return self.document.text(*self.selection)
+
+    def save_item(self, name):
+        """Save the selected text as an item: "-s name".
+
+        """
+
+        self.add_item(name, "", self.selected_text())
+        return "Item saved: {:s}".format(name)
+
+    def save_child(self, parent, name):
+        """Save the selected text as a child item: "-cs -parent name".
+
+        """
+
+        self.add_item(name, parent, self.selected_text())
+        return "Item saved: {:s}".format(name)
+
+    def delete_item(self, name):
+        """Delete an item and its children: "-q name".
+
+        """
+
+        if name not in self.tree:
+            raise CommandError("Item not found. Try again.")
+        self.remove_items([name])
+        return "Item deleted: {:s}".format(name)
+
+    def paste(self, names):
+        """Paste items at the cursor: "-j name" or "-j name:name...". The
+        cursor moves to the end of the pasted text.
+
+        """
+
+        text = self.paste_text(names)
+        self.document.insert(self.cursor, text)
+        self.cursor += len(text)
+        self.selection = None
+        return "Pasted: {:s}".format(names)
+
+    def export_file(self, filename):
+        """Save the text to a file: "-ex filename". A file that already has
+        the same text is not written again.
+
+        """
+
+        check_text_file(filename, "-ex")
+        try:
+            self.__saved_files[filename], written = save_document(
+                filename, self.document, self.__saved_files.get(filename))
+        except OSError as error:
+            raise CommandError("Error in saving file: {:s}".format(
+                error.strerror or str(error)))
+        if written:
+            return "File saved: {:s}".format(filename)
+        return "File is already up to date: {:s}".format(filename)
+
+    def import_file(self, filename):
+        """Replace the text with the text of a file: "-im filename".
+
+        """
+
+        check_text_file(filename, "-im")
+        try:
+            self.open(filename)
+        except (OSError, UnicodeDecodeError):
+            raise CommandError("Error in opening file: {:s}".format(filename))
+        return "File imported: {:s}".format(filename)
+
+    def import_files(self, pattern, delimiter=None):
+        """Save all files matching a pattern as items: "-imall pattern" or
+        "-imall pattern delimiter". With a delimiter, the sections of each
+        file between the lines with only the delimiter are saved as children
+        of the file.
+
+        """
+
+        files = read_files(self.match_files(pattern), delimiter)
+        if not files:
+            raise CommandError("No files found.")
+        saved, skipped = self.add_files(files)
+        return "{:d} files imported, {:d} skipped.".format(saved, len(skipped))
+
+    def export_list(self, filename):
+        """Save the items to a list file: "-exlist filename". Each row has the
+        name, the parent and the text of an item, separated with ";".
+
+        """
+
+        if "/" in filename or os.sep in filename:
+            raise CommandError("Only saving in the run folder allowed.")
+        try:
+            write_atomic(filename, list_chunks(self.items.export_rows()),
+                         newline="")
+        except (OSError, sqlite3.Error) as error:
+            raise CommandError("Error in saving the list: {:s}".format(
+                str(error)))
+        return "{:d} items saved to {:s}".format(len(self.tree), filename)
+
+    def import_list(self, filename):
+        """Add the items in a list file saved with "-exlist": "-imlist
+        filename". Items whose names are already used, and children whose
+        parent is not on the top level, are skipped.
+
+        """
+
+        importer = ListImport(self.items, self.tree, filename)
+        try:
+            while importer.step():
+                pass
+        finally:
+            importer.close()
+        return importer.report()
+
+    def clear(self):
+        """Clear the text: "-gg".
+
+        """
+
+        self.document.reset()
+        self.cursor = 0
+        self.selection = None
+        return "Main frame cleared successfully."
+
+    def select(self, first, last):
+        """Select text: "-sel first last", where the positions are given as
+        "line.column" like the indexes of the main frame, or "end". The
+        cursor moves to the end of the selection.
+
+        """
+
+        try:
+            first, last = self.position_offset(first), self.position_offset(
+                last)
+        except ValueError:
+            raise CommandError("Incorrect syntax. Use form '-sel "
+                               "/line.column/ /line.column/'")
+        self.selection = (min(first, last), max(first, last))
+        self.cursor = self.selection[1]
+        return "Selected {:d} characters.".format(self.selection[1]
+                                                  - self.selection[0])
+
+    def position_offset(self, position):
+        """Convert a "line.column" position, or "end", to an offset. Raises
+        ValueError if the position is not valid.
+
+        """
+
+        if position == "end":
+            return len(self.document)
+        line, column = position.split(".")
+        return self.document.offset(max(int(line), 1), max(int(column), 0))
+
+    def search(self, words):
+        """Find the items containing all the words: "-f word word...".
+
+        """
+
+        names = self.items.search(words)
+        return "Found {:d} items: {:s}".format(len(names), " ".join(names))
+
+    def play_macro(self, name):
+        """Run the command lines of a macro: "-play name". The macro stops at
+        the first command that fails.
+
+        """
+
+        try:
+            lines = self.items.macro(name)
+        except KeyError:
+            raise CommandError("Macro not found: {:s}".format(name))
+        if name in self.__playing:
+            raise CommandError("Macro {:s} plays itself.".format(name))
+
+        self.__playing.add(name)
+        try:
+            for number, line in enumerate(lines, 1):
+                try:
+                    self.run(line)
+                except CommandError as error:
+                    raise CommandError("Macro {:s} stopped at line {:d}: {:s}"
+                                       .format(name, number, str(error)))
+        finally:
+            self.__playing.discard(name)
+        return "Macro played: {:s}, {:d} commands.".format(name, len(lines))
+
+    def memory_report(self, top=None):
+        """Show how much text the items hold, and how much of it is cached
+        in memory: "-mem". "-mem top" lists the largest items.
+
+        """
+
+        if top is not None:
+            return self.largest_report()
+
+        items, logical, blobs, stored = self.items.usage()
+        cached, size, hits, misses, evictions = self.items.cache_usage()
+        return ("{:d} items, {:s} of text, stored as {:d} texts in {:s}. "
+                "Cache: {:d} texts, {:s} of {:s}, {:d} hits, {:d} misses, "
+                "{:d} evicted.".format(
+                    items, format_size(logical), blobs, format_size(stored),
+                    cached, format_size(size),
+                    format_size(self.items.cache_size), hits, misses,
+                    evictions))
+
+    def largest_report(self, count=20):
+        """Return a table of the items with the largest texts.
+
+        """
+
+        lines = ["{:<32s} {:>12s} {:>12s}".format("ITEM", "SIZE", "STORED")]
+        for name, size, stored in self.items.largest(count):
+            lines.append("{:<32s} {:>12s} {:>12s}".format(
+                name, format_size(size), format_size(stored)))
+        return "\n".join(lines) + "\n"
+
+
+def main(arguments):
+    """Run a file of commands on documents, without the window.
+
+    Usage: null_core.py [--items FILE] [--stats] COMMANDS [DOCUMENT...]
+
+    Each document is opened in turn and the commands in the COMMANDS file,
+    one on each line, are run on it. "{name}" in a command is replaced with
+    the name of the document without the folder and the extension, e.g.
+    "-ex out-{name}.txt". Without documents the commands are run once on an
+    empty document. Empty lines and lines starting with "#" are skipped.
+
+    The items are kept in memory and shared by the documents, unless an item
+    database is given with --items. A failed command is reported and the
+    rest of the commands for that document are skipped. With --stats, the
+    latency of each command is reported at the end. Returns the exit status.
+
+    """
+
+    items = ":memory:"
+    stats = None
+    while arguments[:1] in (["--items"], ["--stats"]):
+        if arguments[0] == "--stats":
+            stats = LatencyStats()
+            arguments = arguments[1:]
+        elif len(arguments) > 1:
+            items = arguments[1]
+            arguments = arguments[2:]
+        else:
+            arguments = []
+    if not arguments:
+        print("Usage: null_core.py [--items FILE] [--stats] COMMANDS "
+              "[DOCUMENT...]", file=sys.stderr)
+        return 2
+
+    with open(arguments[0], "r") as file:
+        lines = [(number, line.strip()) for number, line in
+                 enumerate(file, 1)
+                 if line.strip() and not line.startswith("#")]
+
+    # The commands are parsed once, before any document is opened, and only
+    # "{name}" is replaced in the arguments for each document.
+
+    session = Session(items)
+    commands = []
+    for number, line in lines:
+        try:
+            commands.append((number, session.commands.parse(line)))
+        except CommandError as error:
+            print("{:s}: line {:d}: {:s}".format(arguments[0], number,
+                                                 str(error)), file=sys.stderr)
+            return 2
+
+    failed = 0
+    for document in arguments[1:] or [None]:
+        name = ""
+        try:
+            if document is None:
+                session.clear()
+            else:
+                name = os.path.splitext(os.path.basename(document))[0]
+                session.open(document)
+            for number, (command, function, values) in commands:
+                values = [value.replace("{name}", name)
+                          if isinstance(value, str) else
+                          [word.replace("{name}", name) for word in value]
+                          if value is not None else None
+                          for value in values]
+                if stats is None:
+                    function(*values)
+                else:
+                    stats.timed(function, command)(*values)
+
+        except CommandError as error:
+            print("{:s}: line {:d}: {:s}".format(document or arguments[0],
+                                                 number, str(error)),
+                  file=sys.stderr)
+            failed += 1
+        except (OSError, UnicodeDecodeError) as error:
+            print("{:s}: {:s}".format(document, str(error)), file=sys.stderr)
+            failed += 1
+
+    if stats is not None:
+        sys.stderr.write(stats.report_text())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,468 @@
+"""Round-trip tests of the editor core, without the interface.
+
+"""
+
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+
+PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE)
+
+import null_core
+
+
+class CoreTest(unittest.TestCase):
+    """Base class that runs each test in an empty temporary folder.
+
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.folder)
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def write(self, name, data):
+        with open(self.path(name), "wb") as file:
+            file.write(data)
+        return self.path(name)
+
+
+class PagedFileTest(CoreTest):
+
+    def pages(self, filename):
+        view = null_core.PagedFile(filename)
+        try:
+            return [view.page_text(page) for page in range(view.page_count)]
+        finally:
+            view.close()
+
+    def test_long_line(self):
+        text = "x" * 100000 + "\n"
+        filename = self.write("long.txt", text.encode("utf-8"))
+        with mock.patch.object(null_core, "VIEW_PAGE_SIZE", 1024):
+            pages = self.pages(filename)
+        self.assertEqual("".join(pages), text)
+        self.assertLessEqual(max(len(page) for page in pages), 2 * 1024)
+
+    def test_cut_at_character(self):
+        text = "aä€😀" * 5000
+        filename = self.write("wide.txt", text.encode("utf-8"))
+        with mock.patch.object(null_core, "VIEW_PAGE_SIZE", 1000):
+            pages = self.pages(filename)
+        self.assertEqual("".join(pages), text)
+        self.assertNotIn("�", "".join(pages))
+
+    def test_lines_kept_whole(self):
+        text = "".join("line %d\n" % number for number in range(2000))
+        filename = self.write("lines.txt", text.encode("utf-8"))
+        with mock.patch.object(null_core, "VIEW_PAGE_SIZE", 1024):
+            pages = self.pages(filename)
+        self.assertEqual("".join(pages), text)
+        self.assertTrue(all(page.endswith("\n") for page in pages if page))
+
+
+class PieceTableTest(unittest.TestCase):
+
+    def test_edits(self):
+        """Random edits give the same text as editing a string, and the
+        offsets and positions agree with it.
+
+        """
+
+        generator = random.Random(1)
+        document = null_core.PieceTable("first\nsecond\n")
+        text = document.text()
+        for step in range(2000):
+            offset = generator.randint(0, len(text))
+            if generator.random() < 0.6:
+                insert = generator.choice(["a", "bc", "\n", "x\ny", "ä😀"])
+                document.insert(offset, insert)
+                text = text[:offset] + insert + text[offset:]
+            else:
+                end = offset + generator.randint(0, 5)
+                document.delete(offset, end)
+                text = text[:offset] + text[end:]
+        self.assertEqual(document.text(), text)
+        self.assertEqual(len(document), len(text))
+        self.assertEqual(document.text(10, 50), text[10:50])
+
+        for offset in range(0, len(text), 37):
+            line = text.count("\n", 0, offset) + 1
+            column = offset - (text.rfind("\n", 0, offset) + 1)
+            self.assertEqual(document.position(offset), (line, column))
+            self.assertEqual(document.offset(line, column), offset)
+
+    def test_copy_and_difference(self):
+        document = null_core.PieceTable("one two three")
+        old = document.copy()
+        document.delete(4, 7)
+        document.insert(4, "2")
+        self.assertEqual(old.text(), "one two three")
+
+        start, old_end, end = document.difference(old)
+        self.assertEqual(document.text()[:start] + old.text()[start:old_end]
+                         + document.text()[end:], old.text())
+
+
+class EditHistoryTest(unittest.TestCase):
+
+    def test_runs(self):
+        """Typing next to the last edit is joined into one entry, and a line
+        break starts a new one.
+
+        """
+
+        history = null_core.EditHistory()
+        document = null_core.PieceTable()
+        for offset, text in enumerate("ab\nc"):
+            document.insert(offset, text)
+            history.record("insert", offset, [(text, 0, 1, text.count("\n"))])
+        self.assertEqual(len(history.undo()), 1)
+        self.assertEqual(len(history.undo()), 1)
+        self.assertIsNone(history.undo())
+
+    def test_trim(self):
+        """The oldest entries are dropped when the removed text no longer
+        fits in the limit, and the newest entry is always kept.
+
+        """
+
+        history = null_core.EditHistory(limit=3 * null_core.UNDO_EDIT_COST
+                                         + 10)
+        for number in range(5):
+            history.separate()
+            history.record("delete", 0, [(str(number), 0, 1, 0)])
+        undone = []
+        while True:
+            edits = history.undo()
+            if edits is None:
+                break
+            undone.append(edits[0][2][0][0])
+        self.assertEqual(undone, ["4", "3", "2"])
+
+        history.record("delete", 0, [("x" * 1000, 0, 1000, 0)])
+        self.assertIsNotNone(history.undo())
+        self.assertIsNone(history.undo())
+
+    def test_redo(self):
+        history = null_core.EditHistory()
+        history.record("insert", 0, [("a", 0, 1, 0)])
+        edits = history.undo()
+        self.assertEqual(history.redo(), edits)
+        self.assertIsNone(history.redo())
+
+
+class CommandTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.commands = null_core.CommandTable()
+        self.commands.add(self.calls.append, "-one /name/")
+        self.commands.add(self.calls.append, "-opt /name/ [/extra/]")
+        self.commands.add(self.calls.append, "-alt top|bottom|-/name/",
+                          "-alt /first/ /second/")
+        self.commands.add(self.calls.append, "-many /word/...")
+
+    def arguments(self, line):
+        return self.commands.parse(line)[2]
+
+    def test_optional(self):
+        self.assertEqual(self.arguments("-opt a"), ["a", None])
+        self.assertEqual(self.arguments("-opt a b"), ["a", "b"])
+        with self.assertRaises(null_core.CommandError):
+            self.commands.parse("-opt a b c")
+
+    def test_alternatives(self):
+        self.assertEqual(self.arguments("-alt top"), ["top"])
+        self.assertEqual(self.arguments("-alt -item"), ["item"])
+        self.assertEqual(self.arguments("-alt a b"), ["a", "b"])
+        with self.assertRaises(null_core.CommandError) as raised:
+            self.commands.parse("-alt middle")
+        self.assertIn("'-alt /first/ /second/'", str(raised.exception))
+
+    def test_repeated(self):
+        self.assertEqual(self.arguments("-many a b c"), [["a", "b", "c"]])
+        with self.assertRaises(null_core.CommandError):
+            self.commands.parse("-many")
+
+    def test_quoted_and_unknown(self):
+        self.assertEqual(self.arguments("-one 'my item'"), ["my item"])
+        line = "-one " + null_core.quote_word("it's here")
+        self.assertEqual(null_core.split_command(line), ["-one", "it's here"])
+        with self.assertRaises(null_core.CommandError):
+            self.commands.parse("-none")
+
+
+class NameIndexTest(unittest.TestCase):
+
+    def test_complete_and_fuzzy(self):
+        index = null_core.NameIndex()
+        names = ["item{:03d}".format(number) for number in range(200)]
+        for name in names + ["other", "iterate"]:
+            index.add(name)
+        self.assertEqual(index.complete("item01", 5),
+                         ["item010", "item011", "item012", "item013",
+                          "item014"])
+        self.assertEqual(index.complete("ot"), ["other"])
+
+        index.discard(["other"] + names[:100])
+        self.assertEqual(index.complete("ot"), [])
+        self.assertEqual(index.complete("item", 1), ["item100"])
+        self.assertEqual(index.fuzzy("ITR")[0], "iterate")
+        self.assertEqual(index.fuzzy("i199"), ["item199"])
+
+
+class ItemStoreTest(CoreTest):
+
+    def test_dedupe(self):
+        """Items with the same text store it once, and the text stays stored
+        until the last item using it is removed.
+
+        """
+
+        store = null_core.ItemStore(self.path("items.db"))
+        text = "shared text " * 1000
+        store.add("a", "", text)
+        store.add("b", "", text)
+        store.add("c", "a", "child")
+        items, logical, blobs, stored = store.usage()
+        self.assertEqual((items, blobs), (3, 2))
+        self.assertLess(stored, 2 * len(text))
+        self.assertEqual(store.bodies(["b", "c"]), [text, "child"])
+
+        store.remove(["a", "c"])
+        self.assertEqual(store.body("b"), text)
+        store.remove(["b"])
+        self.assertEqual(store.usage()[2], 0)
+
+    def test_search(self):
+        store = null_core.ItemStore(self.path("items.db"))
+        store.add("a", "", "Red apples and pears")
+        store.add("b", "", "green apples")
+        store.add_many([("c", "", "pearl"), ("d", "c", "APPLE pie")])
+        self.assertEqual(store.search(["apples"]), ["a", "b"])
+        self.assertEqual(store.search(["apples", "red"]), ["a"])
+        self.assertEqual(store.search(["pear*"]), ["a", "c"])
+        self.assertEqual(store.search(["apple"]), ["d"])
+
+        reopened = null_core.ItemStore(self.path("items.db"))
+        self.assertEqual(reopened.search(["pie"]), ["d"])
+        self.assertEqual(reopened.load(), [("a", ""), ("b", ""), ("c", ""),
+                                           ("d", "c")])
+
+    def test_previews(self):
+        """The previews of compressed and plain texts are the beginnings of
+        the texts, whether or not the texts are cached.
+
+        """
+
+        generator = random.Random(2)
+        texts = {
+            "plain": "short ä😀 text",
+            "repeated": "repeated words 😀 " * 5000,
+            "random": "".join(chr(generator.randint(0x20, 0x2FFF))
+                              for number in range(20000))}
+        store = null_core.ItemStore(self.path("items.db"), cache_size=0)
+        store.add_many((name, "", text) for name, text in texts.items())
+        names = ["random", "plain", "repeated"]
+        previews = store.previews(names, 100)
+        self.assertEqual(previews, [
+            (texts[name][:100], len(texts[name].encode("utf-8")),
+             name != "plain") for name in names])
+
+        store.cache_size = null_core.BODY_CACHE_SIZE
+        store.bodies(names)
+        self.assertEqual(store.previews(names, 100), previews)
+
+
+class SnapshotTest(CoreTest):
+
+    def test_round_trip(self):
+        """A snapshot restores the text, the cursor, the selection and the
+        items into another store, and the restored texts are searchable.
+
+        """
+
+        session = null_core.Session(self.path("first.db"))
+        session.document.reset("main text 😀\nsecond line\n")
+        session.add_item("top", "", "short text")
+        session.add_item("long", "", "long words " * 2000)
+        session.add_item("child", "top", "short text")
+        write = null_core.write_atomic
+        write("saved.snap", null_core.snapshot_chunks(
+            session.document, 5, (1, 8), session.items.export_items(),
+            session.items.export_blobs()), mode="wb")
+
+        other = null_core.Session(self.path("second.db"))
+        other.add_item("gone", "", "replaced")
+        snapshot = null_core.Snapshot("saved.snap")
+        try:
+            other.restore(snapshot)
+        finally:
+            snapshot.close()
+
+        self.assertEqual(other.document.text(), session.document.text())
+        self.assertEqual((other.cursor, other.selection), (5, (1, 8)))
+        self.assertEqual(other.items.load(), session.items.load())
+        for name in ("top", "long", "child"):
+            self.assertEqual(other.items.body(name), session.items.body(name))
+        self.assertNotIn("gone", other.tree)
+        self.assertEqual(other.items.search(["words"]), ["long"])
+
+    def test_not_a_snapshot(self):
+        self.write("bad.snap", b"NULLSNAP" + b"\0" * 10)
+        with self.assertRaises(ValueError):
+            null_core.Snapshot(self.path("bad.snap"))
+
+
+class JournalTest(CoreTest):
+
+    def test_recover(self):
+        """The edits written to the journal are replayed on recovery, and a
+        record cut short ends the replay.
+
+        """
+
+        document = null_core.PieceTable("start\n")
+        journal = null_core.Journal(self.path("journal.log"))
+        journal.start(document.copy())
+        for offset, text in ((6, "more\n"), (0, "ä😀 "), (3, "x")):
+            document.insert(offset, text)
+            journal.insert(offset, text)
+        document.delete(1, 4)
+        journal.delete(1, 4)
+        journal.close()
+        self.assertEqual(journal.recover().text(), document.text())
+
+        with open(self.path("journal.log"), "a", newline="") as file:
+            file.write("I 0 100\ncut")
+        self.assertEqual(journal.recover().text(), document.text())
+        self.assertIsNone(null_core.Journal(self.path("none.log")).recover())
+
+    def test_compaction(self):
+        """A snapshot replaces the records written before it.
+
+        """
+
+        document = null_core.PieceTable()
+        journal = null_core.Journal(self.path("journal.log"))
+        journal.start(document.copy())
+        for offset in range(500):
+            document.insert(offset, "y")
+            journal.insert(offset, "y")
+        journal.flush()
+        self.assertGreater(journal.size, 0)
+        journal.snapshot(document.copy())
+        journal.insert(0, "z")
+        document.insert(0, "z")
+        journal.close()
+
+        with open(self.path("journal.log"), "r", newline="") as file:
+            self.assertEqual(file.read(), "S 500\n" + "y" * 500 + "\n"
+                             "I 0 1\nz\n")
+        self.assertEqual(journal.recover().text(), document.text())
+
+    def test_open_journal(self):
+        """Each editor takes a journal of its own, and a journal that is not
+        in use is taken first, so its text is recovered.
+
+        """
+
+        first = null_core.open_journal(self.path("journal.log"))
+        second = null_core.open_journal(self.path("journal.log"))
+        self.assertEqual(first.filename, self.path("journal.log"))
+        self.assertEqual(second.filename, self.path("journal-2.log"))
+        second.start(null_core.PieceTable("crashed\n"))
+        second.close()
+
+        third = null_core.open_journal(self.path("journal.log"))
+        self.assertEqual(third.filename, self.path("journal-2.log"))
+        self.assertEqual(third.recover().text(), "crashed\n")
+        third.close(True)
+
+        first.close(True)
+        self.assertEqual(os.listdir(self.folder), [])
+        fourth = null_core.open_journal(self.path("journal.log"))
+        self.assertEqual(fourth.filename, self.path("journal.log"))
+        fourth.close(True)
+
+
+class SessionTest(CoreTest):
+
+    def test_list_round_trip(self):
+        """Items saved with "-exlist" are added back with "-imlist", with
+        their parents, order and texts, and names already used are skipped.
+
+        """
+
+        session = null_core.Session(self.path("first.db"))
+        texts = {"a": "one; two\n\"quoted\"", "b": "", "c": "child 😀",
+                 "d": "second child"}
+        session.add_item("a", "", texts["a"])
+        session.add_item("b", "", texts["b"])
+        session.add_item("c", "a", texts["c"])
+        session.add_item("d", "a", texts["d"])
+        session.run("-exlist items.csv")
+
+        other = null_core.Session(self.path("second.db"))
+        other.add_item("b", "", "kept")
+        self.assertEqual(other.run("-imlist items.csv"),
+                         "3 items imported, 1 skipped.")
+        self.assertEqual(other.tree.children("a"), session.tree.children("a"))
+        for name in ("a", "c", "d"):
+            self.assertEqual(other.items.body(name), texts[name])
+        self.assertEqual(other.items.body("b"), "kept")
+
+    def test_main(self):
+        """The batch mode runs the commands on each document, and reports
+        the documents where a command failed.
+
+        """
+
+        self.write("one.txt", b"first document\n")
+        self.write("two.txt", b"second document\n")
+        with open("commands", "w") as file:
+            file.write("# Save the first line.\n"
+                       "-sel 1.0 1.5\n"
+                       "-s {name}\n"
+                       "-sel end end\n"
+                       "-j {name}\n"
+                       "-ex out-{name}.txt\n")
+        status = null_core.main(["--items", "items.db", "commands",
+                                 "one.txt", "two.txt"])
+        self.assertEqual(status, 0)
+        with open("out-one.txt") as file:
+            self.assertEqual(file.read(), "first document\nfirst\n")
+        with open("out-two.txt") as file:
+            self.assertEqual(file.read(), "second document\nsecon\n")
+        self.assertEqual(null_core.ItemStore("items.db").load(),
+                         [("one", ""), ("two", "")])
+
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            status = null_core.main(["--items", "items.db", "commands",
+                                     "one.txt"])
+        self.assertEqual(status, 1)
+        self.assertIn("one.txt: line 3: Can't save same name twice.",
+                      stderr.getvalue())
+
+        with open("commands", "w") as file:
+            file.write("-nothing\n")
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(null_core.main(["commands"]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,724 @@
+"""Build the interface without a display and run it against fake widgets.
+
+The widgets are replaced with small fakes, but the main frame is still
+driven through a real Tcl interpreter: the fake text widget is a Tcl
+command, which the interface renames and replaces with its proxy, like it
+does with the real widget. Like Tk 8.6, the fake counts a character outside
+the Basic Multilingual Plane as two columns in the indexes.
+
+"""
+
+import importlib.util
+import os
+import re
+import shutil
+import sys
+import tempfile
+import tkinter
+import types
+import unittest
+
+
+PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE)
+
+import null_core
+
+
+def load_editor():
+    """Load NULL-EDITOR.py as a module, without starting the window.
+
+    """
+
+    spec = importlib.util.spec_from_file_location(
+        "null_editor", os.path.join(PACKAGE, "NULL-EDITOR.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def columns(text):
+    """Return the number of Tk 8.6 index columns the text takes.
+
+    """
+
+    return len(text) + sum(1 for character in text if ord(character) > 0xFFFF)
+
+
+def characters(text, count):
+    """Return the number of characters in the first count columns of the
+    text.
+
+    """
+
+    used = 0
+    for number, character in enumerate(text):
+        if used >= count:
+            return number
+        used += 2 if ord(character) > 0xFFFF else 1
+    return len(text)
+
+
+class FakeApp:
+    """The Tcl interpreter of the fake root, which remembers the Python
+    commands created in it.
+
+    """
+    def __init__(self):
+        self.app = tkinter.Tcl().tk
+        self.commands = {}
+
+    def __getattr__(self, name):
+        return getattr(self.app, name)
+
+    def createcommand(self, name, function):
+        self.commands[name] = function
+        self.app.createcommand(name, function)
+
+
+class FakeWidget:
+    """A widget whose methods do nothing.
+
+    """
+    count = 0
+
+    def __init__(self, master=None, **options):
+        FakeWidget.count += 1
+        self.master = master
+        self._w = ".fake{:d}".format(FakeWidget.count)
+        self.tk = master.tk if master is not None else None
+
+    def __getattr__(self, name):
+        return lambda *args, **options: ""
+
+
+class FakeTk(FakeWidget):
+    """The root window. The jobs scheduled with after() are kept in a list,
+    and run only when the test asks for them.
+
+    """
+    script = None
+
+    def __init__(self):
+        super().__init__()
+        self.tk = FakeApp()
+        self.jobs = []
+
+    def register(self, function):
+        name = "register{:d}".format(id(function))
+        self.tk.createcommand(name, function)
+        return name
+
+    def after(self, delay, function=None, *args):
+        job = [function, args]
+        self.jobs.append(job)
+        return job
+
+    def after_cancel(self, job):
+        if job in self.jobs:
+            self.jobs.remove(job)
+
+    def run_jobs(self, function):
+        """Run the scheduled jobs of a method until there are none left.
+
+        """
+
+        while True:
+            jobs = [job for job in self.jobs
+                    if getattr(job[0], "__func__", None) is function
+                    or getattr(job[0], "__name__", "") == "<lambda>"]
+            if not jobs:
+                return
+            self.jobs.remove(jobs[0])
+            jobs[0][0](*jobs[0][1])
+
+    def focus_get(self):
+        return None
+
+    def mainloop(self):
+        if FakeTk.script is not None:
+            FakeTk.script(self)
+
+
+class FakeEntry(FakeWidget):
+    """The command box.
+
+    """
+    def __init__(self, master=None, **options):
+        super().__init__(master)
+        self.text = ""
+        self.cursor = 0
+        self.selected = None
+        self.after = master.after
+        self.after_cancel = master.after_cancel
+
+    def position(self, index):
+        if index == tkinter.END:
+            return len(self.text)
+        if index == tkinter.INSERT:
+            return self.cursor
+        if index == tkinter.SEL_FIRST:
+            return self.selected[0]
+        if index == tkinter.SEL_LAST:
+            return self.selected[1]
+        return min(int(index), len(self.text))
+
+    def get(self):
+        return self.text
+
+    def insert(self, index, text):
+        position = self.position(index)
+        self.text = self.text[:position] + text + self.text[position:]
+        self.cursor = position + len(text)
+
+    def delete(self, first, last=None):
+        first = self.position(first)
+        last = first + 1 if last is None else self.position(last)
+        self.text = self.text[:first] + self.text[last:]
+        self.cursor = min(self.cursor, len(self.text))
+        self.selected = None
+
+    def index(self, index):
+        return self.position(index)
+
+    def icursor(self, index):
+        self.cursor = self.position(index)
+
+    def selection_range(self, first, last):
+        self.selected = (self.position(first), self.position(last))
+
+    def selection_present(self):
+        return self.selected is not None
+
+    def selection_clear(self):
+        self.selected = None
+
+
+class FakeText(FakeWidget):
+    """The main frame. The text is kept in a Tcl command that takes the
+    widget commands, and the methods call it, like the methods of the real
+    widget do.
+
+    """
+    def __init__(self, master=None, **options):
+        super().__init__(master)
+        self.text = ""
+        self.marks = {"insert": 0}
+        self.tags = {}
+        master.tk.createcommand(self._w, self.command)
+
+    # The methods used by the interface.
+
+    def insert(self, index, text, *tags):
+        return self.tk.call(self._w, "insert", index, text)
+
+    def delete(self, first, last=None):
+        if last is None:
+            return self.tk.call(self._w, "delete", first)
+        return self.tk.call(self._w, "delete", first, last)
+
+    def get(self, first, last):
+        return self.tk.call(self._w, "get", first, last)
+
+    def mark_set(self, name, index):
+        return self.tk.call(self._w, "mark", "set", name, index)
+
+    def mark_unset(self, name):
+        return self.tk.call(self._w, "mark", "unset", name)
+
+    def tag_add(self, name, first, last):
+        return self.tk.call(self._w, "tag", "add", name, first, last)
+
+    def tag_remove(self, name, first, last):
+        return self.tk.call(self._w, "tag", "remove", name, first, last)
+
+    def tag_ranges(self, name):
+        return self.tk.splitlist(self.tk.call(self._w, "tag", "ranges", name))
+
+    def selection_get(self):
+        if "sel" not in self.tags:
+            raise tkinter.TclError("PRIMARY selection doesn't exist")
+        first, last = self.tags["sel"]
+        return self.text[first:last]
+
+    # The widget command, called through Tcl.
+
+    def offset(self, index):
+        """Return the offset of a Tk index in the text.
+
+        """
+
+        index = str(index).strip()
+        match = re.fullmatch(r"(.*?)\s*([+-])\s*(\d+)\s*c(hars)?", index)
+        if match:
+            offset = self.offset(match.group(1))
+            change = int(match.group(3))
+            if match.group(2) == "-":
+                change = -change
+            return max(0, min(offset + change, len(self.text)))
+        if index == "end":
+            return len(self.text)
+        if index in self.marks:
+            return self.marks[index]
+        if index in ("sel.first", "sel.last"):
+            return self.tags["sel"][index == "sel.last"]
+
+        line, column = (int(float(part)) for part in index.split("."))
+        lines = self.text.split("\n")
+        if line < 1:
+            return 0
+        if line > len(lines):
+            return len(self.text)
+        start = sum(len(text) + 1 for text in lines[:line - 1])
+        return start + characters(lines[line - 1], column)
+
+    def index(self, offset):
+        """Return the Tk index of an offset in the text.
+
+        """
+
+        before = self.text[:offset]
+        line = before.count("\n") + 1
+        return "{:d}.{:d}".format(line, columns(before.split("\n")[-1]))
+
+    def command(self, operation, *args):
+        if operation == "index":
+            if str(args[0]) == "end":
+                return "{:d}.0".format(self.text.count("\n") + 2)
+            return self.index(self.offset(args[0]))
+        if operation == "cget":
+            return "normal"
+        if operation == "get":
+            return self.text[self.offset(args[0]):self.offset(args[1])]
+        if operation == "insert":
+            offset = self.offset(args[0])
+            text = "".join(args[1::2])
+            self.text = self.text[:offset] + text + self.text[offset:]
+            self.move(offset, offset, len(text))
+            return ""
+        if operation == "delete":
+            first = self.offset(args[0])
+            last = self.offset(args[1]) if len(args) > 1 else first + 1
+            last = min(last, len(self.text))
+            if last > first:
+                self.text = self.text[:first] + self.text[last:]
+                self.move(first, last, 0)
+            return ""
+        if operation == "mark":
+            if args[0] == "set":
+                self.marks[args[1]] = self.offset(args[2])
+            elif args[0] == "unset":
+                self.marks.pop(args[1], None)
+            return ""
+        if operation == "tag" and args[0] in ("add", "remove"):
+            if args[1] == "sel":
+                if args[0] == "add":
+                    self.tags["sel"] = (self.offset(args[2]),
+                                        self.offset(args[3]))
+                else:
+                    self.tags.pop("sel", None)
+            return ""
+        if operation == "tag" and args[0] == "ranges":
+            if args[1] in self.tags:
+                return " ".join(self.index(offset)
+                                for offset in self.tags[args[1]])
+            return ""
+        return ""
+
+    def move(self, first, last, length):
+        """Move the marks after an edit that replaced the text from first to
+        last with length characters.
+
+        """
+
+        for name, offset in self.marks.items():
+            if offset >= last:
+                self.marks[name] = offset - (last - first) + length
+            elif offset > first:
+                self.marks[name] = first
+        self.tags.pop("sel", None)
+
+
+class InterfaceTest(unittest.TestCase):
+    """Start the interface with fake widgets and check the main frame and
+    the document stay the same.
+
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for name in ("default_main.txt", "help.txt"):
+            shutil.copy(os.path.join(PACKAGE, name), self.folder)
+        self.cwd = os.getcwd()
+        os.chdir(self.folder)
+
+        self.editor = load_editor()
+        self.editor.Tk = FakeTk
+        self.editor.Entry = FakeEntry
+        self.editor.Button = FakeWidget
+        self.editor.tkst = types.SimpleNamespace(ScrolledText=FakeText)
+        self.editor.ttk = types.SimpleNamespace(Style=FakeWidget,
+                                                Treeview=FakeWidget)
+        self.editor.messagebox = types.SimpleNamespace(
+            askokcancel=lambda *args, **options: True)
+
+    def tearDown(self):
+        FakeTk.script = None
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def run_interface(self, script):
+        """Build the interface and run the script in place of the mainloop.
+        The script gets the interface, the root and the main frame.
+
+        """
+
+        def mainloop(root):
+            proxy = [function for name, function in root.tk.commands.items()
+                     if getattr(function, "__name__", "")
+                     == "main_frame_proxy"][0]
+            interface = proxy.__self__
+            main_frame = interface._Interface__main_frame
+            script(interface, root, main_frame)
+
+        FakeTk.script = mainloop
+        self.editor.Interface()
+
+    def document(self, interface):
+        return interface._Interface__document.text()
+
+    def test_startup(self):
+        """The default text is shown and the document follows it.
+
+        """
+
+        with open("default_main.txt", "r") as file:
+            default_text = file.read()
+
+        def script(interface, root, main_frame):
+            self.assertEqual(main_frame.text, default_text)
+            self.assertEqual(self.document(interface), default_text)
+
+        self.run_interface(script)
+
+    def test_startup_recovered(self):
+        """The text of a journal left by a crash is shown at startup.
+
+        """
+
+        journal = null_core.Journal()
+        journal.start(null_core.PieceTable("unsaved text\n"))
+        journal.close()
+
+        def script(interface, root, main_frame):
+            self.assertEqual(main_frame.text, "unsaved text\n")
+            self.assertEqual(self.document(interface), "unsaved text\n")
+
+        self.run_interface(script)
+
+    def stored_order(self):
+        """Return the items in the order they are loaded at the next start.
+
+        """
+
+        return null_core.ItemStore().load()
+
+    def test_move_saved(self):
+        """Moving an item to another parent and back is saved, so the list
+        is in the same order after a restart.
+
+        """
+
+        def script(interface, root, main_frame):
+            session = interface._Interface__session
+            for name in ("a", "b", "c"):
+                session.add_item(name, "", name)
+            interface.move_tree_item("a", "b")
+            interface.move_tree_item("a", "", 1)
+            self.assertEqual(session.tree.children(), ["b", "a", "c"])
+            self.assertEqual(self.stored_order(),
+                             [("b", ""), ("a", ""), ("c", "")])
+
+        self.run_interface(script)
+
+    def test_remove_saved(self):
+        """The items after a removed item keep their order when an item is
+        moved after the removal.
+
+        """
+
+        def script(interface, root, main_frame):
+            session = interface._Interface__session
+            for name in ("x", "a", "c", "b"):
+                session.add_item(name, "", name)
+            interface.move_tree_item("b", "", 1)
+            session.remove_items(["x"])
+            interface.move_tree_item("c", "", 1)
+            self.assertEqual(session.tree.children(), ["b", "c", "a"])
+            self.assertEqual(self.stored_order(),
+                             [("b", ""), ("c", ""), ("a", "")])
+
+        self.run_interface(script)
+
+    def test_astral_characters(self):
+        """Edits after an emoji, which Tk counts as two columns, change the
+        same text in the main frame and the document, and are undone.
+
+        """
+
+        def script(interface, root, main_frame):
+            main_frame.delete("1.0", "end")
+            main_frame.insert("1.0", "a\U0001F600b\nline\n")
+            main_frame.insert("1.4", "c")
+            main_frame.delete("1.3", "1.4")
+            self.assertEqual(main_frame.text, "a\U0001F600c\nline\n")
+            self.assertEqual(self.document(interface), main_frame.text)
+
+            interface.undo()
+            self.assertEqual(main_frame.text, "a\U0001F600bc\nline\n")
+            self.assertEqual(self.document(interface), main_frame.text)
+            self.assertEqual(main_frame.marks["insert"], 3)
+
+        self.run_interface(script)
+
+    def test_astral_characters_macro(self):
+        """A macro edit after an emoji changes the same text in the main
+        frame and the document.
+
+        """
+
+        def script(interface, root, main_frame):
+            main_frame.delete("1.0", "end")
+            main_frame.insert("1.0", "\U0001F600" + "a" * 600)
+            main_frame.insert("end", "bbb")
+            session = interface._Interface__session
+            session.add_item("x", "", "XX")
+            interface._Interface__item_container.save_macro(
+                "m", ["-sel 1.601 1.601", "-j x"])
+
+            self.command(interface, "-play m")
+            self.assertEqual(main_frame.text,
+                             "\U0001F600" + "a" * 600 + "XXbbb")
+            self.assertEqual(self.document(interface), main_frame.text)
+
+            self.command(interface, "-play m")
+            self.assertEqual(self.document(interface), main_frame.text)
+
+        self.run_interface(script)
+
+    def test_restore_indexes_later(self):
+        """The texts restored from a snapshot are indexed in the background
+        and found by searching.
+
+        """
+
+        def script(interface, root, main_frame):
+            session = interface._Interface__session
+            session.add_item("a", "", "restored words")
+            self.command(interface, "-snap saved.snap")
+            root.run_jobs(interface.background_poll.__func__)
+            session.remove_items(["a"])
+            self.assertEqual(session.items.search(["restored"]), [])
+
+            self.command(interface, "-rest saved.snap")
+            root.run_jobs(interface.index_step.__func__)
+            self.assertEqual(session.items.search(["restored"]), ["a"])
+
+        self.run_interface(script)
+
+    def test_undo_while_pasting(self):
+        """Undo during a long paste keeps the history, and undoes the paste
+        after it has finished.
+
+        """
+
+        def script(interface, root, main_frame):
+            main_frame.delete("1.0", "end")
+            main_frame.insert("1.0", "typed\n")
+            text = "x" * (self.editor.INSERT_CHUNK_SIZE * 2)
+            interface.insert_text(text)
+
+            interface.undo()
+            self.assertNotEqual(main_frame.text, "")
+            root.run_jobs(None)
+            self.assertEqual(main_frame.text, "typed\n" + text)
+
+            interface.undo()
+            self.assertEqual(main_frame.text, "typed\n")
+            self.assertEqual(self.document(interface), main_frame.text)
+
+        self.run_interface(script)
+
+    def test_paste_while_pasting(self):
+        """A paste typed while an earlier paste is running shows why it
+        failed, instead of clearing the command box.
+
+        """
+
+        def script(interface, root, main_frame):
+            interface._Interface__session.add_item("a", "", "pasted")
+            main_frame.delete("1.0", "end")
+            text = "x" * (self.editor.INSERT_CHUNK_SIZE * 2)
+            interface.insert_text(text)
+
+            self.assertEqual(self.command(interface, "-j a"),
+                             "Still pasting. Try again soon.")
+            root.run_jobs(None)
+            self.assertEqual(self.command(interface, "-j a"), "")
+            self.assertEqual(main_frame.text, text + "pasted")
+
+        self.run_interface(script)
+
+    def command(self, interface, line):
+        """Type a command line in the command box and run it.
+
+        """
+
+        command_box = interface._Interface__command_box
+        command_box.text = "ᴧ " + line
+        command_box.cursor = len(command_box.text)
+        interface.command_call(None)
+        return command_box.text[2:]
+
+    def test_macro_failed_commands(self):
+        """Failed commands and commands the session cannot run are not
+        recorded into a macro, and the filenames are checked the same way in
+        macros.
+
+        """
+
+        with open("notes.txt", "w") as file:
+            file.write("notes\n")
+
+        def script(interface, root, main_frame):
+            self.command(interface, "-rec m")
+            self.command(interface, "-q missing")
+            self.command(interface, "-ex ../outside.txt")
+            self.command(interface, "-gg")
+            self.command(interface, "-im -v notes.txt")
+            self.command(interface, "-end")
+            self.assertEqual(interface._Interface__item_container.macro("m"),
+                             ["-gg"])
+
+            session = interface._Interface__session
+            with self.assertRaises(null_core.CommandError):
+                session.run("-ex ../outside.txt")
+            with self.assertRaises(null_core.CommandError):
+                session.run("-im notes.md")
+
+        self.run_interface(script)
+
+    def test_import_list(self):
+        """A list is imported in chunks, and children imported under an
+        open parent are shown.
+
+        """
+
+        rows = ["name;parent;text", "p;;parent"]
+        rows += ["c{:d};p;child".format(number) for number in range(2500)]
+        with open("list.csv", "w") as file:
+            file.write("\n".join(rows) + "\n")
+
+        def script(interface, root, main_frame):
+            session = interface._Interface__session
+            session.add_item("p", "", "parent")
+            interface.open_parent("p")
+            rendered = []
+            render_tree = interface.render_tree
+            interface.render_tree = lambda *parents: (
+                rendered.extend(parents), render_tree(*parents))
+
+            self.command(interface, "-imlist list.csv")
+            root.run_jobs(interface.import_list_slice.__func__)
+            self.assertIn("p", rendered)
+            self.assertEqual(len(session.tree.children("p")), 2500)
+            self.assertEqual(rendered.count(""), 3)
+            self.assertEqual(interface._Interface__command_box.text,
+                             "ᴧ 2500 items imported, 1 skipped.")
+
+        self.run_interface(script)
+
+    def test_complete_quoted_names(self):
+        """Names with spaces are suggested and completed in quotes, and a
+        quoted name is completed.
+
+        """
+
+        def script(interface, root, main_frame):
+            session = interface._Interface__session
+            for name in ("my item", "my other", "plain"):
+                session.add_item(name, "", name)
+            box = interface._Interface__command_box
+
+            def type_line(line):
+                box.text = "ᴧ " + line
+                box.cursor = len(box.text)
+                box.selected = None
+                interface.suggest_name(types.SimpleNamespace(char=line[-1]))
+
+            type_line("-j my")
+            self.assertEqual(box.text, "ᴧ -j 'my item'")
+            self.assertEqual(box.selected, (len("ᴧ -j 'my"), len(box.text)))
+            interface.complete_name(None)
+            self.assertEqual(box.text, "ᴧ -j 'my item'")
+            interface.complete_name(None)
+            self.assertEqual(box.text, "ᴧ -j 'my other'")
+
+            type_line("-j my")
+            interface.drop_suggestion()
+            self.assertEqual(box.text, "ᴧ -j my")
+
+            type_line("-j 'my o")
+            interface.complete_name(None)
+            self.assertEqual(box.text, "ᴧ -j 'my other'")
+
+            type_line("-j plain:'my i")
+            interface.complete_name(None)
+            self.assertEqual(box.text, "ᴧ -j plain:'my item'")
+
+            box.text = "ᴧ -j pl"
+            box.cursor = len(box.text)
+            interface.drop_suggestion()
+            interface.complete_name(None)
+            self.assertEqual(box.text, "ᴧ -j plain")
+
+        self.run_interface(script)
+
+    def test_clear_while_pasting(self):
+        """Clearing the main frame stops a long paste.
+
+        """
+
+        def script(interface, root, main_frame):
+            interface.insert_text("x" * (self.editor.INSERT_CHUNK_SIZE * 2))
+            self.command(interface, "-gg")
+            root.run_jobs(None)
+            self.assertEqual(main_frame.text, "")
+            self.assertEqual(self.document(interface), "")
+            self.assertNotIn("paste", main_frame.marks)
+
+            interface.insert_text("pasted")
+            self.assertEqual(main_frame.text, "pasted")
+
+        self.run_interface(script)
+
+    def test_clear_while_importing(self):
+        """Clearing the main frame stops a file import.
+
+        """
+
+        with open("large.txt", "w") as file:
+            file.write("x" * (self.editor.INSERT_CHUNK_SIZE * 3))
+
+        def script(interface, root, main_frame):
+            self.command(interface, "-im large.txt")
+            root.run_jobs(None)
+            self.command(interface, "-gg")
+            root.run_jobs(interface.import_slice.__func__)
+            self.assertEqual(main_frame.text, "")
+            self.assertEqual(self.document(interface), "")
+
+        self.run_interface(script)
+
+
+if __name__ == "__main__":
+    unittest.main()